@@ -1,7 +1,14 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
+# Async under the ASGI deployment, as for the messaging read views
+conversation = (
+    views.aconversation_messages
+    if getattr(settings, "MESSAGING_ASYNC_VIEWS", False)
+    else views.conversation_messages
+)
+
 urlpatterns = [
-    # Add URL patterns for chats app here
-    # path('', views.index, name='chats-index'),
+    path("<int:message_pk>/", conversation, name="chats-conversation"),
 ]
@@ -1,20 +1,46 @@
-from django.shortcuts import render, get_object_or_404
-from django.views.decorators.cache import cache_page
+from django.http import Http404
+from django.shortcuts import render
 
+from messaging.archive import aget_archived_thread_tree, get_archived_thread_tree
 from messaging.models import Message
+from messaging.thread_cache import aget_thread_tree, get_thread_tree
 
 
-@cache_page(60)  # cache this view for 60 seconds
 def conversation_messages(request, message_pk):
-    """Display messages in a conversation (thread) — cached for 60s."""
-    root = get_object_or_404(Message, pk=message_pk)
-
-    # Efficiently fetch root and immediate replies (select_related/prefetch_related)
-    root = (
-        Message.objects.filter(pk=root.pk)
-        .select_related("sender", "receiver")
-        .prefetch_related("replies", "replies__sender")
-    ).first()
-
-    # Build a simple context — templates should render replies recursively
-    return render(request, "chats/conversation.html", {"root": root})
+    """Display messages in a conversation (thread) from the versioned thread cache.
+
+    The tree stays cached until a message in the thread changes; a miss
+    loads the whole thread with one query (see `Message.get_thread`).
+    Archived conversations are read from the archive tables.
+    """
+    message = Message.objects.only("pk", "thread_root_id").filter(pk=message_pk).first()
+    if message is not None:
+        tree = get_thread_tree(message)
+    else:
+        tree = get_archived_thread_tree(message_pk)
+        if tree is None:
+            raise Http404("No message matches the given query.")
+
+    # Templates should render tree["replies"] recursively
+    return render(
+        request, "chats/conversation.html", {"root": tree["message"], "tree": tree}
+    )
+
+
+async def aconversation_messages(request, message_pk):
+    """Async `conversation_messages`, for the ASGI deployment."""
+    message = (
+        await Message.objects.only("pk", "thread_root_id")
+        .filter(pk=message_pk)
+        .afirst()
+    )
+    if message is not None:
+        tree = await aget_thread_tree(message)
+    else:
+        tree = await aget_archived_thread_tree(message_pk)
+        if tree is None:
+            raise Http404("No message matches the given query.")
+
+    return render(
+        request, "chats/conversation.html", {"root": tree["message"], "tree": tree}
+    )
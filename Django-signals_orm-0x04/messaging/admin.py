@@ -1,11 +1,134 @@
+from django.conf import settings
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Count, IntegerField, OuterRef, QuerySet, Subquery
+from django.db.models.functions import Coalesce
+from django.utils.functional import cached_property
 
 from .models import Message, Notification
 from .models import MessageHistory
+from .search import get_backend as get_search_backend
+
+# Below this many rows an exact COUNT(*) is cheap enough
+DEFAULT_ESTIMATE_THRESHOLD = 100_000
+
+
+def estimated_row_count(model, using="default"):
+    """Return the database's row estimate for `model`'s table, or None.
+
+    MySQL and PostgreSQL keep an estimate in their catalogs that costs one
+    lookup instead of a full COUNT(*); other databases return None.
+    """
+    connection = connections[using]
+    table = model._meta.db_table
+    if connection.vendor == "mysql":
+        sql = (
+            "SELECT table_rows FROM information_schema.tables "
+            "WHERE table_schema = DATABASE() AND table_name = %s"
+        )
+    elif connection.vendor == "postgresql":
+        sql = "SELECT reltuples::bigint FROM pg_class WHERE relname = %s"
+    else:
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [table])
+        row = cursor.fetchone()
+    # PostgreSQL reports -1 for tables that were never analyzed
+    if row is None or row[0] is None or row[0] < 0:
+        return None
+    return int(row[0])
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator that uses the table's row estimate for large unfiltered lists.
+
+    Filtered or searched changelists, and tables below
+    ``MESSAGING_ADMIN_ESTIMATE_THRESHOLD`` rows, still get an exact count.
+    With an estimate the last page may come up short or empty.
+    """
+
+    @cached_property
+    def count(self):
+        qs = self.object_list
+        if isinstance(qs, QuerySet) and not qs.query.where:
+            estimate = estimated_row_count(qs.model, using=qs.db)
+            threshold = getattr(
+                settings,
+                "MESSAGING_ADMIN_ESTIMATE_THRESHOLD",
+                DEFAULT_ESTIMATE_THRESHOLD,
+            )
+            if estimate is not None and estimate >= threshold:
+                return estimate
+        return super().count
+
+
+def subquery_count(model, field):
+    """Count rows of `model` whose `field` points at the outer row.
+
+    A correlated subquery is only evaluated for the rows of the page, where
+    ``Count()`` over a join would group the whole table first.
+    """
+    counts = (
+        model.objects.filter(**{field: OuterRef("pk")})
+        .order_by()
+        .values(field)
+        .annotate(n=Count("pk"))
+        .values("n")
+    )
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+
+class ScalableAdminMixin:
+    """Keep changelists and change forms cheap on large messaging tables.
+
+    * `count_annotations` (name -> expression) are added in `get_queryset`,
+      so per-row counts cost no extra queries;
+    * the paginator uses the table's row estimate instead of COUNT(*) on big
+      unfiltered changelists, and the unfiltered total is never counted;
+    * user and message foreign keys use autocomplete/raw-id widgets instead
+      of dropdowns listing every row (declared on each admin).
+
+    Together with `list_select_related`, a changelist page costs the same
+    number of queries however many rows it shows.
+    """
+
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    count_annotations = {}
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        if self.count_annotations:
+            queryset = queryset.annotate(**self.count_annotations)
+        return queryset
+
+
+class FullTextSearchMixin:
+    """Add full-text matches on message content to the admin search.
+
+    `search_fields` stay for the cheap username lookups; the content itself
+    is matched through the search index instead of a ``LIKE '%term%'`` scan,
+    as a subquery of the changelist query.
+    `full_text_lookup` names the field holding the message id.
+    """
+
+    full_text_lookup = "pk"
+
+    def get_search_results(self, request, queryset, search_term):
+        base = queryset
+        queryset, may_have_duplicates = super().get_search_results(
+            request, queryset, search_term
+        )
+        if search_term:
+            queryset |= base.filter(
+                get_search_backend().match_filter(search_term, self.full_text_lookup)
+            )
+        return queryset, may_have_duplicates
 
 
 @admin.register(Message)
-class MessageAdmin(admin.ModelAdmin):
+class MessageAdmin(ScalableAdminMixin, FullTextSearchMixin, admin.ModelAdmin):
     list_display = (
         "id",
         "sender",
@@ -14,22 +137,40 @@ class MessageAdmin(admin.ModelAdmin):
         "parent_message",
         "reply_count",
     )
-    search_fields = ("sender__username", "receiver__username", "content")
+    # Message.__str__ shows both users
+    list_select_related = (
+        "sender",
+        "receiver",
+        "parent_message__sender",
+        "parent_message__receiver",
+    )
+    search_fields = ("sender__username", "receiver__username")
+    autocomplete_fields = ("sender", "receiver")
+    raw_id_fields = ("parent_message", "thread_root")
+    count_annotations = {"reply_count": subquery_count(Message, "parent_message")}
 
-    @admin.display(description="Replies")
+    @admin.display(description="Replies", ordering="reply_count")
     def reply_count(self, obj):
-        return obj.replies.count()
+        return obj.reply_count
 
 
 @admin.register(Notification)
-class NotificationAdmin(admin.ModelAdmin):
+class NotificationAdmin(ScalableAdminMixin, admin.ModelAdmin):
     list_display = ("id", "user", "message", "read", "created_at")
     list_filter = ("read", "created_at")
+    list_select_related = ("user", "message__sender", "message__receiver")
     search_fields = ("user__username",)
+    autocomplete_fields = ("user",)
+    raw_id_fields = ("message",)
 
 
 @admin.register(MessageHistory)
-class MessageHistoryAdmin(admin.ModelAdmin):
+class MessageHistoryAdmin(ScalableAdminMixin, FullTextSearchMixin, admin.ModelAdmin):
     list_display = ("id", "message", "edited_by", "edited_at")
-    search_fields = ("message__content",)
+    list_select_related = ("edited_by", "message__sender", "message__receiver")
+    search_fields = ("edited_by__username",)
+    full_text_lookup = "message_id"
+    autocomplete_fields = ("edited_by",)
+    raw_id_fields = ("message",)
+    fields = ("message", "edited_by", "old_content", "edited_at")
     readonly_fields = ("old_content", "edited_at")
@@ -0,0 +1,224 @@
+"""Time-based archival of cold threads into the archive tables.
+
+A thread is cold when none of its messages is newer than the cutoff
+(``MESSAGING_ARCHIVE_AFTER_DAYS``, default 365). Cold threads are moved -
+messages, notifications and history - into `ArchivedMessage`,
+`ArchivedNotification` and `ArchivedMessageHistory`, one batch per
+transaction. A batch holds at most `batch_size` threads and, unless a
+single thread is larger, at most `max_rows` messages; rows are copied and
+deleted in chunks, so no statement binds more than a few thousand ids.
+Rows keep their primary keys, and the live tables' AUTOINCREMENT counters
+never hand those ids out again, so an id found in the archive is never
+reused.
+
+Each batch commits on its own and eligibility is recomputed on every run,
+so an interrupted run is resumed by running it again. The live side is
+removed through `messaging.deletion.delete_messages`, which also updates
+the unread counters, the thread cache and the search index.
+
+`get_archived_thread_tree` (and its async version) serves the thread views
+when a message is no longer in the live table.
+"""
+
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Exists, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .deletion import delete_messages
+from .models import (
+    ArchivedMessage,
+    ArchivedMessageHistory,
+    ArchivedNotification,
+    Message,
+    MessageHistory,
+    Notification,
+)
+from .thread_cache import aget_thread_tree, get_thread_tree
+
+DEFAULT_ARCHIVE_AFTER_DAYS = 365
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_MAX_ROWS = 5000
+# Rows copied per INSERT and message ids deleted per statement
+_CHUNK_SIZE = 1000
+
+
+def archive_cutoff(days=None):
+    """Return the datetime before which threads count as cold."""
+    if days is None:
+        days = getattr(
+            settings, "MESSAGING_ARCHIVE_AFTER_DAYS", DEFAULT_ARCHIVE_AFTER_DAYS
+        )
+    return timezone.now() - timedelta(days=days)
+
+
+def cold_threads(cutoff):
+    """Return root messages whose whole thread is older than `cutoff`."""
+    recent_reply = Message.objects.filter(
+        thread_root=OuterRef("pk"), timestamp__gte=cutoff
+    )
+    return Message.objects.filter(
+        parent_message__isnull=True, timestamp__lt=cutoff
+    ).exclude(Exists(recent_reply))
+
+
+def _copy(model, archive_model, qs):
+    """Copy the rows of `qs` into `archive_model`; return the number copied."""
+    archive_fields = {f.attname for f in archive_model._meta.concrete_fields}
+    fields = [
+        f.attname for f in model._meta.concrete_fields if f.attname in archive_fields
+    ]
+    copied = 0
+    rows = []
+    for row in qs.order_by().values(*fields).iterator(chunk_size=_CHUNK_SIZE):
+        rows.append(archive_model(**row))
+        if len(rows) == _CHUNK_SIZE:
+            # Rows left by an earlier, interrupted attempt are already there
+            archive_model.objects.bulk_create(rows, ignore_conflicts=True)
+            copied += len(rows)
+            rows = []
+    archive_model.objects.bulk_create(rows, ignore_conflicts=True)
+    return copied + len(rows)
+
+
+def _pick_batch(cutoff, last_pk, batch_size, max_rows):
+    """Return the next cold roots after `last_pk`, up to `max_rows` messages."""
+    replies = (
+        Message.objects.filter(thread_root=OuterRef("pk"))
+        .order_by()
+        .values("thread_root")
+        .annotate(n=Count("pk"))
+        .values("n")
+    )
+    candidates = (
+        cold_threads(cutoff)
+        .filter(pk__gt=last_pk)
+        .order_by("pk")
+        .annotate(reply_count=Coalesce(Subquery(replies), 0))
+        .values_list("pk", "reply_count")[:batch_size]
+    )
+    root_pks, rows = [], 0
+    for pk, reply_count in candidates:
+        # A thread larger than max_rows still goes, alone
+        if root_pks and rows + reply_count + 1 > max_rows:
+            break
+        root_pks.append(pk)
+        rows += reply_count + 1
+    return root_pks
+
+
+def _archive_batch(root_pks, cutoff):
+    with transaction.atomic():
+        # Re-check under lock: a reply may have arrived since the batch was picked
+        root_pks = list(
+            cold_threads(cutoff)
+            .filter(pk__in=root_pks)
+            .select_for_update()
+            .values_list("pk", flat=True)
+        )
+        messages = Message.objects.filter(
+            Q(pk__in=root_pks) | Q(thread_root_id__in=root_pks)
+        )
+        stats = Counter(
+            threads=len(root_pks),
+            notifications=_copy(
+                Notification,
+                ArchivedNotification,
+                Notification.objects.filter(message_id__in=messages.values("pk")),
+            ),
+            history=_copy(
+                MessageHistory,
+                ArchivedMessageHistory,
+                MessageHistory.objects.filter(message_id__in=messages.values("pk")),
+            ),
+        )
+        stats["messages"] = _copy(Message, ArchivedMessage, messages)
+        # Deepest first, so no remaining message replies to a deleted one
+        message_ids = list(
+            messages.order_by("-depth", "pk").values_list("pk", flat=True)
+        )
+        for start in range(0, len(message_ids), _CHUNK_SIZE):
+            delete_messages(message_ids[start : start + _CHUNK_SIZE])
+    return stats
+
+
+def archive_threads(
+    cutoff=None, batch_size=None, max_batches=None, progress=None, max_rows=None
+):
+    """Move every cold thread into the archive tables, one transaction per batch.
+
+    `progress`, if given, is called as ``progress(stats)`` with the running
+    totals after every batch. Returns the ``threads``/``messages``/
+    ``notifications``/``history`` counts moved.
+    """
+    if cutoff is None:
+        cutoff = archive_cutoff()
+    if batch_size is None:
+        batch_size = DEFAULT_BATCH_SIZE
+    if max_rows is None:
+        max_rows = DEFAULT_MAX_ROWS
+    stats = Counter()
+    last_pk = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        root_pks = _pick_batch(cutoff, last_pk, batch_size, max_rows)
+        if not root_pks:
+            break
+        stats.update(_archive_batch(root_pks, cutoff))
+        last_pk = root_pks[-1]
+        batches += 1
+        if progress is not None:
+            progress(dict(stats))
+    return dict(stats)
+
+
+def _build_archived_tree(message):
+    replies = ArchivedMessage.objects.filter(thread_root_id=message.thread_root_pk)
+    if message.thread_root_id is not None:
+        replies = replies.filter(path__startswith=message.descendant_path)
+    messages = list(replies.select_related("sender", "receiver").order_by("path", "pk"))
+    message = ArchivedMessage.objects.select_related("sender", "receiver").get(
+        pk=message.pk
+    )
+    children = {}
+    for m in messages:
+        children.setdefault(m.parent_message_id, []).append(m)
+
+    def _gather(msg):
+        return {
+            "message": msg,
+            "replies": [_gather(r) for r in children.get(msg.pk, [])],
+        }
+
+    return _gather(message)
+
+
+def get_archived_thread_tree(pk):
+    """Return the nested tree of archived message `pk`, or None if not archived.
+
+    Same shape as `Message.get_thread`, served through the thread cache.
+    """
+    message = (
+        ArchivedMessage.objects.only("pk", "thread_root_id", "path")
+        .filter(pk=pk)
+        .first()
+    )
+    if message is None:
+        return None
+    return get_thread_tree(message, build=lambda: _build_archived_tree(message))
+
+
+async def aget_archived_thread_tree(pk):
+    """Async version of `get_archived_thread_tree`."""
+    message = (
+        await ArchivedMessage.objects.only("pk", "thread_root_id", "path")
+        .filter(pk=pk)
+        .afirst()
+    )
+    if message is None:
+        return None
+    return await aget_thread_tree(message, build=lambda: _build_archived_tree(message))
@@ -0,0 +1,110 @@
+"""Async versions of the read views, for the ASGI deployment.
+
+Same URLs, templates and queries as their counterparts in `messaging.views`,
+but the database and cache are reached through Django's async APIs
+(``afirst``, ``async for``, ``cache.aget``), so a request never holds a
+worker while it waits. `messaging.urls` routes to them when
+``MESSAGING_ASYNC_VIEWS`` is set, as it should be under `messaging_app.asgi`;
+under WSGI every async view would pay for an event loop per request.
+
+On Django 4.2 each query still runs on a thread behind ``sync_to_async``;
+`benchmark_concurrency` measures what the async stack buys in practice.
+"""
+
+import functools
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.views import redirect_to_login
+from django.http import Http404
+from django.shortcuts import render
+
+from .archive import aget_archived_thread_tree
+from .models import Message
+from .pagination import DEFAULT_PAGE_SIZE, InvalidCursor
+from .thread_cache import aget_thread_tree
+
+
+def alogin_required(view):
+    """`login_required` for async views (Django 4.2's only wraps sync views)."""
+
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        # Resolving the lazy user reads the session and user rows
+        if not await sync_to_async(lambda: request.user.is_authenticated)():
+            return redirect_to_login(request.get_full_path())
+        return await view(request, *args, **kwargs)
+
+    return wrapper
+
+
+async def _akeyset_page(request, queryset):
+    """Return the page of `queryset` selected by the ``cursor`` GET parameter."""
+    per_page = getattr(settings, "MESSAGING_PAGE_SIZE", DEFAULT_PAGE_SIZE)
+    try:
+        return await queryset.akeyset_page(request.GET.get("cursor"), per_page=per_page)
+    except InvalidCursor:
+        raise Http404("Invalid page cursor")
+
+
+@alogin_required
+async def thread_list(request):
+    """Async `messaging.views.thread_list`."""
+    page = await _akeyset_page(request, Message.fetch_thread_summaries())
+    return render(
+        request,
+        "messaging/thread_list.html",
+        {"roots": page.object_list, "page": page},
+    )
+
+
+@alogin_required
+async def thread_detail(request, pk):
+    """Async `messaging.views.thread_detail`."""
+    message = (
+        await Message.objects.only(
+            "pk", "thread_root_id", "path", "depth", "receiver_id", "read"
+        )
+        .filter(pk=pk)
+        .afirst()
+    )
+    if message is None:
+        tree = await aget_archived_thread_tree(pk)
+        if tree is None:
+            raise Http404("No message matches the given query.")
+        return render(
+            request,
+            "messaging/thread_detail.html",
+            {"tree": tree, "unread_ids": set(), "archived": True},
+        )
+    tree = await aget_thread_tree(message)
+
+    unread_ids = {
+        pk
+        async for pk in message.descendants()
+        .filter(receiver=request.user, read=False)
+        .values_list("pk", flat=True)
+    }
+    if message.receiver_id == request.user.pk and not message.read:
+        unread_ids.add(message.pk)
+    return render(
+        request,
+        "messaging/thread_detail.html",
+        {"tree": tree, "unread_ids": unread_ids},
+    )
+
+
+@alogin_required
+async def inbox(request):
+    """Async `messaging.views.inbox`."""
+    qs = (
+        Message.unread.unread_for_user(request.user)
+        .select_related("sender")
+        .only("id", "sender_id", "content", "timestamp")
+    )
+    page = await _akeyset_page(request, qs)
+    return render(
+        request,
+        "messaging/inbox.html",
+        {"messages": page.object_list, "page": page},
+    )
@@ -0,0 +1,102 @@
+"""Bulk (broadcast) message sending.
+
+`Message.objects.create` costs one INSERT for the message, one for its
+Notification and one counter UPDATE, all driven by per-row signals. A
+broadcast to many receivers instead inserts messages and notifications with
+batched `bulk_create` calls inside one transaction, producing the same rows
+(and full-text index entries and live events) the signal handlers would.
+"""
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+
+from .dispatch import coalesce_key, get_coalesce_mode, publish_notifications
+from .events import message_event, publish_on_commit
+from .models import Message, Notification, UnreadCounter
+from .search import get_backend as get_search_backend
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+def _bulk_create_messages(sender, receiver_ids, content):
+    """Insert one message per receiver and return them with primary keys set.
+
+    Backends that cannot return ids from a bulk INSERT (MySQL) get them
+    re-read with one query on the sender's rows above the previous max id.
+    """
+    messages = [
+        Message(sender=sender, receiver_id=receiver_id, content=content)
+        for receiver_id in receiver_ids
+    ]
+    if connection.features.can_return_rows_from_bulk_insert:
+        return Message.objects.bulk_create(messages)
+
+    max_pk_before = (
+        Message.objects.order_by("-pk").values_list("pk", flat=True).first() or 0
+    )
+    Message.objects.bulk_create(messages)
+    return [
+        Message(
+            pk=pk,
+            sender=sender,
+            receiver_id=receiver_id,
+            content=content,
+            timestamp=timestamp,
+        )
+        for pk, receiver_id, timestamp in Message.objects.filter(
+            pk__gt=max_pk_before, sender=sender, receiver_id__in=receiver_ids
+        ).values_list("pk", "receiver_id", "timestamp")
+    ]
+
+
+def broadcast_message(sender, receiver_ids, content, batch_size=None):
+    """Send `content` from `sender` to every user in `receiver_ids`.
+
+    Messages and their notifications are written with `bulk_create` in
+    batches of `batch_size` (default: ``MESSAGING_BROADCAST_BATCH_SIZE``)
+    inside a single transaction, and the receivers' unread counters are
+    bumped with one UPDATE per batch. Duplicate receiver ids are ignored.
+    Returns the number of messages created.
+    """
+    if batch_size is None:
+        batch_size = getattr(
+            settings, "MESSAGING_BROADCAST_BATCH_SIZE", DEFAULT_BATCH_SIZE
+        )
+    receiver_ids = list(dict.fromkeys(receiver_ids))
+
+    search_backend = get_search_backend()
+    coalesce_mode = get_coalesce_mode()
+    created = 0
+    with transaction.atomic():
+        for start in range(0, len(receiver_ids), batch_size):
+            batch_ids = receiver_ids[start : start + batch_size]
+            messages = _bulk_create_messages(sender, batch_ids, content)
+            # Same rows as create_notification_on_message would write
+            if coalesce_mode != "off":
+                inserted, updated = Notification.objects.upsert_coalesced(
+                    (
+                        m.receiver_id,
+                        coalesce_key(coalesce_mode, m.pk, sender.pk, None),
+                        m.pk,
+                    )
+                    for m in messages
+                )
+                publish_notifications(inserted + updated)
+                UnreadCounter.objects.filter(user_id__in=batch_ids).update(
+                    unread_messages=F("unread_messages") + 1
+                )
+            else:
+                notifications = Notification.objects.bulk_create(
+                    [Notification(user_id=m.receiver_id, message=m) for m in messages]
+                )
+                publish_notifications(notifications)
+                UnreadCounter.objects.filter(user_id__in=batch_ids).update(
+                    unread_messages=F("unread_messages") + 1,
+                    unread_notifications=F("unread_notifications") + 1,
+                )
+            if search_backend.maintains_index:
+                search_backend.index((m.pk, content) for m in messages)
+            publish_on_commit((m.receiver_id, message_event(m)) for m in messages)
+            created += len(messages)
+    return created
@@ -0,0 +1,239 @@
+"""Chunked, bounded-memory deletion of a user and their messaging data.
+
+`user.delete()` makes Django's collector load every related message, reply,
+notification and history row into memory before deleting anything. This
+module instead walks the user's data in fixed-size primary-key batches and
+removes it with raw DELETE statements in dependency order (notifications
+and history, then messages deepest-first), committing after every batch.
+Only one batch of ids is held in memory at a time.
+
+Raw deletes skip the per-row signals, so the unread counters of the
+affected receivers, the cached thread versions and the full-text index are
+updated here per batch.
+"""
+
+from collections import Counter
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Count, Q
+
+from .models import (
+    ArchivedMessage,
+    ArchivedMessageHistory,
+    ArchivedNotification,
+    Message,
+    MessageHistory,
+    Notification,
+    ThreadTree,
+    UnreadCounter,
+)
+from .search import get_backend as get_search_backend
+from .thread_cache import invalidate_threads
+
+DEFAULT_BATCH_SIZE = 500
+# Path-prefix conditions OR'ed into one subtree query
+_SUBTREES_PER_QUERY = 100
+
+
+def _raw_delete(qs):
+    return qs._raw_delete(qs.db)
+
+
+def _unread_per_user(qs, user_field):
+    return dict(
+        qs.filter(read=False).order_by().values_list(user_field).annotate(n=Count("pk"))
+    )
+
+
+def delete_messages(message_ids):
+    """Delete messages (and their notifications/history) in one transaction.
+
+    The caller guarantees no remaining message replies to one of them.
+    Messages are deleted deepest level first, so a reply never outlives its
+    parent inside the statement (MySQL checks foreign keys row by row).
+    Returns the number of messages deleted.
+    """
+    with transaction.atomic():
+        messages = Message.objects.filter(pk__in=message_ids)
+        notifications = Notification.objects.filter(message_id__in=message_ids)
+        unread_messages = _unread_per_user(messages, "receiver_id")
+        unread_notifications = _unread_per_user(notifications, "user_id")
+        roots = {
+            root_pk or pk
+            for root_pk, pk in messages.order_by().values_list("thread_root_id", "pk")
+        }
+        transaction.on_commit(lambda: invalidate_threads(roots))
+        # Stored trees of touched threads are rebuilt lazily on next read
+        _raw_delete(ThreadTree.objects.filter(root_id__in=roots))
+        for user_id in set(unread_messages) | set(unread_notifications):
+            UnreadCounter.objects.adjust(
+                user_id,
+                messages=-unread_messages.get(user_id, 0),
+                notifications=-unread_notifications.get(user_id, 0),
+            )
+        search_backend = get_search_backend()
+        if search_backend.maintains_index:
+            search_backend.remove(message_ids)
+        _raw_delete(notifications)
+        _raw_delete(MessageHistory.objects.filter(message_id__in=message_ids))
+        depths = messages.order_by("-depth").values_list("depth", flat=True).distinct()
+        return sum(_raw_delete(messages.filter(depth=depth)) for depth in list(depths))
+
+
+def _delete_archived(message_ids):
+    """Delete archived messages with their archived notifications and history."""
+    with transaction.atomic():
+        _raw_delete(ArchivedNotification.objects.filter(message_id__in=message_ids))
+        _raw_delete(ArchivedMessageHistory.objects.filter(message_id__in=message_ids))
+        return _raw_delete(ArchivedMessage.objects.filter(pk__in=message_ids))
+
+
+def _subtree_filters(messages):
+    """Yield Q objects matching every reply below the given messages."""
+    roots = [m.pk for m in messages if m.thread_root_id is None]
+    if roots:
+        yield Q(thread_root_id__in=roots)
+    replies = [m for m in messages if m.thread_root_id is not None]
+    for start in range(0, len(replies), _SUBTREES_PER_QUERY):
+        q = Q()
+        for m in replies[start : start + _SUBTREES_PER_QUERY]:
+            q |= Q(thread_root_id=m.thread_root_id, path__startswith=m.descendant_path)
+        yield q
+
+
+def _delete_history(entry_ids):
+    """Raw-delete history entries, keeping the delta chains of the rest intact.
+
+    An entry older than a deleted one may be a delta against it, so it is
+    rewritten as a full snapshot first (see `messaging.history`).
+    """
+    with transaction.atomic():
+        entries = MessageHistory.objects.filter(pk__in=entry_ids)
+        for entry in entries.only("pk", "message_id"):
+            older = (
+                MessageHistory.objects.filter(
+                    message_id=entry.message_id, pk__lt=entry.pk
+                )
+                .order_by("-pk")
+                .first()
+            )
+            if older is not None and older.delta is not None:
+                if older.pk not in entry_ids:
+                    content = older.old_content
+                    older.old_content = content
+                    older.save(update_fields=["snapshot", "delta"])
+        return _raw_delete(entries)
+
+
+def _delete_in_batches(qs, batch_size, delete=None):
+    """Raw-delete `qs` in primary-key batches; return the number of rows.
+
+    `delete(ids)`, if given, deletes one batch instead of a plain raw delete.
+    """
+    deleted = 0
+    while True:
+        ids = list(qs.order_by("pk").values_list("pk", flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        if delete is not None:
+            deleted += delete(ids)
+            continue
+        with transaction.atomic():
+            deleted += _raw_delete(qs.model.objects.filter(pk__in=ids))
+
+
+def delete_user_data(user_id, batch_size=None, progress=None):
+    """Delete a user and all of their messaging data in bounded batches.
+
+    Removes every message the user sent or received together with all
+    replies below them (matching the CASCADE on `parent_message`), their
+    notifications and history, the user's own notifications, the history
+    entries they authored and finally the user row itself. Archived threads
+    are removed the same way; archived history entries the user authored
+    only lose their author.
+
+    `progress`, if given, is called as ``progress(stage, total_so_far)``
+    after every batch. Returns a dict of row counts per stage.
+    """
+    if batch_size is None:
+        batch_size = getattr(
+            settings, "MESSAGING_DELETE_BATCH_SIZE", DEFAULT_BATCH_SIZE
+        )
+    stats = Counter()
+
+    def report(stage, count):
+        stats[stage] += count
+        if progress is not None:
+            progress(stage, stats[stage])
+
+    own_messages = Message.objects.filter(Q(sender_id=user_id) | Q(receiver_id=user_id))
+    while True:
+        batch = list(
+            own_messages.order_by("pk").only("pk", "thread_root_id", "path")[
+                :batch_size
+            ]
+        )
+        if not batch:
+            break
+        # Replies below the batch go first, deepest level first
+        for subtree in _subtree_filters(batch):
+            replies = Message.objects.filter(subtree)
+            while True:
+                ids = list(
+                    replies.order_by("-depth", "pk").values_list("pk", flat=True)[
+                        :batch_size
+                    ]
+                )
+                if not ids:
+                    break
+                report("messages", delete_messages(ids))
+        report("messages", delete_messages([m.pk for m in batch]))
+
+    # The archive holds whole threads, so subtrees go in the same batches
+    archived = ArchivedMessage.objects.filter(
+        Q(sender_id=user_id) | Q(receiver_id=user_id)
+    )
+    while True:
+        batch = list(
+            archived.order_by("pk").only("pk", "thread_root_id", "path")[:batch_size]
+        )
+        if not batch:
+            break
+        for subtree in _subtree_filters(batch):
+            report(
+                "archived",
+                _delete_in_batches(
+                    ArchivedMessage.objects.filter(subtree),
+                    batch_size,
+                    delete=_delete_archived,
+                ),
+            )
+        report("archived", _delete_archived([m.pk for m in batch]))
+    report(
+        "archived",
+        _delete_in_batches(
+            ArchivedNotification.objects.filter(user_id=user_id), batch_size
+        ),
+    )
+    ArchivedMessageHistory.objects.filter(edited_by_id=user_id).update(edited_by=None)
+
+    report(
+        "notifications",
+        _delete_in_batches(Notification.objects.filter(user_id=user_id), batch_size),
+    )
+    report(
+        "history",
+        _delete_in_batches(
+            MessageHistory.objects.filter(edited_by_id=user_id),
+            batch_size,
+            delete=_delete_history,
+        ),
+    )
+
+    with transaction.atomic():
+        _raw_delete(UnreadCounter.objects.filter(user_id=user_id))
+        deleted, _ = get_user_model().objects.filter(pk=user_id).delete()
+    report("users", 1 if deleted else 0)
+    return dict(stats)
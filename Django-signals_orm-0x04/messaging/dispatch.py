@@ -0,0 +1,208 @@
+"""Notification fan-out, inline or through a queued worker.
+
+`create_notification_on_message` hands every new message to
+`enqueue_notification`. What happens next depends on the
+``MESSAGING_NOTIFICATION_DISPATCH`` setting:
+
+* ``"sync"`` (default): the Notification is written inline, as before.
+* ``"eager"``: message ids are collected per transaction and delivered in
+  batches in-process once it commits. No broker needed (tests, local runs).
+* ``"celery"``: the same per-transaction batches are sent to the
+  `deliver_notifications_task` Celery task, off the request path.
+
+Delivery is at-least-once and idempotent: `deliver_notifications` skips
+messages that already have their Notification and the table has a unique
+(user, message) constraint, so a retried job cannot duplicate rows.
+
+With ``MESSAGING_NOTIFICATION_COALESCE`` set to ``"thread"`` or
+``"sender"``, a receiver keeps one unread notification per thread (or per
+sender) instead of one per message: new messages bump its `count` and move
+its `message` pointer in place (`NotificationManager.upsert_coalesced`).
+"""
+
+import weakref
+from collections import Counter
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+
+from .events import notification_event, publish_on_commit
+from .models import Message, Notification, UnreadCounter
+
+DISPATCH_MODES = ("sync", "eager", "celery")
+COALESCE_MODES = ("off", "thread", "sender")
+DEFAULT_BATCH_SIZE = 500
+
+
+def get_dispatch_mode():
+    mode = getattr(settings, "MESSAGING_NOTIFICATION_DISPATCH", "sync")
+    if mode not in DISPATCH_MODES:
+        raise ValueError(
+            f"MESSAGING_NOTIFICATION_DISPATCH must be one of {DISPATCH_MODES}, "
+            f"got {mode!r}"
+        )
+    return mode
+
+
+def get_coalesce_mode():
+    mode = getattr(settings, "MESSAGING_NOTIFICATION_COALESCE", "off")
+    if mode not in COALESCE_MODES:
+        raise ValueError(
+            f"MESSAGING_NOTIFICATION_COALESCE must be one of {COALESCE_MODES}, "
+            f"got {mode!r}"
+        )
+    return mode
+
+
+def coalesce_key(mode, message_id, sender_id, thread_root_id):
+    """Return the conversation key a message's notification is coalesced under."""
+    if mode == "thread":
+        return f"thread:{thread_root_id or message_id}"
+    return f"sender:{sender_id}"
+
+
+def publish_notifications(notifications):
+    """Push the notification events of `notifications` to their users on commit."""
+    publish_on_commit((n.user_id, notification_event(n)) for n in notifications)
+
+
+def _batch_size():
+    return getattr(settings, "MESSAGING_NOTIFICATION_BATCH_SIZE", DEFAULT_BATCH_SIZE)
+
+
+def deliver_notifications(message_ids):
+    """Create the missing Notification of each message in `message_ids`.
+
+    Safe to call repeatedly with the same ids: messages that already have
+    their notification (or no longer exist) are skipped, and unread
+    counters are only bumped for rows actually inserted. Returns the number
+    of notifications created (not counting coalesced updates).
+    """
+    created = 0
+    message_ids = list(message_ids)
+    batch_size = _batch_size()
+    mode = get_coalesce_mode()
+    for start in range(0, len(message_ids), batch_size):
+        batch = message_ids[start : start + batch_size]
+        with transaction.atomic():
+            delivered = set(
+                Notification.objects.filter(message_id__in=batch).values_list(
+                    "message_id", "user_id"
+                )
+            )
+            messages = [
+                row
+                for row in Message.objects.filter(pk__in=batch)
+                .order_by()
+                .values_list("pk", "receiver_id", "sender_id", "thread_root_id")
+                if row[:2] not in delivered
+            ]
+            if mode != "off":
+                inserted, updated = Notification.objects.upsert_coalesced(
+                    (receiver_id, coalesce_key(mode, pk, sender_id, root_id), pk)
+                    for pk, receiver_id, sender_id, root_id in messages
+                )
+                publish_notifications(inserted + updated)
+                created += len(inserted)
+                continue
+            new = [
+                Notification(user_id=receiver_id, message_id=pk)
+                for pk, receiver_id, _, _ in messages
+            ]
+            new = _insert_new(new)
+            publish_notifications(new)
+            per_user = Counter(n.user_id for n in new)
+            for user_id, count in per_user.items():
+                UnreadCounter.objects.adjust(user_id, notifications=count)
+        created += len(new)
+    return created
+
+
+def _insert_new(notifications):
+    """Insert `notifications`; return those actually inserted.
+
+    One INSERT, unless a concurrent delivery of the same messages inserted
+    some of them first (the unique (user, message) constraint). Then each
+    row is retried alone and the ones that conflict are dropped, so their
+    counters and events are left to the delivery that wrote them.
+    """
+    try:
+        with transaction.atomic():
+            return Notification.objects.bulk_create(notifications)
+    except IntegrityError:
+        pass
+    inserted = []
+    for notification in notifications:
+        try:
+            with transaction.atomic():
+                inserted += Notification.objects.bulk_create([notification])
+        except IntegrityError:
+            pass
+    return inserted
+
+
+def _send_to_worker(message_ids):
+    if get_dispatch_mode() == "celery":
+        from .tasks import deliver_notifications_task
+
+        batch_size = _batch_size()
+        for start in range(0, len(message_ids), batch_size):
+            deliver_notifications_task.delay(message_ids[start : start + batch_size])
+    else:
+        deliver_notifications(message_ids)
+
+
+class _PendingBatch:
+    """Message ids enqueued in the current transaction, flushed on commit.
+
+    `scheduled` is set when the flush hook is registered and cleared by the
+    flush. Nothing but Django's on_commit list holds the hook, so a
+    rolled-back transaction or savepoint, which discards its hooks, clears
+    the flag too.
+    """
+
+    def __init__(self):
+        self.message_ids = []
+        self._hook = None
+
+    @property
+    def scheduled(self):
+        return self._hook is not None and self._hook() is not None
+
+    def schedule(self):
+        hook = self.flush
+        self._hook = weakref.ref(hook)
+        # Runs immediately when not inside a transaction
+        transaction.on_commit(hook)
+
+    def flush(self):
+        self._hook = None
+        message_ids, self.message_ids = self.message_ids, []
+        if message_ids:
+            _send_to_worker(message_ids)
+
+
+def enqueue_notification(message):
+    """Create (``sync``) or queue the Notification for a newly created message."""
+    if get_dispatch_mode() == "sync":
+        mode = get_coalesce_mode()
+        if mode == "off":
+            Notification.objects.create(user_id=message.receiver_id, message=message)
+            return
+        key = coalesce_key(mode, message.pk, message.sender_id, message.thread_root_id)
+        inserted, updated = Notification.objects.upsert_coalesced(
+            [(message.receiver_id, key, message.pk)]
+        )
+        publish_notifications(inserted + updated)
+        return
+
+    connection = transaction.get_connection()
+    batch = getattr(connection, "_pending_notifications", None)
+    if batch is None:
+        batch = connection._pending_notifications = _PendingBatch()
+    if batch.scheduled:
+        batch.message_ids.append(message.pk)
+        return
+    # Ids left without a hook were queued in a rolled-back block
+    batch.message_ids = [message.pk]
+    batch.schedule()
@@ -0,0 +1,216 @@
+"""Live inbox events for server-sent event streams.
+
+The Message and Notification ``post_save`` signals (and the bulk write
+paths) hand each new row to `publish_on_commit`, which publishes a small
+JSON event to the receiving user once the transaction commits. The
+`inbox_stream` view subscribes the connected user and writes the events
+out as they arrive.
+
+The broker is chosen with ``MESSAGING_EVENT_BROKER`` (a dotted path):
+
+* `InProcessBroker` (default) fans events out inside one process. Writers
+  and streams must then be served by the same process.
+* `RedisBroker` publishes through Redis pub/sub, so events written by any
+  web or worker process reach streams held by any other. Each process keeps
+  one Redis subscription and fans out locally.
+
+Backpressure: every subscription buffers at most
+``MESSAGING_EVENTS_QUEUE_SIZE`` events. A stream that falls further behind
+(a slow client blocks its writes) has its buffer replaced by a single
+``resync`` event, telling the client to reload its inbox instead of
+replaying what it missed.
+"""
+
+import asyncio
+import json
+import logging
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BROKER = "messaging.events.InProcessBroker"
+DEFAULT_QUEUE_SIZE = 100
+RESYNC = {"type": "resync"}
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def message_event(message):
+    return {
+        "type": "message",
+        "id": message.pk,
+        "sender_id": message.sender_id,
+        "parent_id": message.parent_message_id,
+        "thread_id": message.thread_root_pk,
+        "content": message.content,
+        "timestamp": message.timestamp.isoformat() if message.timestamp else None,
+    }
+
+
+def notification_event(notification):
+    return {
+        "type": "notification",
+        "id": notification.pk,
+        "message_id": notification.message_id,
+        "count": notification.count,
+    }
+
+
+class Subscription:
+    """Events for one connected stream, buffered in a bounded asyncio queue.
+
+    Created on the event loop that consumes it; `deliver` may be called
+    from any thread.
+    """
+
+    def __init__(self, broker, user_id, maxsize):
+        self.broker = broker
+        self.user_id = user_id
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize)
+        self.dropped = 0
+
+    def _put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Too far behind to catch up event by event
+            while not self.queue.empty():
+                if self.queue.get_nowait() is not RESYNC:
+                    self.dropped += 1
+            self.dropped += 1
+            self.queue.put_nowait(RESYNC)
+
+    def deliver(self, event):
+        if not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self._put, event)
+
+    async def get(self, timeout=None):
+        """Return the next event; raise `asyncio.TimeoutError` after `timeout`."""
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class InProcessBroker:
+    """Publish events to the subscriptions of the current process."""
+
+    def __init__(self):
+        self.queue_size = getattr(
+            settings, "MESSAGING_EVENTS_QUEUE_SIZE", DEFAULT_QUEUE_SIZE
+        )
+        self._lock = threading.Lock()
+        self._subscriptions = defaultdict(set)
+
+    async def subscribe(self, user_id):
+        subscription = Subscription(self, user_id, self.queue_size)
+        with self._lock:
+            self._subscriptions[user_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.user_id]
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(s) for s in self._subscriptions.values())
+
+    def publish(self, user_id, event):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(user_id, ()))
+        for subscription in subscriptions:
+            subscription.deliver(event)
+
+
+class RedisBroker(InProcessBroker):
+    """Publish through Redis pub/sub; needs the `redis` package.
+
+    One pattern subscription per process, started with the first stream,
+    feeds the local subscriptions (``MESSAGING_EVENTS_REDIS_URL``).
+    """
+
+    channel_prefix = "messaging:events:"
+
+    def __init__(self):
+        import redis
+
+        super().__init__()
+        self.url = getattr(settings, "MESSAGING_EVENTS_REDIS_URL", None) or getattr(
+            settings, "CELERY_BROKER_URL"
+        )
+        self._client = redis.Redis.from_url(self.url)
+        self._listener = None
+
+    def publish(self, user_id, event):
+        self._client.publish(f"{self.channel_prefix}{user_id}", json.dumps(event))
+
+    async def subscribe(self, user_id):
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.ensure_future(self._listen())
+        return await super().subscribe(user_id)
+
+    async def _listen(self):
+        import redis.asyncio
+
+        client = redis.asyncio.Redis.from_url(self.url)
+        pubsub = client.pubsub()
+        await pubsub.psubscribe(f"{self.channel_prefix}*")
+        try:
+            async for item in pubsub.listen():
+                if item["type"] != "pmessage":
+                    continue
+                user_id = int(item["channel"].decode().rsplit(":", 1)[1])
+                super().publish(user_id, json.loads(item["data"]))
+        except Exception:
+            # The next subscribe starts a new listener
+            logger.exception("Redis event listener stopped")
+        finally:
+            await pubsub.reset()
+            await client.close()
+
+
+def get_broker():
+    """Return this process's broker (``MESSAGING_EVENT_BROKER``)."""
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            path = getattr(settings, "MESSAGING_EVENT_BROKER", DEFAULT_BROKER)
+            _broker = import_string(path)()
+        return _broker
+
+
+def reset_broker():
+    """Drop the broker so the next `get_broker` builds it from settings again."""
+    global _broker
+    with _broker_lock:
+        _broker = None
+
+
+def publish_on_commit(events):
+    """Publish ``(user_id, event)`` pairs once the current transaction commits."""
+    events = list(events)
+    if not events:
+        return
+
+    def publish():
+        broker = get_broker()
+        for user_id, event in events:
+            try:
+                broker.publish(user_id, event)
+            except Exception:
+                # Live events are best effort; never fail the write for them
+                logger.exception("Could not publish %s event", event["type"])
+
+    transaction.on_commit(publish)
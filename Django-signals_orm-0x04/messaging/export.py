@@ -0,0 +1,167 @@
+"""Streaming export of a user's messages, threads and edit history.
+
+Rows are read in primary-key order, `chunk_size` at a time, as plain
+``values()`` dicts and written out one line at a time, so memory use is
+bounded by the chunk size whatever the size of the export. Chunks are
+fetched by keyset (``pk > last``) rather than with a single
+``.iterator()`` query because MySQL's client buffers whole result sets.
+History entries are paged the same way, on ``(message_id, seq)``.
+"""
+
+import csv
+import json
+from itertools import groupby
+from operator import itemgetter
+
+from django.db.models import Exists, OuterRef, Q
+
+from .history import reconstruct
+from .models import Message, MessageHistory
+
+DEFAULT_CHUNK_SIZE = 2000
+FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+CSV_COLUMNS = [
+    "type",
+    "id",
+    "message_id",
+    "sender_id",
+    "receiver_id",
+    "parent_message_id",
+    "thread_root_id",
+    "depth",
+    "timestamp",
+    "edited",
+    "read",
+    "edited_by_id",
+    "content",
+]
+
+_MESSAGE_FIELDS = (
+    "id",
+    "sender_id",
+    "receiver_id",
+    "parent_message_id",
+    "thread_root_id",
+    "depth",
+    "timestamp",
+    "edited",
+    "read",
+    "content",
+)
+_HISTORY_FIELDS = (
+    "id",
+    "message_id",
+    "seq",
+    "edited_at",
+    "edited_by_id",
+    "snapshot",
+    "delta",
+    "target_hash",
+)
+
+
+def _iter_chunked(qs, fields, chunk_size):
+    last_pk = 0
+    while True:
+        rows = list(
+            qs.filter(pk__gt=last_pk).order_by("pk").values(*fields)[:chunk_size]
+        )
+        if not rows:
+            return
+        yield from rows
+        last_pk = rows[-1]["id"]
+
+
+def _iter_history(message_rows, chunk_size):
+    """Yield history records of the given messages, newest edit first per message.
+
+    Entries are read `chunk_size` at a time by keyset on ``(message_id,
+    seq)`` and their content rebuilt from the message's current content
+    (see `messaging.history`); the oldest content rebuilt so far carries
+    over to the next page.
+    """
+    contents = {row["id"]: row["content"] for row in message_rows}
+    entries = MessageHistory.objects.filter(message_id__in=contents).order_by(
+        "message_id", "-seq"
+    )
+    page = entries
+    while contents:
+        rows = list(page.values(*_HISTORY_FIELDS)[:chunk_size])
+        for message_id, group in groupby(rows, key=itemgetter("message_id")):
+            group = list(group)
+            for row, content in zip(group, reconstruct(contents[message_id], group)):
+                contents[message_id] = content
+                yield {
+                    "type": "history",
+                    "id": row["id"],
+                    "message_id": message_id,
+                    "timestamp": row["edited_at"],
+                    "edited_by_id": row["edited_by_id"],
+                    "content": content,
+                }
+        if len(rows) < chunk_size:
+            return
+        last = rows[-1]
+        page = entries.filter(
+            Q(message_id=last["message_id"], seq__lt=last["seq"])
+            | Q(message_id__gt=last["message_id"])
+        )
+
+
+def iter_user_records(user, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield one dict per message the user sent or received, then per history entry.
+
+    Messages carry their thread position (`parent_message_id`,
+    `thread_root_id`, `depth`); history entries cover every edit of those
+    messages, with the old content reconstructed.
+    """
+    messages = Message.objects.filter(Q(sender=user) | Q(receiver=user))
+    for row in _iter_chunked(messages, _MESSAGE_FIELDS, chunk_size):
+        row["type"] = "message"
+        row["message_id"] = row["id"]
+        yield row
+
+    edited = messages.filter(
+        Exists(MessageHistory.objects.filter(message=OuterRef("pk")))
+    )
+    chunk = []
+    for row in _iter_chunked(edited, ("id", "content"), chunk_size):
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            yield from _iter_history(chunk, chunk_size)
+            chunk = []
+    yield from _iter_history(chunk, chunk_size)
+
+
+def _iter_ndjson(records):
+    for record in records:
+        record["timestamp"] = record["timestamp"].isoformat()
+        yield json.dumps(record, ensure_ascii=False) + "\n"
+
+
+class _Echo:
+    """File-like object whose write() returns the line instead of storing it."""
+
+    def write(self, value):
+        return value
+
+
+def _iter_csv(records):
+    writer = csv.DictWriter(_Echo(), fieldnames=CSV_COLUMNS)
+    yield writer.writeheader()
+    for record in records:
+        record["timestamp"] = record["timestamp"].isoformat()
+        yield writer.writerow(record)
+
+
+def iter_export(user, fmt="ndjson", chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield the export of `user` as lines of text in `fmt` (ndjson or csv)."""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format {fmt!r}; use one of {list(FORMATS)}")
+    records = iter_user_records(user, chunk_size=chunk_size)
+    if fmt == "csv":
+        return _iter_csv(records)
+    return _iter_ndjson(records)
@@ -0,0 +1,126 @@
+"""Delta encoding of message edit history.
+
+A `MessageHistory` entry stores the content a message had before an edit.
+Instead of the full text, most entries keep a reverse delta: the operations
+that rebuild the old version from the next newer one (the next entry, or
+the message's current content for the newest entry). Every
+``MESSAGING_HISTORY_SNAPSHOT_INTERVAL``-th entry of a message, and any entry
+whose delta would not be smaller than the text itself, keeps a full
+snapshot instead, so reconstructing a version applies at most that many
+deltas.
+
+A delta is a JSON list whose items are either ``[start, end]`` (copy
+``newer[start:end]``) or a string (insert it literally). It is stored with
+`content_hash` of the version it applies to: content written without
+`Message.save` (``QuerySet.update`` and the like) leaves no history entry,
+so the newer version found at read time may not be that one. Such a delta
+is not applied; the entry falls back to the nearest snapshot instead.
+"""
+
+import hashlib
+import json
+import re
+from difflib import SequenceMatcher
+
+from django.conf import settings
+
+DEFAULT_SNAPSHOT_INTERVAL = 10
+
+# Words, runs of whitespace and runs of punctuation: diffing tokens instead
+# of characters keeps SequenceMatcher fast on long messages.
+_TOKEN = re.compile(r"\w+|\s+|[^\w\s]+")
+
+
+def snapshot_interval():
+    return getattr(
+        settings, "MESSAGING_HISTORY_SNAPSHOT_INTERVAL", DEFAULT_SNAPSHOT_INTERVAL
+    )
+
+
+def make_delta(newer, older):
+    """Return the delta that rebuilds `older` from `newer`."""
+    newer_tokens = _TOKEN.findall(newer)
+    older_tokens = _TOKEN.findall(older)
+    offsets = [0]
+    for token in newer_tokens:
+        offsets.append(offsets[-1] + len(token))
+
+    delta = []
+    matcher = SequenceMatcher(None, newer_tokens, older_tokens)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            delta.append([offsets[i1], offsets[i2]])
+        elif j2 > j1:
+            delta.append("".join(older_tokens[j1:j2]))
+    return delta
+
+
+def content_hash(text):
+    """Return the short hash stored with a delta to check the version it applies to."""
+    return hashlib.blake2b(text.encode(), digest_size=8).hexdigest()
+
+
+def fits(newer, target_hash):
+    """Whether `newer` is the version a delta stored with `target_hash` applies to.
+
+    Entries written before hashes were stored have none and are trusted.
+    """
+    return not target_hash or content_hash(newer) == target_hash
+
+
+def apply_delta(newer, delta):
+    """Rebuild the older version from `newer` and its `delta`."""
+    return "".join(newer[op[0] : op[1]] if isinstance(op, list) else op for op in delta)
+
+
+def encode(older, newer, seq):
+    """Return ``(snapshot, delta)`` to store for the `seq`-th edit of a message.
+
+    `older` is the content before the edit, `newer` the content after it.
+    """
+    if seq % snapshot_interval() == 0:
+        return older, None
+    delta = make_delta(newer, older)
+    if len(json.dumps(delta)) >= len(older):
+        return older, None
+    return "", delta
+
+
+def reconstruct(current, entries):
+    """Yield the old content of each entry, newest first.
+
+    `entries` are the consecutive history entries of one message, newest
+    first, as objects or dicts with ``snapshot``, ``delta`` and
+    ``target_hash``. `current` is the content the newest of them was diffed
+    against; it is not needed when that entry is a snapshot. An entry whose
+    delta does not fit the newer version gets the nearest snapshot among
+    `entries`, older ones first.
+    """
+    entries = [
+        (
+            entry
+            if isinstance(entry, dict)
+            else {
+                "snapshot": entry.snapshot,
+                "delta": entry.delta,
+                "target_hash": entry.target_hash,
+            }
+        )
+        for entry in entries
+    ]
+    content = current
+    for i, entry in enumerate(entries):
+        if entry["delta"] is None:
+            content = entry["snapshot"]
+        elif content is not None and fits(content, entry.get("target_hash")):
+            content = apply_delta(content, entry["delta"])
+        else:
+            content = _nearest_snapshot(entries, i, content)
+        yield content
+
+
+def _nearest_snapshot(entries, i, default):
+    for entry in [*entries[i + 1 :], *reversed(entries[:i])]:
+        if entry["delta"] is None:
+            return entry["snapshot"]
+    return default
@@ -0,0 +1,66 @@
+from django.core.management.base import BaseCommand
+
+from messaging.archive import (
+    DEFAULT_BATCH_SIZE,
+    DEFAULT_MAX_ROWS,
+    archive_cutoff,
+    archive_threads,
+)
+
+
+class Command(BaseCommand):
+    """Move cold threads, with their notifications and history, to the archive.
+
+    Safe to re-run after an interruption: every batch of threads commits on
+    its own and the next run picks up the threads that are still cold.
+    """
+
+    help = "Archive threads with no message newer than the configured age."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--older-than-days",
+            type=int,
+            default=None,
+            help="Age in days (default: MESSAGING_ARCHIVE_AFTER_DAYS or 365).",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=DEFAULT_BATCH_SIZE,
+            help=f"Threads moved per transaction (default: {DEFAULT_BATCH_SIZE}).",
+        )
+        parser.add_argument(
+            "--max-rows",
+            type=int,
+            default=DEFAULT_MAX_ROWS,
+            help="Messages moved per transaction, unless one thread is larger "
+            f"(default: {DEFAULT_MAX_ROWS}).",
+        )
+        parser.add_argument(
+            "--max-batches",
+            type=int,
+            default=None,
+            help="Stop after this many batches; run again to continue.",
+        )
+
+    def handle(self, *args, **options):
+        cutoff = archive_cutoff(options["older_than_days"])
+
+        def progress(stats):
+            self.stdout.write(
+                f"{stats['threads']} threads, {stats['messages']} messages archived"
+            )
+
+        stats = archive_threads(
+            cutoff,
+            batch_size=options["batch_size"],
+            max_rows=options["max_rows"],
+            max_batches=options["max_batches"],
+            progress=progress,
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Archived threads older than {cutoff:%Y-%m-%d}: {stats}"
+            )
+        )
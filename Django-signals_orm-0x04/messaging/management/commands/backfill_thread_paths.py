@@ -0,0 +1,69 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from messaging.models import Message
+
+
+class Command(BaseCommand):
+    """Recompute `thread_root`, `path` and `depth` for existing messages.
+
+    Threads are walked level by level starting from the root messages, so
+    every parent is positioned before its replies. Only the ids of the
+    current level are kept in memory and rows are written with `bulk_update`.
+    """
+
+    help = "Backfill the materialized thread path of existing messages."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of parent messages processed per batch (default: 1000).",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+
+        with transaction.atomic():
+            updated = Message.objects.filter(parent_message__isnull=True).update(
+                thread_root=None, path="", depth=0
+            )
+        frontier = list(
+            Message.objects.filter(parent_message__isnull=True)
+            .order_by("pk")
+            .values_list("pk", flat=True)
+        )
+        self.stdout.write(f"Level 0: {updated} root messages")
+
+        level = 0
+        while frontier:
+            level += 1
+            next_frontier = []
+            for start in range(0, len(frontier), batch_size):
+                parent_ids = frontier[start : start + batch_size]
+                parents = {
+                    p.pk: p
+                    for p in Message.objects.filter(pk__in=parent_ids).only(
+                        "pk", "thread_root_id", "path", "depth"
+                    )
+                }
+                children = list(
+                    Message.objects.filter(parent_message_id__in=parent_ids).only(
+                        "pk", "parent_message_id"
+                    )
+                )
+                for child in children:
+                    child.assign_thread_position(parents[child.parent_message_id])
+                with transaction.atomic():
+                    Message.objects.bulk_update(
+                        children,
+                        ["thread_root", "path", "depth"],
+                        batch_size=batch_size,
+                    )
+                next_frontier.extend(c.pk for c in children)
+            if next_frontier:
+                self.stdout.write(f"Level {level}: {len(next_frontier)} replies")
+            frontier = next_frontier
+
+        self.stdout.write(self.style.SUCCESS("Thread paths backfilled."))
@@ -0,0 +1,100 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from messaging.broadcast import broadcast_message
+from messaging.models import Message, UnreadCounter
+
+
+class _Rollback(Exception):
+    """Raised to discard the benchmark data once a run is measured."""
+
+
+class _QueryCounter:
+    """`connection.execute_wrapper` hook counting executed statements."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    """Compare broadcast_message with one Message.objects.create per receiver.
+
+    Each path runs in its own transaction that is rolled back afterwards,
+    so the benchmark leaves no rows behind.
+    """
+
+    help = "Benchmark bulk broadcast sending against the per-row signal path."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--receivers",
+            type=int,
+            default=2000,
+            help="Number of receiving users to create (default: 2000).",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=None,
+            help="broadcast_message batch size (default: setting or 1000).",
+        )
+
+    def _measure(self, label, receivers, send):
+        user_model = get_user_model()
+        try:
+            with transaction.atomic():
+                sender = user_model.objects.create(username="benchmark-sender")
+                user_model.objects.bulk_create(
+                    user_model(username=f"benchmark-receiver-{i}")
+                    for i in range(receivers)
+                )
+                receiver_ids = list(
+                    user_model.objects.filter(
+                        username__startswith="benchmark-receiver-"
+                    ).values_list("pk", flat=True)
+                )
+                # bulk_create skips the post_save hook that creates counters
+                UnreadCounter.objects.bulk_create(
+                    UnreadCounter(user_id=pk) for pk in receiver_ids
+                )
+                queries = _QueryCounter()
+                with connection.execute_wrapper(queries):
+                    started = time.perf_counter()
+                    send(sender, receiver_ids)
+                    elapsed = time.perf_counter() - started
+                raise _Rollback
+        except _Rollback:
+            pass
+        self.stdout.write(
+            f"{label:<10} {receivers:>8} msgs  {elapsed:8.3f}s  "
+            f"{receivers / elapsed:10.0f} msgs/s  {queries.count:>7} queries"
+        )
+        return elapsed
+
+    def handle(self, *args, **options):
+        receivers = options["receivers"]
+        batch_size = options["batch_size"]
+
+        def per_row(sender, receiver_ids):
+            for receiver_id in receiver_ids:
+                Message.objects.create(
+                    sender=sender, receiver_id=receiver_id, content="Announcement"
+                )
+
+        def bulk(sender, receiver_ids):
+            broadcast_message(
+                sender, receiver_ids, "Announcement", batch_size=batch_size
+            )
+
+        per_row_time = self._measure("per-row", receivers, per_row)
+        bulk_time = self._measure("broadcast", receivers, bulk)
+        self.stdout.write(
+            self.style.SUCCESS(f"broadcast speedup: {per_row_time / bulk_time:.1f}x")
+        )
@@ -0,0 +1,374 @@
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth import get_user_model
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.db.models import Count
+from django.test import override_settings
+from django.urls import reverse
+
+from messaging.models import Message
+
+MODES = ("wsgi", "asgi")
+HOST = "testserver"
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def _manage_command():
+    """Return the command line that started this process, up to the subcommand."""
+    spec = getattr(sys.modules["__main__"], "__spec__", None)
+    if spec is not None:
+        # python -m django
+        return [sys.executable, "-m", spec.name.removesuffix(".__main__")]
+    return [sys.executable, sys.argv[0]]
+
+
+class _LatencyInjector:
+    """`execute_wrapper` hook sleeping before each statement, like a network hop."""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+    def __call__(self, execute, sql, params, many, context):
+        time.sleep(self.seconds)
+        return execute(sql, params, many, context)
+
+
+class _ThreadSampler(threading.Thread):
+    """Record the peak number of live threads while a run is in progress."""
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.peak = threading.active_count()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(0.01):
+            self.peak = max(self.peak, threading.active_count())
+
+
+class Command(BaseCommand):
+    """Compare the sync WSGI stack with the async ASGI stack under concurrency.
+
+    The read views (inbox, thread list, thread detail, conversation) are
+    requested by `--concurrency` closed-loop clients against the existing
+    data of the configured database; seed it first with
+    ``seed_messaging_data``. Each mode runs in its own process:
+
+    * ``wsgi``: Django's WSGI handler with the sync views, served by a pool
+      of `--workers` threads like a threaded gunicorn; requests queue for a
+      free worker.
+    * ``asgi``: Django's ASGI handler with ``MESSAGING_ASYNC_VIEWS`` on,
+      every request a coroutine on one event loop.
+
+    Handlers are called in-process without an HTTP server, so the numbers
+    compare the application stacks, not gunicorn against uvicorn.
+    ``--db-latency`` adds a sleep before every statement to stand in for
+    the round trip to a networked database.
+    """
+
+    help = "Benchmark sync-WSGI against async-ASGI throughput and p99 latency."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=100,
+            help="Concurrent clients (default: 100).",
+        )
+        parser.add_argument(
+            "--requests",
+            type=int,
+            default=2000,
+            help="Requests per mode (default: 2000).",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=8,
+            help="WSGI worker threads (default: 8).",
+        )
+        parser.add_argument(
+            "--db-latency",
+            type=float,
+            default=0.0,
+            help="Milliseconds added to every SQL statement (default: 0).",
+        )
+        parser.add_argument(
+            "--users",
+            type=int,
+            default=20,
+            help="Distinct logged-in users the clients rotate through (default: 20).",
+        )
+        parser.add_argument(
+            "--modes",
+            default=",".join(MODES),
+            help="Comma-separated modes to run (default: wsgi,asgi).",
+        )
+        parser.add_argument(
+            "--output",
+            default=None,
+            help="Write the JSON results to this file.",
+        )
+        # Internal: run a single mode in this process
+        parser.add_argument("--run-mode", choices=MODES, help="")
+
+    def handle(self, *args, **options):
+        if options["run_mode"]:
+            results = self._run_mode(options["run_mode"], options)
+            self.stdout.write(json.dumps(results))
+            return
+
+        modes = [m.strip() for m in options["modes"].split(",") if m.strip()]
+        unknown = set(modes) - set(MODES)
+        if unknown:
+            raise CommandError(f"Unknown modes: {sorted(unknown)}")
+        if connection.vendor == "sqlite" and connection.settings_dict["NAME"] in (
+            ":memory:",
+            "",
+        ):
+            raise CommandError("An in-memory database cannot be shared; use a file.")
+
+        results = {
+            "concurrency": options["concurrency"],
+            "requests": options["requests"],
+            "workers": options["workers"],
+            "db_latency_ms": options["db_latency"],
+            "vendor": connection.vendor,
+            "modes": {},
+        }
+        for mode in modes:
+            results["modes"][mode] = self._spawn(mode, options)
+
+        self.stdout.write(
+            f"{'mode':<6} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9} "
+            f"{'max ms':>9} {'errors':>7} {'threads':>8}"
+        )
+        for mode, r in results["modes"].items():
+            latency = r["latency_ms"]
+            self.stdout.write(
+                f"{mode:<6} {r['throughput_rps']:>9.1f} {latency['p50']:>9.2f} "
+                f"{latency['p99']:>9.2f} {latency['max']:>9.2f} "
+                f"{sum(r['errors'].values()):>7} "
+                f"{r['peak_threads']:>8}"
+            )
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump(results, f, indent=2)
+
+    def _spawn(self, mode, options):
+        # A fresh process per mode: URLconfs are fixed at import time
+        env = dict(os.environ, MESSAGING_ASYNC_VIEWS=str(mode == "asgi"))
+        args = [*_manage_command(), "benchmark_concurrency", "--run-mode", mode]
+        for name in ("concurrency", "requests", "workers", "db_latency", "users"):
+            args += [f"--{name.replace('_', '-')}", str(options[name])]
+        try:
+            completed = subprocess.run(
+                args, env=env, capture_output=True, text=True, check=True
+            )
+        except subprocess.CalledProcessError as exc:
+            raise CommandError(f"{mode} run failed:\n{exc.stderr}") from exc
+        return json.loads(completed.stdout.strip().splitlines()[-1])
+
+    def _targets(self, user_count):
+        """Return the paths to request and sessions of the users to request them as."""
+        user_ids = list(
+            Message.objects.order_by()
+            .values("receiver_id")
+            .annotate(n=Count("pk"))
+            .order_by("-n", "receiver_id")
+            .values_list("receiver_id", flat=True)[:user_count]
+        )
+        # An even spread of threads, small and large
+        roots = list(
+            Message.objects.filter(parent_message__isnull=True)
+            .order_by("pk")
+            .values_list("pk", flat=True)
+        )
+        threads = roots[:: max(1, len(roots) // user_count)][:user_count]
+        if not user_ids or not threads:
+            raise CommandError("No messages; run seed_messaging_data first.")
+
+        paths = [reverse("messaging-inbox"), reverse("messaging-thread-list")]
+        for pk in threads:
+            paths.append(reverse("messaging-thread-detail", kwargs={"pk": pk}))
+            paths.append(reverse("chats-conversation", kwargs={"message_pk": pk}))
+
+        sessions = []
+        for user in get_user_model().objects.filter(pk__in=user_ids):
+            session = SessionStore()
+            session[SESSION_KEY] = str(user.pk)
+            session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+            session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+            session.save()
+            sessions.append(session)
+        return paths, sessions
+
+    def _run_mode(self, mode, options):
+        if options["db_latency"]:
+            injector = _LatencyInjector(options["db_latency"] / 1000)
+
+            def add_latency(sender, connection, **kwargs):
+                connection.execute_wrappers.append(injector)
+
+            connection_created.connect(add_latency, weak=False)
+
+        hosts = [*settings.ALLOWED_HOSTS, HOST]
+        with override_settings(DEBUG=False, ALLOWED_HOSTS=hosts):
+            paths, sessions = self._targets(options["users"])
+            cookie_name = settings.SESSION_COOKIE_NAME
+            cookies = [f"{cookie_name}={s.session_key}" for s in sessions]
+            # Requests open their own connections
+            connection.close()
+            plan = [
+                (paths[i % len(paths)], cookies[i % len(cookies)])
+                for i in range(options["requests"])
+            ]
+            sampler = _ThreadSampler()
+            sampler.start()
+            try:
+                started = time.perf_counter()
+                latencies, errors = self._run(mode, plan, options)
+                elapsed = time.perf_counter() - started
+            finally:
+                sampler.stopped.set()
+                sampler.join()
+                for session in sessions:
+                    session.delete()
+
+        latencies_ms = [t * 1000 for t in latencies]
+        return {
+            "mode": mode,
+            "requests": len(latencies),
+            "errors": errors,
+            "elapsed_s": round(elapsed, 3),
+            "throughput_rps": round(len(latencies) / elapsed, 1),
+            "latency_ms": {
+                "p50": round(statistics.median(latencies_ms), 3),
+                "p90": round(_percentile(latencies_ms, 0.90), 3),
+                "p99": round(_percentile(latencies_ms, 0.99), 3),
+                "max": round(max(latencies_ms), 3),
+            },
+            "peak_threads": sampler.peak,
+        }
+
+    def _wsgi_requester(self, options):
+        from django.core.handlers.wsgi import WSGIHandler
+
+        handler = WSGIHandler()
+        pool = ThreadPoolExecutor(options["workers"])
+
+        def request(path, cookie):
+            environ = {
+                "REQUEST_METHOD": "GET",
+                "PATH_INFO": path,
+                "SCRIPT_NAME": "",
+                "QUERY_STRING": "",
+                "SERVER_NAME": HOST,
+                "SERVER_PORT": "80",
+                "SERVER_PROTOCOL": "HTTP/1.1",
+                "HTTP_HOST": HOST,
+                "HTTP_COOKIE": cookie,
+                "wsgi.input": BytesIO(),
+                "wsgi.errors": sys.stderr,
+                "wsgi.url_scheme": "http",
+            }
+            status = []
+            body = handler(environ, lambda s, headers: status.append(s))
+            try:
+                b"".join(body)
+            finally:
+                if hasattr(body, "close"):
+                    body.close()
+            return int(status[0].split()[0])
+
+        async def arequest(path, cookie):
+            # Waiting for a free worker counts towards the latency
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(pool, request, path, cookie)
+
+        return arequest, pool.shutdown
+
+    def _asgi_requester(self, options):
+        from django.core.handlers.asgi import ASGIHandler
+
+        handler = ASGIHandler()
+
+        async def arequest(path, cookie):
+            scope = {
+                "type": "http",
+                "asgi": {"version": "3.0"},
+                "http_version": "1.1",
+                "method": "GET",
+                "scheme": "http",
+                "path": path,
+                "raw_path": path.encode(),
+                "root_path": "",
+                "query_string": b"",
+                "headers": [(b"host", HOST.encode()), (b"cookie", cookie.encode())],
+                "server": (HOST, 80),
+                "client": ("127.0.0.1", 0),
+            }
+            messages = [{"type": "http.request", "body": b"", "more_body": False}]
+            status = []
+
+            async def receive():
+                if messages:
+                    return messages.pop()
+                # The client never disconnects early
+                await asyncio.Event().wait()
+
+            async def send(message):
+                if message["type"] == "http.response.start":
+                    status.append(message["status"])
+
+            await handler(scope, receive, send)
+            return status[0]
+
+        return arequest, lambda: None
+
+    def _run(self, mode, plan, options):
+        """Issue `plan` from `--concurrency` closed-loop client coroutines."""
+        if mode == "wsgi":
+            arequest, shutdown = self._wsgi_requester(options)
+        else:
+            arequest, shutdown = self._asgi_requester(options)
+        latencies, errors = [], Counter()
+
+        async def client(requests):
+            for path, cookie in requests:
+                started = time.perf_counter()
+                code = await arequest(path, cookie)
+                latencies.append(time.perf_counter() - started)
+                if code != 200:
+                    errors[code] += 1
+
+        async def main():
+            concurrency = options["concurrency"]
+            await asyncio.gather(
+                *(client(plan[i::concurrency]) for i in range(concurrency))
+            )
+
+        try:
+            asyncio.run(main())
+        finally:
+            shutdown()
+        return latencies, dict(errors)
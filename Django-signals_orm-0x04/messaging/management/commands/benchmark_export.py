@@ -0,0 +1,88 @@
+import resource
+import time
+import tracemalloc
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from messaging.export import DEFAULT_CHUNK_SIZE, iter_export
+from messaging.models import Message
+
+
+class _Rollback(Exception):
+    """Raised to discard the benchmark data once the export is measured."""
+
+
+class Command(BaseCommand):
+    """Check that the streaming export runs in bounded memory.
+
+    Generates a synthetic mailbox inside a transaction that is rolled back,
+    streams its export to nowhere and fails if the peak Python heap
+    allocated while exporting exceeds ``--max-peak-mb``. The growth of the
+    process's peak RSS is reported alongside.
+    """
+
+    help = "Benchmark the streaming export and assert its peak memory stays bounded."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--messages",
+            type=int,
+            default=100_000,
+            help="Messages in the synthetic mailbox (default: 100000).",
+        )
+        parser.add_argument("--format", choices=["ndjson", "csv"], default="ndjson")
+        parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+        parser.add_argument(
+            "--max-peak-mb",
+            type=float,
+            default=32.0,
+            help="Fail when the export's peak heap exceeds this (default: 32).",
+        )
+
+    def handle(self, *args, **options):
+        user_model = get_user_model()
+        total = options["messages"]
+        try:
+            with transaction.atomic():
+                user = user_model.objects.create(username="benchmark-export-user")
+                peer = user_model.objects.create(username="benchmark-export-peer")
+                for start in range(0, total, 5000):
+                    Message.objects.bulk_create(
+                        Message(
+                            sender=user if i % 2 else peer,
+                            receiver=peer if i % 2 else user,
+                            content=f"Synthetic message {i} " + "x" * 200,
+                        )
+                        for i in range(start, min(start + 5000, total))
+                    )
+
+                rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                tracemalloc.start()
+                started = time.perf_counter()
+                size = 0
+                for line in iter_export(
+                    user, options["format"], chunk_size=options["chunk_size"]
+                ):
+                    size += len(line)
+                elapsed = time.perf_counter() - started
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                raise _Rollback
+        except _Rollback:
+            pass
+
+        peak_mb = peak / 2**20
+        self.stdout.write(
+            f"{total} messages, {size / 2**20:.1f} MiB {options['format']} "
+            f"in {elapsed:.2f}s; peak heap {peak_mb:.1f} MiB, "
+            f"peak RSS growth {(rss_after - rss_before) / 1024:.1f} MiB"
+        )
+        if peak_mb > options["max_peak_mb"]:
+            raise CommandError(
+                f"Export peak heap {peak_mb:.1f} MiB exceeds "
+                f"{options['max_peak_mb']} MiB"
+            )
+        self.stdout.write(self.style.SUCCESS("Export memory stayed bounded."))
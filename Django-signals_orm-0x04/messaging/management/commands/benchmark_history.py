@@ -0,0 +1,103 @@
+import json
+import random
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from messaging.models import Message, MessageHistory
+
+
+class _Rollback(Exception):
+    """Raised to discard the benchmark data once it is measured."""
+
+
+def _edit(rng, content):
+    """Return `content` with one small edit: a word replaced or a sentence added."""
+    words = content.split(" ")
+    if rng.random() < 0.7:
+        words[rng.randrange(len(words))] = f"edit{rng.randrange(10_000)}"
+    else:
+        words.insert(rng.randrange(len(words)), "An added sentence, for good measure.")
+    return " ".join(words)
+
+
+class Command(BaseCommand):
+    """Measure MessageHistory storage and reconstruction on heavy edits.
+
+    Generates messages inside a transaction that is rolled back, edits each
+    of them `--edits` times through `bulk_edit`, then reports the bytes the
+    delta-encoded history stores against what full copies would take, and
+    how long it takes to read every version and the oldest version alone.
+    """
+
+    help = "Benchmark delta-compressed MessageHistory on a synthetic edit load."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--messages", type=int, default=200)
+        parser.add_argument("--edits", type=int, default=50)
+        parser.add_argument(
+            "--length", type=int, default=2000, help="Initial message length."
+        )
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        user_model = get_user_model()
+        words = [f"word{i}" for i in range(500)]
+        try:
+            with transaction.atomic():
+                user = user_model.objects.create(username="benchmark-history-user")
+                messages = Message.objects.bulk_create(
+                    Message(
+                        sender=user,
+                        receiver=user,
+                        content=" ".join(
+                            rng.choice(words) for _ in range(options["length"] // 8)
+                        ),
+                    )
+                    for _ in range(options["messages"])
+                )
+                contents = {m.pk: m.content for m in messages}
+
+                started = time.perf_counter()
+                for _ in range(options["edits"]):
+                    contents = {pk: _edit(rng, c) for pk, c in contents.items()}
+                    Message.objects.bulk_edit(contents)
+                write_time = time.perf_counter() - started
+
+                stored = full = 0
+                entries = MessageHistory.objects.filter(message__sender=user)
+                for snapshot, delta in entries.values_list("snapshot", "delta"):
+                    stored += len(snapshot) + (
+                        len(json.dumps(delta)) if delta is not None else 0
+                    )
+
+                started = time.perf_counter()
+                for message in Message.objects.filter(sender=user):
+                    for entry in message.history():
+                        full += len(entry.old_content)
+                all_versions_time = time.perf_counter() - started
+
+                oldest = list(entries.filter(seq=1).values_list("pk", flat=True))
+                started = time.perf_counter()
+                for pk in oldest:
+                    MessageHistory.objects.get(pk=pk).old_content
+                oldest_time = time.perf_counter() - started
+                raise _Rollback
+        except _Rollback:
+            pass
+
+        versions = options["messages"] * options["edits"]
+        self.stdout.write(
+            f"{versions} versions of {options['messages']} messages: "
+            f"{full / 2**20:.2f} MiB as full copies, {stored / 2**20:.2f} MiB "
+            f"stored ({full / max(stored, 1):.1f}x smaller)"
+        )
+        self.stdout.write(
+            f"writes: {write_time * 1000 / versions:.3f} ms/edit; "
+            f"all versions via history(): "
+            f"{all_versions_time * 1000 / options['messages']:.2f} ms/message; "
+            f"oldest version alone: {oldest_time * 1000 / len(oldest):.2f} ms"
+        )
@@ -0,0 +1,303 @@
+import json
+import math
+import platform
+import statistics
+import subprocess
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import django
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from messaging.models import Message
+from messaging.seed import seed_dataset
+from messaging.thread_cache import invalidate_threads
+
+from .seed_messaging_data import add_dataset_arguments, dataset_params
+
+FORMAT_VERSION = 1
+
+
+class _Rollback(Exception):
+    """Raised to discard the benchmark data once every scenario is measured."""
+
+
+class _QueryCounter:
+    """`connection.execute_wrapper` hook counting executed statements."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=Path(__file__).resolve().parent,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def _summary(times, queries):
+    times_ms = [t * 1000 for t in times]
+    return {
+        "runs": len(times),
+        "time_ms": {
+            "min": round(min(times_ms), 3),
+            "median": round(statistics.median(times_ms), 3),
+            "p95": round(_percentile(times_ms, 0.95), 3),
+            "max": round(max(times_ms), 3),
+        },
+        "queries": {
+            "min": min(queries),
+            "median": statistics.median(queries),
+            "max": max(queries),
+        },
+    }
+
+
+class Command(BaseCommand):
+    """Time the messaging views against a seeded dataset and report as JSON.
+
+    Every scenario issues real requests through the test client (URL
+    routing, middleware, view, template) and records wall time and the
+    number of SQL statements per request. The dataset is generated with
+    `messaging.seed` inside a transaction that is rolled back at the end,
+    so the run leaves no rows behind; ``--no-seed`` runs against the
+    existing data instead (also rolled back).
+
+    ``--output`` writes the results as JSON; ``--compare`` checks them
+    against such a file from another commit and fails on regressions.
+    """
+
+    help = "Benchmark the messaging views and admin changelists."
+
+    def add_arguments(self, parser):
+        add_dataset_arguments(parser)
+        parser.add_argument(
+            "--no-seed",
+            action="store_true",
+            help="Benchmark the existing data instead of a generated dataset.",
+        )
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=5,
+            help="Measured requests per scenario (default: 5).",
+        )
+        parser.add_argument(
+            "--output",
+            default=None,
+            help="Write the JSON results to this file ('-' for stdout).",
+        )
+        parser.add_argument(
+            "--compare",
+            default=None,
+            help="JSON results of a previous run to compare against.",
+        )
+        parser.add_argument(
+            "--tolerance",
+            type=float,
+            default=0.25,
+            help="Allowed relative slowdown of a median before it counts as a "
+            "regression (default: 0.25).",
+        )
+
+    def _scenarios(self, repeat):
+        """Yield ``(name, request, warmup)``; `request(i)` issues the i-th request."""
+        user_model = get_user_model()
+        # The users receiving the most messages, reader first
+        users = list(
+            Message.objects.filter(
+                receiver__is_active=True, receiver__is_superuser=False
+            )
+            .order_by()
+            .values("receiver_id")
+            .annotate(n=Count("pk"))
+            .order_by("-n", "receiver_id")
+            .values_list("receiver_id", flat=True)[: repeat + 2]
+        )
+        if len(users) < repeat + 2:
+            raise CommandError(f"Need at least {repeat + 2} users with messages")
+        reader = user_model.objects.get(pk=users[0])
+        largest = (
+            Message.objects.filter(thread_root__isnull=False)
+            .order_by()
+            .values("thread_root_id")
+            .annotate(n=Count("pk"))
+            .order_by("-n")
+            .values_list("thread_root_id", flat=True)
+            .first()
+        ) or Message.objects.values_list("pk", flat=True).first()
+        admin = user_model.objects.create_superuser(
+            "benchmark-admin", "benchmark-admin@example.com", None
+        )
+
+        def client(user):
+            c = Client()
+            c.force_login(user)
+            return c
+
+        reader_client = client(reader)
+        admin_client = client(admin)
+        detail_url = reverse("messaging-thread-detail", kwargs={"pk": largest})
+
+        def get(c, url, expected=200):
+            def request(i):
+                response = c.get(url)
+                if response.status_code != expected:
+                    raise CommandError(f"GET {url}: HTTP {response.status_code}")
+
+            return request
+
+        def thread_detail_cold(i):
+            invalidate_threads([largest])
+            get(reader_client, detail_url)(i)
+
+        def send_message(i):
+            response = reader_client.post(
+                reverse("messaging-send-message"),
+                {"receiver_id": users[1], "content": f"Benchmark message {i}"},
+            )
+            if response.status_code != 302:
+                raise CommandError(f"send_message: HTTP {response.status_code}")
+
+        # The heaviest users are deleted last so the read scenarios see them
+        deletion_clients = [
+            client(user_model.objects.get(pk=pk)) for pk in users[2 : repeat + 2]
+        ]
+
+        def delete_user(i):
+            response = deletion_clients[i].post(reverse("messaging-delete-account"))
+            if response.status_code != 302:
+                raise CommandError(f"delete_user: HTTP {response.status_code}")
+
+        yield "thread_list", get(reader_client, reverse("messaging-thread-list")), True
+        yield "thread_detail_cold", thread_detail_cold, True
+        yield "thread_detail_warm", get(reader_client, detail_url), True
+        yield "inbox", get(reader_client, reverse("messaging-inbox")), True
+        for model in ("message", "notification", "messagehistory"):
+            url = reverse(f"admin:messaging_{model}_changelist")
+            yield f"admin_{model}_changelist", get(admin_client, url), True
+        yield "send_message", send_message, False
+        yield "delete_user", delete_user, False
+
+    def _measure(self, request, repeat, warmup):
+        if warmup:
+            request(-1)
+        times, queries = [], []
+        for i in range(repeat):
+            counter = _QueryCounter()
+            with connection.execute_wrapper(counter):
+                started = time.perf_counter()
+                request(i)
+                times.append(time.perf_counter() - started)
+            queries.append(counter.count)
+        return _summary(times, queries)
+
+    def _compare(self, results, baseline_path, tolerance):
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        regressions = []
+        self.stdout.write(
+            f"{'scenario':<32} {'median ms':>21} {'queries':>13}  "
+            f"vs {baseline['meta'].get('revision') or baseline_path}"
+        )
+        for name, current in results["scenarios"].items():
+            base = baseline["scenarios"].get(name)
+            if base is None:
+                self.stdout.write(f"{name:<32} (new)")
+                continue
+            t0, t1 = base["time_ms"]["median"], current["time_ms"]["median"]
+            q0, q1 = base["queries"]["max"], current["queries"]["max"]
+            flags = []
+            if q1 > q0:
+                flags.append("more queries")
+            if t0 and t1 > t0 * (1 + tolerance):
+                flags.append("slower")
+            if flags:
+                regressions.append(name)
+            self.stdout.write(
+                f"{name:<32} {t0:>9.2f} -> {t1:>9.2f} {q0:>5} -> {q1:>5}  "
+                + ", ".join(flags)
+            )
+        return regressions
+
+    def handle(self, *args, **options):
+        repeat = options["repeat"]
+        if repeat < 1:
+            raise CommandError("--repeat must be at least 1")
+        params = dataset_params(options)
+        results = {
+            "format": FORMAT_VERSION,
+            "meta": {
+                "revision": _git_revision(),
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "vendor": connection.vendor,
+                "python": platform.python_version(),
+                "django": django.get_version(),
+                "repeat": repeat,
+            },
+            "dataset": None if options["no_seed"] else params,
+            "scenarios": {},
+        }
+
+        # The test client's host must pass ALLOWED_HOSTS validation
+        hosts = [*settings.ALLOWED_HOSTS, "testserver"]
+        try:
+            with override_settings(ALLOWED_HOSTS=hosts), transaction.atomic():
+                if not options["no_seed"]:
+                    started = time.perf_counter()
+                    results["seeded"] = seed_dataset(**params)
+                    results["seed_seconds"] = round(time.perf_counter() - started, 3)
+                results["rows"] = {
+                    "messages": Message.objects.count(),
+                    "threads": Message.objects.filter(
+                        parent_message__isnull=True
+                    ).count(),
+                }
+                for name, request, warmup in self._scenarios(repeat):
+                    summary = self._measure(request, repeat, warmup)
+                    results["scenarios"][name] = summary
+                    self.stderr.write(
+                        f"{name:<32} {summary['time_ms']['median']:>9.2f} ms "
+                        f"{summary['queries']['max']:>5} queries"
+                    )
+                raise _Rollback
+        except _Rollback:
+            pass
+
+        output = options["output"]
+        if output == "-":
+            self.stdout.write(json.dumps(results, indent=2))
+        elif output:
+            with open(output, "w") as f:
+                json.dump(results, f, indent=2)
+            self.stderr.write(f"Results written to {output}")
+
+        if options["compare"]:
+            regressions = self._compare(
+                results, options["compare"], options["tolerance"]
+            )
+            if regressions:
+                raise CommandError(f"Regressions in: {', '.join(regressions)}")
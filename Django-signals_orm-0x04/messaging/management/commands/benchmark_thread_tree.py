@@ -0,0 +1,74 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from messaging.models import Message, ThreadTree
+
+
+class _Rollback(Exception):
+    """Raised to discard the benchmark data once it is measured."""
+
+
+def _replies(user, root, count):
+    """Bulk-create `count` replies to `root`, bypassing the tree signals."""
+    replies = [Message(sender=user, receiver=user, content="r") for _ in range(count)]
+    for reply in replies:
+        reply.parent_message = root
+        reply.assign_thread_position(root)
+    return Message.objects.bulk_create(replies)
+
+
+class Command(BaseCommand):
+    """Measure the per-reply cost of maintaining a stored ThreadTree.
+
+    For each thread size, generates a thread inside a transaction that is
+    rolled back, stores its tree, then times `ThreadTree.objects.append`
+    and `remove` for `--replies` more replies. Both rewrite the whole row,
+    so the time per reply grows with the thread.
+    """
+
+    help = "Benchmark incremental ThreadTree updates on large threads."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes",
+            default="100,1000,10000",
+            help="Comma-separated thread sizes to measure.",
+        )
+        parser.add_argument("--replies", type=int, default=50)
+
+    def handle(self, *args, **options):
+        user_model = get_user_model()
+        sizes = [int(size) for size in options["sizes"].split(",")]
+        replies = options["replies"]
+        try:
+            with transaction.atomic():
+                user = user_model.objects.create(username="benchmark-tree-user")
+                for size in sizes:
+                    root = Message.objects.create(
+                        sender=user, receiver=user, content="root"
+                    )
+                    _replies(user, root, size - 1)
+                    ThreadTree.objects.build(root.pk)
+                    new = _replies(user, root, replies)
+
+                    started = time.perf_counter()
+                    for message in new:
+                        ThreadTree.objects.append(message)
+                    append_time = time.perf_counter() - started
+
+                    started = time.perf_counter()
+                    for message in new:
+                        ThreadTree.objects.remove(message)
+                    remove_time = time.perf_counter() - started
+
+                    self.stdout.write(
+                        f"{size} nodes: append {append_time * 1000 / replies:.3f} "
+                        f"ms/reply, remove {remove_time * 1000 / replies:.3f} "
+                        f"ms/reply"
+                    )
+                raise _Rollback
+        except _Rollback:
+            pass
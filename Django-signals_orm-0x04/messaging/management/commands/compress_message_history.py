@@ -0,0 +1,102 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef
+
+from messaging.history import reconstruct
+from messaging.models import Message, MessageHistory
+
+# Moves the old edit numbers out of the way of the new ones, which the
+# unique (message, seq) constraint checks row by row while they are written
+_SEQ_OFFSET = 1_000_000
+
+
+def _stored_size(entry):
+    return len(entry.snapshot) + (
+        len(json.dumps(entry.delta)) if entry.delta is not None else 0
+    )
+
+
+class Command(BaseCommand):
+    """Re-encode existing MessageHistory rows as reverse deltas.
+
+    Rows written before delta storage hold full snapshots. Messages with
+    history are processed in primary-key batches: every entry's content is
+    reconstructed, the entries are renumbered in edit order and stored again
+    as deltas with periodic snapshots (see `messaging.history`). Running the
+    command again is safe; already converted rows come out unchanged.
+    """
+
+    help = "Convert full-text MessageHistory rows to delta storage in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Number of messages converted per batch (default: 500).",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        edited = Message.objects.filter(
+            Exists(MessageHistory.objects.filter(message=OuterRef("pk")))
+        )
+
+        last_pk = 0
+        messages_done = before = after = 0
+        while True:
+            messages = list(
+                edited.filter(pk__gt=last_pk)
+                .order_by("pk")
+                .only("pk", "content", "edit_count")[:batch_size]
+            )
+            if not messages:
+                break
+            with transaction.atomic():
+                sizes = self._convert(messages)
+            before += sizes[0]
+            after += sizes[1]
+            messages_done += len(messages)
+            last_pk = messages[-1].pk
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Converted the history of {messages_done} messages: "
+                f"{before} -> {after} bytes stored."
+            )
+        )
+
+    def _convert(self, messages):
+        by_message = {m.pk: [] for m in messages}
+        entries = MessageHistory.objects.filter(message_id__in=by_message).order_by(
+            "message_id", "-pk"
+        )
+        for entry in entries.only(
+            "pk", "message_id", "snapshot", "delta", "target_hash", "seq"
+        ):
+            by_message[entry.message_id].append(entry)
+
+        before = after = 0
+        for message in messages:
+            newest_first = by_message[message.pk]
+            contents = list(reconstruct(message.content, newest_first))
+            newer_contents = [message.content] + contents[:-1]
+            count = len(newest_first)
+            for i, entry in enumerate(newest_first):
+                before += _stored_size(entry)
+                entry.seq = count - i
+                entry.set_content(contents[i], newer_contents[i])
+                after += _stored_size(entry)
+            message.edit_count = count
+
+        MessageHistory.objects.filter(message_id__in=by_message).update(
+            seq=F("seq") + _SEQ_OFFSET
+        )
+        MessageHistory.objects.bulk_update(
+            [e for entries in by_message.values() for e in entries],
+            ["snapshot", "delta", "target_hash", "seq"],
+        )
+        Message.objects.bulk_update(messages, ["edit_count"])
+        return before, after
@@ -0,0 +1,42 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from messaging.deletion import delete_user_data
+
+
+class Command(BaseCommand):
+    """Delete a user and their messaging data in bounded batches.
+
+    Safe to re-run after an interruption: every batch commits on its own and
+    the next run picks up whatever is left.
+    """
+
+    help = "Delete a user and all of their messaging data in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument("user", help="Primary key or username of the user.")
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=None,
+            help="Rows deleted per batch (default: MESSAGING_DELETE_BATCH_SIZE or 500).",
+        )
+
+    def handle(self, *args, **options):
+        user_model = get_user_model()
+        ident = options["user"]
+        lookup = (
+            {"pk": ident} if ident.isdigit() else {user_model.USERNAME_FIELD: ident}
+        )
+        try:
+            user = user_model.objects.get(**lookup)
+        except user_model.DoesNotExist:
+            raise CommandError(f"User {ident!r} does not exist")
+
+        def progress(stage, total):
+            self.stdout.write(f"{stage}: {total} deleted")
+
+        stats = delete_user_data(
+            user.pk, batch_size=options["batch_size"], progress=progress
+        )
+        self.stdout.write(self.style.SUCCESS(f"Deleted user {ident}: {stats}"))
@@ -0,0 +1,49 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from messaging.export import DEFAULT_CHUNK_SIZE, FORMATS, iter_export
+
+
+class Command(BaseCommand):
+    """Write a user's messages, threads and edit history to a file.
+
+    Uses the same streaming export as the ``messaging-export`` view, so
+    memory stays bounded by the chunk size.
+    """
+
+    help = "Export a user's messaging data as NDJSON or CSV."
+
+    def add_arguments(self, parser):
+        parser.add_argument("user", help="Primary key or username of the user.")
+        parser.add_argument("output", help="Path of the file to write.")
+        parser.add_argument(
+            "--format", choices=sorted(FORMATS), default="ndjson", dest="fmt"
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=DEFAULT_CHUNK_SIZE,
+            help=f"Rows fetched per query (default: {DEFAULT_CHUNK_SIZE}).",
+        )
+
+    def handle(self, *args, **options):
+        user_model = get_user_model()
+        ident = options["user"]
+        lookup = (
+            {"pk": ident} if ident.isdigit() else {user_model.USERNAME_FIELD: ident}
+        )
+        try:
+            user = user_model.objects.get(**lookup)
+        except user_model.DoesNotExist:
+            raise CommandError(f"User {ident!r} does not exist")
+
+        lines = 0
+        with open(options["output"], "w", encoding="utf-8", newline="") as out:
+            for line in iter_export(
+                user, options["fmt"], chunk_size=options["chunk_size"]
+            ):
+                out.write(line)
+                lines += 1
+        self.stdout.write(
+            self.style.SUCCESS(f"Wrote {lines} lines to {options['output']}")
+        )
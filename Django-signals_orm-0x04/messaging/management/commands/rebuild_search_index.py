@@ -0,0 +1,59 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from messaging.models import Message
+from messaging.search import get_backend
+
+
+class Command(BaseCommand):
+    """Rebuild the full-text index of message content from the Message table.
+
+    Messages are read in primary-key batches, so memory stays bounded by the
+    batch size. Each batch replaces its index rows in its own transaction
+    and rows of messages that no longer exist are pruned at the end, so
+    search keeps answering from the old index while the rebuild runs.
+    Backends whose index the database maintains itself (MySQL FULLTEXT) need
+    no rebuild and are left untouched.
+    """
+
+    help = "Re-index all message content for full-text search in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=2000,
+            help="Number of messages indexed per batch (default: 2000).",
+        )
+
+    def handle(self, *args, **options):
+        backend = get_backend()
+        if not backend.maintains_index:
+            self.stdout.write(
+                "The database maintains this search index; nothing to do."
+            )
+            return
+
+        batch_size = options["batch_size"]
+        last_pk = 0
+        indexed = 0
+        while True:
+            rows = list(
+                Message.objects.filter(pk__gt=last_pk)
+                .order_by("pk")
+                .values_list("pk", "content")[:batch_size]
+            )
+            if not rows:
+                break
+            with transaction.atomic():
+                backend.index(rows)
+            indexed += len(rows)
+            last_pk = rows[-1][0]
+        with transaction.atomic():
+            pruned = backend.prune()
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Indexed {indexed} messages, pruned {pruned} stale entries."
+            )
+        )
@@ -0,0 +1,45 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from messaging.models import UnreadCounter
+
+
+class Command(BaseCommand):
+    """Recompute the denormalized unread counters from Message/Notification.
+
+    Users are processed in primary-key batches; each batch costs one grouped
+    COUNT per source table and only drifted or missing rows are written.
+    """
+
+    help = "Recompute drifted per-user unread counters in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of users reconciled per batch (default: 1000).",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        user_model = get_user_model()
+
+        last_pk = None
+        checked = fixed = 0
+        while True:
+            users = user_model.objects.order_by("pk")
+            if last_pk is not None:
+                users = users.filter(pk__gt=last_pk)
+            user_ids = list(users.values_list("pk", flat=True)[:batch_size])
+            if not user_ids:
+                break
+            with transaction.atomic():
+                fixed += UnreadCounter.objects.reconcile(user_ids)
+            checked += len(user_ids)
+            last_pk = user_ids[-1]
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Checked {checked} users, fixed {fixed} counters.")
+        )
@@ -0,0 +1,113 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from messaging.seed import DEFAULTS, seed_dataset
+
+
+def add_dataset_arguments(parser):
+    """Add the `seed_dataset` parameters as ``--options`` to `parser`."""
+    parser.add_argument(
+        "--users",
+        type=int,
+        default=DEFAULTS["users"],
+        help=f"Number of users (default: {DEFAULTS['users']}).",
+    )
+    parser.add_argument(
+        "--messages",
+        type=int,
+        default=DEFAULTS["messages"],
+        help=f"Number of messages (default: {DEFAULTS['messages']}).",
+    )
+    parser.add_argument(
+        "--reply-rate",
+        type=float,
+        default=DEFAULTS["reply_rate"],
+        help="Fraction of messages that are replies "
+        f"(default: {DEFAULTS['reply_rate']}).",
+    )
+    parser.add_argument(
+        "--deepen-rate",
+        type=float,
+        default=DEFAULTS["deepen_rate"],
+        help="Fraction of replies answering the newest message of their thread "
+        f"rather than a random one (default: {DEFAULTS['deepen_rate']}).",
+    )
+    parser.add_argument(
+        "--max-depth",
+        type=int,
+        default=DEFAULTS["max_depth"],
+        help=f"Maximum reply depth (default: {DEFAULTS['max_depth']}).",
+    )
+    parser.add_argument(
+        "--active-window",
+        type=int,
+        default=DEFAULTS["active_window"],
+        help="Replies go to threads active among this many latest messages "
+        f"(default: {DEFAULTS['active_window']}).",
+    )
+    parser.add_argument(
+        "--edit-rate",
+        type=float,
+        default=DEFAULTS["edit_rate"],
+        help=f"Fraction of messages edited (default: {DEFAULTS['edit_rate']}).",
+    )
+    parser.add_argument(
+        "--max-edits",
+        type=int,
+        default=DEFAULTS["max_edits"],
+        help=f"Maximum edits per edited message (default: {DEFAULTS['max_edits']}).",
+    )
+    parser.add_argument(
+        "--read-rate",
+        type=float,
+        default=DEFAULTS["read_rate"],
+        help=f"Fraction of messages already read (default: {DEFAULTS['read_rate']}).",
+    )
+    parser.add_argument(
+        "--prefix",
+        default=DEFAULTS["prefix"],
+        help=f"Username prefix of the generated users (default: {DEFAULTS['prefix']}).",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=DEFAULTS["seed"],
+        help=f"Random seed (default: {DEFAULTS['seed']}).",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=DEFAULTS["batch_size"],
+        help=f"Rows per bulk INSERT (default: {DEFAULTS['batch_size']}).",
+    )
+
+
+def dataset_params(options):
+    """Return the `seed_dataset` keyword arguments from parsed `options`."""
+    return {name: options[name] for name in DEFAULTS}
+
+
+class Command(BaseCommand):
+    """Fill the database with a synthetic, reproducible messaging dataset.
+
+    See `messaging.seed` for the shape of the generated data.
+    """
+
+    help = "Generate synthetic users, threads, edits and notifications."
+
+    def add_arguments(self, parser):
+        add_dataset_arguments(parser)
+
+    def handle(self, *args, **options):
+        params = dataset_params(options)
+        prefix = params["prefix"]
+        if get_user_model().objects.filter(username__startswith=prefix).exists():
+            raise CommandError(
+                f"Users named {prefix!r}... already exist; pass another --prefix."
+            )
+
+        def progress(totals):
+            self.stdout.write(f"{totals['messages']} messages written")
+
+        totals = seed_dataset(progress=progress, **params)
+        self.stdout.write(self.style.SUCCESS(f"Seeded {totals}"))
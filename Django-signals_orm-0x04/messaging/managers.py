@@ -1,9 +1,417 @@
-from django.db import models
+from collections import Counter, defaultdict
 
+from django.db import IntegrityError, models, transaction
+from django.db.models.query import ModelIterable
+from django.utils import timezone
 
-class UnreadMessagesManager(models.Manager):
+from .pagination import DEFAULT_PAGE_SIZE, apaginate_keyset, paginate_keyset
+
+
+class MessageQuerySet(models.QuerySet):
+    """QuerySet for messages with keyset pagination support."""
+
+    def keyset_page(self, cursor=None, per_page=DEFAULT_PAGE_SIZE):
+        """Return one `KeysetPage` of this queryset ordered newest first."""
+        return paginate_keyset(self, cursor=cursor, per_page=per_page)
+
+    async def akeyset_page(self, cursor=None, per_page=DEFAULT_PAGE_SIZE):
+        """Async version of `keyset_page`."""
+        return await apaginate_keyset(self, cursor=cursor, per_page=per_page)
+
+    def bulk_edit(self, contents, edited_by=None, batch_size=500):
+        """Apply many content edits with bulk writes instead of per-row saves.
+
+        `contents` maps message ids to their new content. Per batch the old
+        versions are recorded with one `MessageHistory` bulk_create and the
+        messages are written with one `bulk_update`, so the per-save signal
+        handlers do not run; the cached trees of the touched threads are
+        invalidated on commit and the full-text index is updated here
+        instead. Returns the number of messages changed.
+        """
+        from .search import get_backend
+        from .thread_cache import invalidate_threads
+
+        MessageHistory = self.model._meta.apps.get_model("messaging", "MessageHistory")
+        pks = list(contents)
+        search_backend = get_backend()
+        changed_count = 0
+        for start in range(0, len(pks), batch_size):
+            batch = self.filter(pk__in=pks[start : start + batch_size]).order_by()
+            changed, history = [], []
+            with transaction.atomic(using=self.db):
+                # Locked, so concurrent edits cannot take the same edit numbers
+                for msg in batch.select_for_update().only(
+                    "pk", "thread_root_id", "content", "edited", "edit_count"
+                ):
+                    new_content = contents[msg.pk]
+                    if new_content == msg.content:
+                        continue
+                    msg.edit_count += 1
+                    entry = MessageHistory(
+                        message=msg, seq=msg.edit_count, edited_by=edited_by
+                    )
+                    entry.set_content(msg.content, new_content)
+                    history.append(entry)
+                    msg.content = new_content
+                    msg.edited = True
+                    changed.append(msg)
+                MessageHistory.objects.bulk_create(history)
+                self.model.objects.bulk_update(
+                    changed, ["content", "edited", "edit_count"]
+                )
+                if search_backend.maintains_index:
+                    search_backend.index((m.pk, m.content) for m in changed)
+                roots = {m.thread_root_pk for m in changed}
+                transaction.on_commit(
+                    lambda roots=roots: invalidate_threads(roots), using=self.db
+                )
+            changed_count += len(changed)
+        return changed_count
+
+
+class _LinkedHistoryIterable(ModelIterable):
+    """Link each history entry to the next newer entry of its message.
+
+    When entries come newest first, an entry whose edit number directly
+    precedes the one yielded before it rebuilds its content from that entry
+    instead of querying (see `MessageHistory.old_content`).
+    """
+
+    def __iter__(self):
+        previous = {}
+        for entry in super().__iter__():
+            newer = previous.get(entry.message_id)
+            if (
+                newer is not None
+                and newer.seq == entry.seq + 1
+                and newer.pk > entry.pk
+                and entry.delta is not None
+            ):
+                entry._newer = newer
+            previous[entry.message_id] = entry
+            yield entry
+
+
+class MessageHistoryQuerySet(models.QuerySet):
+    """QuerySet for message history entries with lazy content reconstruction."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._iterable_class = _LinkedHistoryIterable
+
+
+class UnreadMessagesManager(models.Manager.from_queryset(MessageQuerySet)):
     """Manager to filter unread messages for a given user."""
 
     def unread_for_user(self, user):
         # Messages received by the user and not read yet
         return self.get_queryset().filter(receiver=user, read=False)
+
+
+class NotificationManager(models.Manager):
+    """Manager for notifications: coalesced upserts and bulk mark-read."""
+
+    def upsert_coalesced(self, rows):
+        """Fold new messages into one unread notification per conversation.
+
+        `rows` are ``(user_id, coalesce_key, message_id)`` tuples. Each
+        (user, key) group updates the user's unread notification with that
+        key in place - adding to `count` and pointing `message` at the
+        newest message - or inserts it. Messages no newer than the one a
+        notification already points at are taken as redelivered and skipped.
+        The users' unread notification counters are bumped only for the rows
+        actually inserted.
+
+        Returns ``(inserted, updated)``, the notifications written, e.g. to
+        publish their live events.
+        """
+        groups = {}
+        for user_id, key, message_id in rows:
+            count, latest = groups.get((user_id, key), (0, 0))
+            groups[(user_id, key)] = (count + 1, max(latest, message_id))
+        if not groups:
+            return [], []
+
+        now = timezone.now()
+        with transaction.atomic(using=self.db):
+            existing = self.select_for_update().filter(
+                user_id__in={user_id for user_id, _ in groups},
+                coalesce_key__in={key for _, key in groups},
+            )
+            updated = []
+            for notification in existing.only(
+                "pk", "user_id", "coalesce_key", "message_id", "count"
+            ):
+                count, latest = groups.pop(
+                    (notification.user_id, notification.coalesce_key), (0, 0)
+                )
+                if latest > notification.message_id:
+                    notification.count += count
+                    notification.message_id = latest
+                    notification.created_at = now
+                    updated.append(notification)
+            self.bulk_update(updated, ["count", "message", "created_at"])
+
+            inserted, folded = self._insert_coalesced(groups, now)
+            UnreadCounter = self.model._meta.apps.get_model(
+                "messaging", "UnreadCounter"
+            )
+            UnreadCounter.objects.adjust_many(
+                notifications=Counter(n.user_id for n in inserted)
+            )
+        return inserted, updated + folded
+
+    def _insert_coalesced(self, groups, now):
+        """Insert the `groups` without a notification.
+
+        All rows go in one INSERT unless a concurrent transaction inserted
+        one of the conversations first (the unique (user, coalesce_key)
+        constraint). Then each row is retried alone and a conflicting one is
+        folded into the winner's row with an F() update, so no count is lost.
+        Returns ``(inserted, folded)``: the rows inserted and the winners'
+        rows updated.
+        """
+        rows = {
+            group: self.model(
+                user_id=group[0], message_id=latest, coalesce_key=group[1], count=count
+            )
+            for group, (count, latest) in groups.items()
+        }
+        try:
+            with transaction.atomic(using=self.db):
+                self.bulk_create(rows.values())
+            return list(rows.values()), []
+        except IntegrityError:
+            pass
+        inserted, folded = [], []
+        for (user_id, key), row in rows.items():
+            try:
+                with transaction.atomic(using=self.db):
+                    # bulk_create, like the fast path: no post_save handlers
+                    self.bulk_create([row])
+                inserted.append(row)
+            except IntegrityError:
+                # Redelivered messages (unique (user, message)) match nothing
+                winner = self.filter(
+                    user_id=user_id, coalesce_key=key, message_id__lt=row.message_id
+                )
+                if winner.update(
+                    count=models.F("count") + row.count,
+                    message_id=row.message_id,
+                    created_at=now,
+                ):
+                    folded += self.filter(user_id=user_id, coalesce_key=key).only(
+                        "pk", "user_id", "message_id", "count"
+                    )
+        return inserted, folded
+
+    def mark_read(self, user, thread=None, sender=None):
+        """Mark `user`'s unread notifications read with one UPDATE.
+
+        `thread` (a root message id) or `sender` (a user id) restricts it to
+        one conversation. The user's unread counter drops by the number of
+        rows marked, which is returned.
+        """
+        qs = self.filter(user=user, read=False)
+        if thread is not None:
+            qs = qs.filter(
+                models.Q(message__thread_root_id=thread) | models.Q(message_id=thread)
+            )
+        if sender is not None:
+            qs = qs.filter(message__sender_id=sender)
+        UnreadCounter = self.model._meta.apps.get_model("messaging", "UnreadCounter")
+        with transaction.atomic(using=self.db):
+            # Read rows give up their key, so the next message opens a new one
+            marked = qs.update(read=True, coalesce_key=None)
+            if marked:
+                UnreadCounter.objects.adjust(user.pk, notifications=-marked)
+        return marked
+
+
+class UnreadCounterManager(models.Manager):
+    """Manager for the per-user denormalized unread counters."""
+
+    def _recount(self, user_ids):
+        """Return ``{user_id: (unread_messages, unread_notifications)}`` from source rows."""
+        Message = self.model._meta.apps.get_model("messaging", "Message")
+        Notification = self.model._meta.apps.get_model("messaging", "Notification")
+        counts = {user_id: [0, 0] for user_id in user_ids}
+        message_counts = (
+            Message.objects.filter(receiver_id__in=user_ids, read=False)
+            .order_by()
+            .values_list("receiver_id")
+            .annotate(n=models.Count("pk"))
+        )
+        for user_id, n in message_counts:
+            counts[user_id][0] = n
+        notification_counts = (
+            Notification.objects.filter(user_id__in=user_ids, read=False)
+            .order_by()
+            .values_list("user_id")
+            .annotate(n=models.Count("pk"))
+        )
+        for user_id, n in notification_counts:
+            counts[user_id][1] = n
+        return {user_id: tuple(c) for user_id, c in counts.items()}
+
+    def _create_from_source(self, user_id):
+        messages, notifications = self._recount([user_id])[user_id]
+        counter, _ = self.get_or_create(
+            user_id=user_id,
+            defaults={
+                "unread_messages": messages,
+                "unread_notifications": notifications,
+            },
+        )
+        return counter
+
+    def adjust(self, user_id, messages=0, notifications=0):
+        """Atomically add the given deltas to a user's counters.
+
+        This is a single UPDATE with F() expressions. A missing counter row
+        is left alone: `for_user` builds it from a recount on first read,
+        which already includes every change made in the meantime.
+        """
+        self.filter(user_id=user_id).update(
+            unread_messages=models.F("unread_messages") + messages,
+            unread_notifications=models.F("unread_notifications") + notifications,
+        )
+
+    def adjust_many(self, messages=None, notifications=None):
+        """Add per-user deltas (``{user_id: n}``) with one UPDATE per distinct n."""
+        for field, deltas in (
+            ("unread_messages", messages),
+            ("unread_notifications", notifications),
+        ):
+            users_by_delta = defaultdict(list)
+            for user_id, n in (deltas or {}).items():
+                if n:
+                    users_by_delta[n].append(user_id)
+            for n, user_ids in users_by_delta.items():
+                self.filter(user_id__in=user_ids).update(**{field: models.F(field) + n})
+
+    def for_user(self, user):
+        """Return the counter row of `user` (a primary-key lookup).
+
+        Users without a row yet (created before counters existed) get one
+        built from a recount of the source tables.
+        """
+        try:
+            return self.get(pk=user.pk)
+        except self.model.DoesNotExist:
+            return self._create_from_source(user.pk)
+
+    def reconcile(self, user_ids):
+        """Recompute the counters of `user_ids`; return the number of rows fixed."""
+        counts = self._recount(user_ids)
+        existing = {c.user_id: c for c in self.filter(user_id__in=user_ids)}
+        drifted, missing = [], []
+        for user_id, (messages, notifications) in counts.items():
+            counter = existing.get(user_id)
+            if counter is None:
+                missing.append(
+                    self.model(
+                        user_id=user_id,
+                        unread_messages=messages,
+                        unread_notifications=notifications,
+                    )
+                )
+            elif (counter.unread_messages, counter.unread_notifications) != (
+                messages,
+                notifications,
+            ):
+                counter.unread_messages = messages
+                counter.unread_notifications = notifications
+                drifted.append(counter)
+        self.bulk_update(drifted, ["unread_messages", "unread_notifications"])
+        self.bulk_create(missing, ignore_conflicts=True)
+        return len(drifted) + len(missing)
+
+
+class ThreadTreeManager(models.Manager):
+    """Manager building and incrementally updating compact thread trees."""
+
+    def build(self, root_pk):
+        """(Re)build the tree of the thread rooted at `root_pk` from its messages."""
+        Message = self.model._meta.apps.get_model("messaging", "Message")
+        # Replies always get larger ids than their parents, so id order puts
+        # every parent before its children
+        rows = (
+            Message.objects.filter(
+                models.Q(pk=root_pk) | models.Q(thread_root_id=root_pk)
+            )
+            .order_by("pk")
+            .values_list("pk", "parent_message_id", "sender_id")
+        )
+        tree = self.model(root_id=root_pk, ids=[], parents=[], senders=[])
+        index = {}
+        for pk, parent_pk, sender_pk in rows:
+            index[pk] = len(tree.ids)
+            tree.ids.append(pk)
+            tree.parents.append(index.get(parent_pk, -1))
+            tree.senders.append(sender_pk)
+        try:
+            with transaction.atomic(using=self.db):
+                tree.save()
+        except IntegrityError:
+            # Another reader built and stored the same tree first
+            pass
+        return tree
+
+    def for_root(self, root_pk):
+        """Return the tree of a thread, building it on first use."""
+        tree = self.filter(root_id=root_pk).first()
+        return tree if tree is not None else self.build(root_pk)
+
+    def append(self, message):
+        """Add a newly created reply to its thread's tree, if one is stored.
+
+        Threads without a stored tree are built lazily on first read, which
+        includes the reply anyway.
+
+        The JSON arrays are read and written back whole under the row lock
+        (databases rewrite a JSON value on any change anyway), so a reply
+        costs O(thread size): about 1 ms per 1,000 nodes on SQLite, mostly
+        decoding and encoding the arrays. `benchmark_thread_tree` measures
+        it on large threads.
+        """
+        with transaction.atomic(using=self.db):
+            tree = (
+                self.select_for_update().filter(root_id=message.thread_root_id).first()
+            )
+            if tree is None or message.pk in tree.ids:
+                return
+            try:
+                parent = tree.ids.index(message.parent_message_id)
+            except ValueError:
+                # The stored tree predates the parent (a concurrent build
+                # raced with its creation); build it again from the rows
+                self.build(message.thread_root_id)
+                return
+            tree.ids.append(message.pk)
+            tree.parents.append(parent)
+            tree.senders.append(message.sender_id)
+            tree.save(update_fields=["ids", "parents", "senders"])
+
+    def remove(self, message):
+        """Tombstone a deleted reply in its thread's tree.
+
+        The slot keeps its position (its id becomes None) so the parent
+        indexes of the remaining nodes stay valid. Once tombstones make up
+        more than half of the tree it is compacted by a rebuild. Like
+        `append`, this costs O(thread size).
+        """
+        with transaction.atomic(using=self.db):
+            tree = (
+                self.select_for_update().filter(root_id=message.thread_root_id).first()
+            )
+            if tree is None:
+                return
+            try:
+                tree.ids[tree.ids.index(message.pk)] = None
+            except ValueError:
+                return
+            if tree.ids.count(None) * 2 > len(tree.ids):
+                self.build(tree.root_id)
+            else:
+                tree.save(update_fields=["ids"])
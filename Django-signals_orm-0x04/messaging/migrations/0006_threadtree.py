@@ -0,0 +1,32 @@
+# Generated by Django 4.2.16 on 2026-10-18 04:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("messaging", "0005_notification_unique_user_message"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ThreadTree",
+            fields=[
+                (
+                    "root",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="tree",
+                        serialize=False,
+                        to="messaging.message",
+                    ),
+                ),
+                ("ids", models.JSONField(default=list)),
+                ("parents", models.JSONField(default=list)),
+                ("senders", models.JSONField(default=list)),
+            ],
+        ),
+    ]
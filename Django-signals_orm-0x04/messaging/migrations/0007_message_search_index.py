@@ -0,0 +1,40 @@
+from django.db import migrations
+
+FTS_TABLE = "messaging_message_fts"
+FULLTEXT_INDEX = "msg_content_fulltext"
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "sqlite":
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(content)"
+        )
+        schema_editor.execute(
+            f"INSERT INTO {FTS_TABLE} (rowid, content) "
+            "SELECT id, content FROM messaging_message"
+        )
+    elif vendor == "mysql":
+        schema_editor.execute(
+            f"ALTER TABLE messaging_message ADD FULLTEXT INDEX {FULLTEXT_INDEX} (content)"
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "sqlite":
+        schema_editor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+    elif vendor == "mysql":
+        schema_editor.execute(
+            f"ALTER TABLE messaging_message DROP INDEX {FULLTEXT_INDEX}"
+        )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("messaging", "0006_threadtree"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
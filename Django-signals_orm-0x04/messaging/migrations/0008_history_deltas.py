@@ -0,0 +1,39 @@
+# Generated by Django 4.2.16 on 2026-10-18 04:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("messaging", "0007_message_search_index"),
+    ]
+
+    operations = [
+        # Existing rows keep their full text and become snapshots
+        migrations.RenameField(
+            model_name="messagehistory",
+            old_name="old_content",
+            new_name="snapshot",
+        ),
+        migrations.AlterField(
+            model_name="messagehistory",
+            name="snapshot",
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name="messagehistory",
+            name="delta",
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="messagehistory",
+            name="seq",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="message",
+            name="edit_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
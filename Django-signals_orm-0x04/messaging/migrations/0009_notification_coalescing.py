@@ -0,0 +1,31 @@
+# Generated by Django 4.2.16 on 2026-10-18 04:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("messaging", "0008_history_deltas"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="notification",
+            name="coalesce_key",
+            field=models.CharField(
+                blank=True, editable=False, max_length=64, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="notification",
+            name="count",
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddConstraint(
+            model_name="notification",
+            constraint=models.UniqueConstraint(
+                fields=("user", "coalesce_key"), name="notif_unique_user_coalesce"
+            ),
+        ),
+    ]
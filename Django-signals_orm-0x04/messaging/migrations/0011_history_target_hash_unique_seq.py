@@ -0,0 +1,53 @@
+# Generated by Django 4.2.16 on 2026-10-18 05:14
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def renumber_duplicate_seqs(apps, schema_editor):
+    # Rows from before 0008 all have seq 0, and racing edits could record
+    # the same edit number twice: number such messages' entries in id order
+    MessageHistory = apps.get_model("messaging", "MessageHistory")
+    Message = apps.get_model("messaging", "Message")
+    duplicated = set(
+        MessageHistory.objects.order_by()
+        .values("message_id", "seq")
+        .annotate(n=Count("pk"))
+        .filter(n__gt=1)
+        .values_list("message_id", flat=True)
+    )
+    for message_id in duplicated:
+        entries = list(
+            MessageHistory.objects.filter(message_id=message_id).order_by("pk")
+        )
+        for seq, entry in enumerate(entries, 1):
+            entry.seq = seq
+        MessageHistory.objects.bulk_update(entries, ["seq"])
+        Message.objects.filter(pk=message_id).update(edit_count=len(entries))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("messaging", "0010_archive"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="archivedmessagehistory",
+            name="target_hash",
+            field=models.CharField(blank=True, default="", max_length=16),
+        ),
+        migrations.AddField(
+            model_name="messagehistory",
+            name="target_hash",
+            field=models.CharField(blank=True, default="", max_length=16),
+        ),
+        migrations.RunPython(renumber_duplicate_seqs, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="messagehistory",
+            constraint=models.UniqueConstraint(
+                fields=("message", "seq"), name="history_unique_message_seq"
+            ),
+        ),
+    ]
@@ -1,9 +1,107 @@
 from django.conf import settings
-from django.db import models
-from .managers import UnreadMessagesManager
+from django.db import models, transaction
+from django.db.models.functions import Coalesce
+from .history import apply_delta, content_hash, encode, fits, reconstruct
+from .managers import (
+    MessageHistoryQuerySet,
+    MessageQuerySet,
+    NotificationManager,
+    ThreadTreeManager,
+    UnreadCounterManager,
+    UnreadMessagesManager,
+)
 
+# Width of one zero-padded id segment in `Message.path`. Fixed-width segments
+# keep lexicographic order on `path` equal to depth-first thread order.
+PATH_SEGMENT_WIDTH = 12
 
-class Message(models.Model):
+
+def path_segment(pk):
+    """Return the materialized-path segment for a message id."""
+    return f"{pk:0{PATH_SEGMENT_WIDTH}d}/"
+
+
+class LoadedStateMixin:
+    """Remember the field values a model instance was loaded or last saved with.
+
+    The snapshot lives in `_loaded_values` (attname -> value) so signal
+    handlers can tell what changed without re-reading the row. Deferred
+    fields are simply absent from it.
+    """
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    @property
+    def loaded_values(self):
+        return getattr(self, "_loaded_values", {})
+
+    def loaded_value(self, attname):
+        """Return the loaded value of `attname`, reading it from the row if needed.
+
+        Instances built by hand or loaded with the field deferred cost one
+        ``values_list`` query; the value is then kept in the snapshot.
+        """
+        loaded = self.loaded_values
+        if attname not in loaded:
+            value = (
+                type(self)
+                ._base_manager.using(self._state.db)
+                .filter(pk=self.pk)
+                .values_list(attname, flat=True)
+                .first()
+            )
+            self._loaded_values = loaded = {**loaded, attname: value}
+        return loaded[attname]
+
+    def changed_fields(self):
+        """Return attnames whose value differs from the loaded snapshot.
+
+        Fields missing from the snapshot (never loaded) count as changed.
+        """
+        loaded = self.loaded_values
+        deferred = self.get_deferred_fields()
+        return {
+            f.attname
+            for f in self._meta.concrete_fields
+            if f.attname not in deferred
+            and (
+                f.attname not in loaded or loaded[f.attname] != getattr(self, f.attname)
+            )
+        }
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # post_save handlers have seen the old snapshot; now roll it forward
+        update_fields = kwargs.get("update_fields")
+        snapshot = dict(self.loaded_values)
+        deferred = self.get_deferred_fields()
+        for field in self._meta.concrete_fields:
+            if update_fields is not None and field.name not in update_fields:
+                continue
+            if field.attname not in deferred:
+                snapshot[field.attname] = getattr(self, field.attname)
+        self._loaded_values = snapshot
+
+
+class ThreadPositionMixin:
+    """Thread helpers shared by Message and ArchivedMessage."""
+
+    @property
+    def thread_root_pk(self):
+        """Id of the root message of the thread this message belongs to."""
+        return self.thread_root_id or self.pk
+
+    @property
+    def descendant_path(self):
+        """Path prefix shared by every reply below this message."""
+        return self.path + path_segment(self.pk)
+
+
+class Message(ThreadPositionMixin, LoadedStateMixin, models.Model):
     """Simple message sent from one user to another."""
 
     sender = models.ForeignKey(
@@ -16,49 +114,179 @@ class Message(models.Model):
     )
     content = models.TextField()
     edited = models.BooleanField(default=False)
+    # Number of recorded edits; numbers the next MessageHistory entry
+    edit_count = models.PositiveIntegerField(default=0, editable=False)
     parent_message = models.ForeignKey(
         "self", related_name="replies", null=True, blank=True, on_delete=models.CASCADE
     )
+    # Materialized thread position, filled in on insert (see signals.py).
+    # `thread_root` is NULL for root messages, `path` holds the ids of all
+    # ancestors (root first) and `depth` is 0 for roots.
+    thread_root = models.ForeignKey(
+        "self",
+        related_name="thread_messages",
+        null=True,
+        blank=True,
+        editable=False,
+        on_delete=models.CASCADE,
+    )
+    path = models.TextField(blank=True, default="", editable=False)
+    depth = models.PositiveIntegerField(default=0, editable=False)
     read = models.BooleanField(default=False)
+    # declare the default manager first so `objects` stays the default manager
+    objects = MessageQuerySet.as_manager()
     # expose the unread manager on the model class for static analysis/tools
     unread = UnreadMessagesManager()
     timestamp = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         ordering = ["-timestamp"]
+        # Composite indexes for the hot listing paths. The primary key is
+        # implicitly the last column of every secondary index on SQLite and
+        # InnoDB, so the (timestamp, id) keyset order is served without a sort.
+        indexes = [
+            # Message.unread.unread_for_user(): unread rows of a receiver,
+            # newest first. `read=False` compiles to `NOT read`, which cannot
+            # seek a composite index, so this is a partial index instead.
+            models.Index(
+                fields=["receiver", "timestamp"],
+                condition=models.Q(read=False),
+                name="msg_unread_receiver_ts_idx",
+            ),
+            # Thread root listing: parent_message IS NULL, newest first
+            models.Index(
+                fields=["parent_message", "timestamp"],
+                name="msg_parent_ts_idx",
+            ),
+        ]
 
     def __str__(self):
         return f"From {self.sender} to {self.receiver} at {self.timestamp}"
 
+    def save(self, *args, **kwargs):
+        if self._state.adding or self.loaded_values.get("content") == self.content:
+            return super().save(*args, **kwargs)
+        # An edit: `log_message_edit` locks the row; hold the lock until the
+        # new content is written
+        with transaction.atomic(using=kwargs.get("using")):
+            return super().save(*args, **kwargs)
+
     def history(self):
-        """Return QuerySet of MessageHistory entries for this message ordered newest first."""
-        return MessageHistory.objects.filter(message=self).order_by("-edited_at")
+        """Return QuerySet of MessageHistory entries for this message ordered newest first.
+
+        Each entry's `old_content` is reconstructed lazily when read, from the
+        entry fetched before it (or this message's content) without further
+        queries.
+        """
+        return self.history_entries.order_by("-pk")
+
+    def assign_thread_position(self, parent=None):
+        """Fill `thread_root`, `path` and `depth` from the parent message.
+
+        Called before insert; `parent` defaults to `parent_message` so callers
+        that already hold the parent (e.g. bulk paths) avoid an extra query.
+        """
+        parent = parent if parent is not None else self.parent_message
+        if parent is None:
+            self.thread_root_id = None
+            self.path = ""
+            self.depth = 0
+            return
+        self.thread_root_id = parent.thread_root_pk
+        self.path = parent.descendant_path
+        self.depth = parent.depth + 1
+
+    def descendants(self, max_depth=None):
+        """Return a QuerySet of all replies below this message.
+
+        A single indexed query on `thread_root`; for non-root messages the
+        subtree is narrowed with a prefix match on `path`. `max_depth` limits
+        the result to replies at most that many levels below this message.
+        """
+        qs = Message.objects.filter(thread_root_id=self.thread_root_pk)
+        if self.thread_root_id is not None:
+            qs = qs.filter(path__startswith=self.descendant_path)
+        if max_depth is not None:
+            qs = qs.filter(depth__lte=self.depth + max_depth)
+        return qs
+
+    def subtree_count(self):
+        """Return the number of replies below this message (one COUNT query)."""
+        return self.descendants().count()
 
-    def get_thread(self):
+    def get_thread(self, max_depth=None):
         """Return this message and all replies recursively as a nested dict.
 
-        Note: This method uses the `replies` related_name and will be efficient
-        if the caller prefetched `replies` and `replies__sender` via
-        `prefetch_related('replies', 'replies__replies')` or similar.
+        All descendants are loaded with one query (or taken from the
+        `thread_messages` prefetch set up by `fetch_thread_root_messages`) and
+        the tree is assembled in memory.
         """
+        prefetched = getattr(self, "_prefetched_objects_cache", {})
+        if self.thread_root_id is None and "thread_messages" in prefetched:
+            msgs = list(self.thread_messages.all())
+            if max_depth is not None:
+                msgs = [m for m in msgs if m.depth <= max_depth]
+        else:
+            msgs = list(
+                self.descendants(max_depth)
+                .select_related("sender", "receiver")
+                .order_by("path", "pk")
+            )
+
+        children = {}
+        for m in msgs:
+            children.setdefault(m.parent_message_id, []).append(m)
 
         def _gather(msg):
-            return {"message": msg, "replies": [_gather(r) for r in msg.replies.all()]}
+            return {
+                "message": msg,
+                "replies": [_gather(r) for r in children.get(msg.pk, [])],
+            }
 
         return _gather(self)
 
     @staticmethod
     def fetch_thread_root_messages(qs=None):
-        """Return queryset of root messages (no parent) with replies prefetched.
+        """Return queryset of root messages (no parent) with threads prefetched.
 
-        Use select_related for FK to user and prefetch_related for replies to
-        minimize query count when rendering threads.
+        Every descendant of every root is loaded with a single extra query via
+        the `thread_messages` relation, so `get_thread()` on the results runs
+        no further queries.
         """
         qs = qs if qs is not None else Message.objects.all()
+        thread_qs = Message.objects.select_related("sender", "receiver").order_by(
+            "path", "pk"
+        )
         return (
             qs.filter(parent_message__isnull=True)
             .select_related("sender", "receiver")
-            .prefetch_related("replies", "replies__sender", "replies__replies")
+            .prefetch_related(models.Prefetch("thread_messages", queryset=thread_qs))
+        )
+
+    @staticmethod
+    def fetch_thread_summaries(qs=None):
+        """Return queryset of root messages annotated with their `reply_count`.
+
+        For listings: the count is a correlated subquery evaluated for the
+        roots of the page only, and no reply is loaded (unlike
+        `fetch_thread_root_messages`, which is for rendering whole threads).
+        """
+        qs = qs if qs is not None else Message.objects.all()
+        replies = (
+            Message.objects.filter(thread_root=models.OuterRef("pk"))
+            .order_by()
+            .values("thread_root")
+            .annotate(n=models.Count("pk"))
+            .values("n")
+        )
+        return (
+            qs.filter(parent_message__isnull=True)
+            .select_related("sender", "receiver")
+            .annotate(
+                reply_count=Coalesce(
+                    models.Subquery(replies, output_field=models.IntegerField()), 0
+                )
+            )
         )
 
     read = models.BooleanField(default=False)
@@ -67,7 +295,7 @@ class Message(models.Model):
 # Note: `unread` manager is declared as a class attribute on Message above.
 
 
-class Notification(models.Model):
+class Notification(LoadedStateMixin, models.Model):
     """Notification created when a user receives a Message."""
 
     user = models.ForeignKey(
@@ -78,28 +306,355 @@ class Notification(models.Model):
     )
     read = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Coalescing (MESSAGING_NOTIFICATION_COALESCE): the number of messages
+    # folded into this notification, `message` being the newest of them.
+    # `coalesce_key` names the conversation while the row is unread and is
+    # cleared once it is read, so there is at most one unread row per key.
+    count = models.PositiveIntegerField(default=1)
+    coalesce_key = models.CharField(
+        max_length=64, null=True, blank=True, editable=False
+    )
+
+    objects = NotificationManager()
 
     class Meta:
         ordering = ["-created_at"]
+        indexes = [
+            # Notification listing: a user's (unread) notifications, newest
+            # first; `read` is filtered on the rows read in index order
+            models.Index(
+                fields=["user", "created_at"],
+                name="notif_user_created_idx",
+            ),
+        ]
+        constraints = [
+            # Makes queued notification delivery idempotent under retries
+            models.UniqueConstraint(
+                fields=["user", "message"], name="notif_unique_user_message"
+            ),
+            # One unread coalesced notification per conversation; read rows
+            # have a NULL key, which never conflicts
+            models.UniqueConstraint(
+                fields=["user", "coalesce_key"], name="notif_unique_user_coalesce"
+            ),
+        ]
 
     def __str__(self):
         return f"Notification for {self.user} - message {self.message.pk}"
 
+    def save(self, *args, **kwargs):
+        if self.read and self.coalesce_key is not None:
+            self.coalesce_key = None
+            update_fields = kwargs.get("update_fields")
+            if update_fields is not None and "coalesce_key" not in update_fields:
+                kwargs["update_fields"] = [*update_fields, "coalesce_key"]
+        super().save(*args, **kwargs)
+
 
 class MessageHistory(models.Model):
-    """Keeps previous versions of a Message before edits."""
+    """Keeps previous versions of a Message before edits.
+
+    The old content is stored either whole in `snapshot` or as a reverse
+    `delta` against the next newer version (see `messaging.history`); read
+    it through `old_content`. Assigning `old_content` stores a snapshot, use
+    `set_content` to store a delta.
+    """
 
     message = models.ForeignKey(
         Message, related_name="history_entries", on_delete=models.CASCADE
     )
-    old_content = models.TextField()
+    snapshot = models.TextField(blank=True)
+    delta = models.JSONField(null=True, blank=True)
+    # `content_hash` of the version `delta` applies to ("" for snapshots)
+    target_hash = models.CharField(max_length=16, blank=True, default="")
+    # 1-based number of the edit within its message
+    seq = models.PositiveIntegerField(default=0)
     edited_at = models.DateTimeField(auto_now_add=True)
     edited_by = models.ForeignKey(
         settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL
     )
 
+    objects = MessageHistoryQuerySet.as_manager()
+
+    # The next newer entry of the same message, linked while iterating
+    _newer = None
+
     class Meta:
         ordering = ["-edited_at"]
+        constraints = [
+            # Two concurrent edits of a message cannot both record edit n
+            models.UniqueConstraint(
+                fields=["message", "seq"], name="history_unique_message_seq"
+            ),
+        ]
+
+    def __str__(self):
+        return f"History for message {self.message_id} at {self.edited_at}"
+
+    def set_content(self, old_content, newer_content):
+        """Store `old_content` as a delta against `newer_content` when worthwhile."""
+        self.snapshot, self.delta = encode(old_content, newer_content, self.seq)
+        self.target_hash = "" if self.delta is None else content_hash(newer_content)
+        self._old_content = old_content
+
+    @property
+    def old_content(self):
+        if "_old_content" not in self.__dict__:
+            self._old_content = self._reconstruct()
+            self._newer = None
+        return self._old_content
+
+    @old_content.setter
+    def old_content(self, value):
+        self.snapshot, self.delta = value, None
+        self.target_hash = ""
+        self._old_content = value
+
+    def _message_content(self):
+        if MessageHistory.message.is_cached(self):
+            message = self.message
+            return message.loaded_values.get("content", message.content)
+        return Message.objects.values_list("content", flat=True).get(pk=self.message_id)
+
+    def _reconstruct(self):
+        if self.delta is None:
+            return self.snapshot
+        if self._newer is not None:
+            newer = self._newer.old_content
+            if fits(newer, self.target_hash):
+                return apply_delta(newer, self.delta)
+        elif MessageHistory.message.is_cached(self):
+            message = self.message
+            if self.seq == message.loaded_values.get("edit_count"):
+                # The newest entry: a delta against the message's content
+                newer = self._message_content()
+                if fits(newer, self.target_hash):
+                    return apply_delta(newer, self.delta)
+
+        # Replay the newer entries up to the nearest snapshot (at most the
+        # snapshot interval), or from the message's content if there is none.
+        newer = MessageHistory.objects.filter(
+            message_id=self.message_id, pk__gt=self.pk
+        )
+        snapshot_pk = (
+            newer.filter(delta__isnull=True)
+            .order_by("pk")
+            .values_list("pk", flat=True)
+            .first()
+        )
+        if snapshot_pk is not None:
+            newer = newer.filter(pk__lte=snapshot_pk)
+        chain = newer.order_by("-pk").values("snapshot", "delta", "target_hash")
+        content = self._message_content() if snapshot_pk is None else None
+        for content in reconstruct(content, chain):
+            pass
+        if fits(content, self.target_hash):
+            return apply_delta(content, self.delta)
+        return self._nearest_snapshot(default=content)
+
+    def _nearest_snapshot(self, default):
+        # The version this delta applies to was never recorded: the closest
+        # full text is the best answer left, older snapshots first
+        snapshots = MessageHistory.objects.filter(
+            message_id=self.message_id, delta__isnull=True
+        )
+        for qs in (
+            snapshots.filter(pk__lt=self.pk).order_by("-pk"),
+            snapshots.filter(pk__gt=self.pk).order_by("pk"),
+        ):
+            snapshot = qs.values_list("snapshot", flat=True).first()
+            if snapshot is not None:
+                return snapshot
+        return default
+
+
+class UnreadCounter(models.Model):
+    """Denormalized unread counts of a user, kept current by messaging.signals.
+
+    Reading a badge is a primary-key lookup instead of a COUNT(*) over
+    Message/Notification. `reconcile_unread_counters` repairs any drift.
+    """
+
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        primary_key=True,
+        related_name="unread_counter",
+        on_delete=models.CASCADE,
+    )
+    unread_messages = models.IntegerField(default=0)
+    unread_notifications = models.IntegerField(default=0)
+
+    objects = UnreadCounterManager()
+
+    def __str__(self):
+        return (
+            f"Unread for {self.user_id}: {self.unread_messages} messages, "
+            f"{self.unread_notifications} notifications"
+        )
+
+
+class ThreadTree(models.Model):
+    """Compact structure of one thread, maintained incrementally by messaging.signals.
+
+    Parallel arrays in insertion order: message ids (None once deleted),
+    the index of each node's parent in `ids` (-1 for the root) and sender
+    ids. Rendering a thread needs this row plus one batched fetch of the
+    message bodies instead of rebuilding the tree from the messages.
+    """
+
+    root = models.OneToOneField(
+        Message, primary_key=True, related_name="tree", on_delete=models.CASCADE
+    )
+    ids = models.JSONField(default=list)
+    parents = models.JSONField(default=list)
+    senders = models.JSONField(default=list)
+
+    objects = ThreadTreeManager()
+
+    def __str__(self):
+        return f"Tree of thread {self.root_id} ({len(self.ids)} nodes)"
+
+    def children(self):
+        """Return ``{index: [child indexes]}`` for the live nodes."""
+        children = {}
+        for i, parent in enumerate(self.parents):
+            if self.ids[i] is not None and parent >= 0:
+                children.setdefault(parent, []).append(i)
+        return children
+
+    def _index(self, pk):
+        """Return the slot of `pk`, rebuilding the tree first if it lacks it."""
+        if pk not in self.ids:
+            # Read before the message was added; `build` also stores the fix
+            fresh = ThreadTree.objects.build(self.root_id)
+            self.ids, self.parents, self.senders = (
+                fresh.ids,
+                fresh.parents,
+                fresh.senders,
+            )
+        return self.ids.index(pk)
+
+    def subtree_ids(self, pk):
+        """Return the ids of `pk` and every live node below it, parents first."""
+        start = self._index(pk)
+        children = self.children()
+        order, stack = [], [start]
+        while stack:
+            i = stack.pop()
+            order.append(self.ids[i])
+            stack.extend(reversed(children.get(i, [])))
+        return order
+
+    def nested(self, pk=None):
+        """Return the subtree of `pk` (default: the root) as nested dicts.
+
+        Same shape as `Message.get_thread`; message bodies are fetched with
+        one batched `in_bulk` query.
+        """
+        pk = self.root_id if pk is None else pk
+        messages = Message.objects.select_related("sender", "receiver").in_bulk(
+            self.subtree_ids(pk)
+        )
+        children = self.children()
+
+        def _gather(i):
+            return {
+                "message": messages[self.ids[i]],
+                "replies": [
+                    _gather(c) for c in children.get(i, []) if self.ids[c] in messages
+                ],
+            }
+
+        return _gather(self._index(pk))
+
+
+def _archived_user_fk(related_name="+", **kwargs):
+    # Archive rows keep the user ids without a constraint;
+    # `messaging.deletion` removes them explicitly
+    return models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        related_name=related_name,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        **kwargs,
+    )
+
+
+class ArchivedMessage(ThreadPositionMixin, models.Model):
+    """A Message moved out of the hot table by `messaging.archive`.
+
+    Same columns and primary key as the Message it was; whole threads are
+    archived together, so every reply's parent is archived as well.
+    """
+
+    id = models.BigIntegerField(primary_key=True)
+    sender = _archived_user_fk()
+    receiver = _archived_user_fk()
+    content = models.TextField()
+    edited = models.BooleanField(default=False)
+    edit_count = models.PositiveIntegerField(default=0)
+    parent_message = models.ForeignKey(
+        "self",
+        related_name="replies",
+        null=True,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+    )
+    thread_root = models.ForeignKey(
+        "self",
+        related_name="thread_messages",
+        null=True,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+    )
+    path = models.TextField(blank=True, default="")
+    depth = models.PositiveIntegerField(default=0)
+    read = models.BooleanField(default=False)
+    timestamp = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ["-timestamp"]
+
+    def __str__(self):
+        return f"Archived message {self.pk} at {self.timestamp}"
+
+
+class ArchivedNotification(models.Model):
+    """A Notification archived together with its message."""
+
+    id = models.BigIntegerField(primary_key=True)
+    user = _archived_user_fk()
+    message = models.ForeignKey(
+        ArchivedMessage,
+        related_name="notifications",
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+    )
+    read = models.BooleanField(default=False)
+    created_at = models.DateTimeField()
+    count = models.PositiveIntegerField(default=1)
+
+    def __str__(self):
+        return f"Archived notification for message {self.message_id}"
+
+
+class ArchivedMessageHistory(models.Model):
+    """A MessageHistory entry archived together with its message."""
+
+    id = models.BigIntegerField(primary_key=True)
+    message = models.ForeignKey(
+        ArchivedMessage,
+        related_name="history_entries",
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+    )
+    snapshot = models.TextField(blank=True)
+    delta = models.JSONField(null=True, blank=True)
+    target_hash = models.CharField(max_length=16, blank=True, default="")
+    seq = models.PositiveIntegerField(default=0)
+    edited_at = models.DateTimeField()
+    edited_by = _archived_user_fk(null=True)
 
     def __str__(self):
-        return f"History for message {self.message.pk} at {self.edited_at}"
+        return f"Archived history for message {self.message_id} at {self.edited_at}"
@@ -0,0 +1,120 @@
+"""Keyset (cursor) pagination for message listings.
+
+Pages are keyed on ``(timestamp, id)`` to match ``Message.Meta.ordering``
+(newest first, id as tie-breaker). Each page is fetched with a range
+predicate on the key instead of ``OFFSET``, so deep pages cost the same as
+the first one. Cursors are opaque url-safe strings.
+"""
+
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from django.db.models import Q
+
+DEFAULT_PAGE_SIZE = 50
+
+
+class InvalidCursor(ValueError):
+    """Raised when a cursor string cannot be decoded."""
+
+
+def encode_cursor(obj, direction):
+    """Return an opaque cursor pointing at `obj` for the given direction."""
+    payload = {"t": obj.timestamp.isoformat(), "i": obj.pk, "d": direction}
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Return ``(timestamp, pk, direction)`` decoded from a cursor string."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        payload = json.loads(raw)
+        direction = payload["d"]
+        if direction not in ("next", "prev"):
+            raise ValueError(direction)
+        return datetime.fromisoformat(payload["t"]), int(payload["i"]), direction
+    except (binascii.Error, ValueError, KeyError, TypeError) as exc:
+        raise InvalidCursor(f"Invalid cursor: {cursor!r}") from exc
+
+
+class KeysetPage:
+    """One page of results plus the cursors of its neighbouring pages."""
+
+    def __init__(self, object_list, next_cursor=None, prev_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.prev_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+def _page_query(queryset, cursor, per_page):
+    """Return ``(rows queryset, direction)`` for the page selected by `cursor`."""
+    direction = "next"
+    if cursor:
+        timestamp, pk, direction = decode_cursor(cursor)
+        if direction == "next":
+            queryset = queryset.filter(
+                Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, pk__lt=pk)
+            )
+        else:
+            queryset = queryset.filter(
+                Q(timestamp__gt=timestamp) | Q(timestamp=timestamp, pk__gt=pk)
+            )
+
+    if direction == "next":
+        return queryset.order_by("-timestamp", "-pk")[: per_page + 1], direction
+    return queryset.order_by("timestamp", "pk")[: per_page + 1], direction
+
+
+def _make_page(rows, cursor, direction, per_page):
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if direction == "prev":
+        rows.reverse()
+    if not rows:
+        return KeysetPage(rows)
+
+    # Moving forwards there is a previous page whenever we started from a
+    # cursor; moving backwards there is always a next page.
+    if direction == "next":
+        has_next, has_previous = has_more, bool(cursor)
+    else:
+        has_next, has_previous = True, has_more
+
+    return KeysetPage(
+        rows,
+        next_cursor=encode_cursor(rows[-1], "next") if has_next else None,
+        prev_cursor=encode_cursor(rows[0], "prev") if has_previous else None,
+    )
+
+
+def paginate_keyset(queryset, cursor=None, per_page=DEFAULT_PAGE_SIZE):
+    """Return a `KeysetPage` of `queryset` ordered newest first.
+
+    `cursor` is a value previously returned as `next_cursor`/`prev_cursor`
+    (or None for the first page). Only ``per_page + 1`` rows are fetched.
+    """
+    rows, direction = _page_query(queryset, cursor, per_page)
+    return _make_page(list(rows), cursor, direction, per_page)
+
+
+async def apaginate_keyset(queryset, cursor=None, per_page=DEFAULT_PAGE_SIZE):
+    """Async version of `paginate_keyset`, fetching through the async ORM."""
+    rows, direction = _page_query(queryset, cursor, per_page)
+    return _make_page([row async for row in rows], cursor, direction, per_page)
@@ -0,0 +1,214 @@
+"""Full-text search over `Message.content`.
+
+One interface, one backend per database vendor:
+
+* SQLite: an FTS5 table ``messaging_message_fts`` keyed by message id,
+  kept in step by the Message save/delete signals and ranked with bm25.
+* MySQL: a FULLTEXT index on ``messaging_message.content``, maintained by
+  the server, ranked by ``MATCH ... AGAINST`` relevance.
+* Anything else: an unranked ``icontains`` scan, so callers always work.
+
+The FTS table and FULLTEXT index are created by migration 0007;
+`rebuild_search_index` re-indexes existing rows in batches, then prunes
+rows of deleted messages.
+"""
+
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from .models import Message
+
+FTS_TABLE = "messaging_message_fts"
+FULLTEXT_INDEX = "msg_content_fulltext"
+DEFAULT_LIMIT = 50
+
+
+class BaseSearchBackend:
+    """Interface shared by the search backends."""
+
+    # Whether index rows must be written by the application
+    maintains_index = False
+
+    def index(self, rows):
+        """Add or replace ``(message_id, content)`` rows in the index."""
+
+    def remove(self, message_ids):
+        """Drop the given message ids from the index."""
+
+    def clear(self):
+        """Empty the index."""
+
+    def prune(self):
+        """Drop index rows of messages that no longer exist; return their number."""
+        return 0
+
+    def search_ids(self, query, user=None, limit=DEFAULT_LIMIT):
+        """Return ids of messages matching `query`, best match first.
+
+        With `user`, only messages they sent or received are considered;
+        ``limit=None`` returns every match.
+        """
+        raise NotImplementedError
+
+    def match_filter(self, query, lookup="pk"):
+        """Return a Q matching rows whose `lookup` is the id of a matching message.
+
+        The match runs as a subquery, so no id list goes through Python.
+        """
+        return Q(**{f"{lookup}__in": self.search_ids(query, limit=None)})
+
+
+class SQLiteFTS5Backend(BaseSearchBackend):
+    maintains_index = True
+
+    @staticmethod
+    def _match_expression(query):
+        # Quote every term so user input can never be FTS5 query syntax;
+        # the terms are ANDed together.
+        return " ".join('"' + term.replace('"', '""') + '"' for term in query.split())
+
+    def index(self, rows):
+        rows = list(rows)
+        if not rows:
+            return
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [(pk,) for pk, _ in rows]
+            )
+            cursor.executemany(
+                f"INSERT INTO {FTS_TABLE} (rowid, content) VALUES (%s, %s)", rows
+            )
+
+    def remove(self, message_ids):
+        message_ids = list(message_ids)
+        if not message_ids:
+            return
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"DELETE FROM {FTS_TABLE} WHERE rowid = %s",
+                [(pk,) for pk in message_ids],
+            )
+
+    def clear(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE}")
+
+    def prune(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"DELETE FROM {FTS_TABLE} WHERE rowid NOT IN "
+                f"(SELECT id FROM {Message._meta.db_table})"
+            )
+            return cursor.rowcount
+
+    def search_ids(self, query, user=None, limit=DEFAULT_LIMIT):
+        match = self._match_expression(query)
+        if not match:
+            return []
+        sql = (
+            f"SELECT m.id FROM {FTS_TABLE} f "
+            f"JOIN {Message._meta.db_table} m ON m.id = f.rowid "
+            f"WHERE {FTS_TABLE} MATCH %s"
+        )
+        params = [match]
+        if user is not None:
+            sql += " AND (m.sender_id = %s OR m.receiver_id = %s)"
+            params += [user.pk, user.pk]
+        sql += f" ORDER BY bm25({FTS_TABLE})"
+        if limit is not None:
+            sql += " LIMIT %s"
+            params.append(limit)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return [row[0] for row in cursor.fetchall()]
+
+    def match_filter(self, query, lookup="pk"):
+        match = self._match_expression(query)
+        if not match:
+            return Q(pk__in=[])
+        return Q(
+            **{
+                f"{lookup}__in": RawSQL(
+                    f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s",
+                    [match],
+                )
+            }
+        )
+
+
+class MySQLFullTextBackend(BaseSearchBackend):
+    def search_ids(self, query, user=None, limit=DEFAULT_LIMIT):
+        if not query.strip():
+            return []
+        sql = (
+            f"SELECT id FROM {Message._meta.db_table} "
+            "WHERE MATCH(content) AGAINST (%s IN NATURAL LANGUAGE MODE)"
+        )
+        params = [query]
+        if user is not None:
+            sql += " AND (sender_id = %s OR receiver_id = %s)"
+            params += [user.pk, user.pk]
+        sql += " ORDER BY MATCH(content) AGAINST (%s IN NATURAL LANGUAGE MODE) DESC"
+        params.append(query)
+        if limit is not None:
+            sql += " LIMIT %s"
+            params.append(limit)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return [row[0] for row in cursor.fetchall()]
+
+    def match_filter(self, query, lookup="pk"):
+        if not query.strip():
+            return Q(pk__in=[])
+        return Q(
+            **{
+                f"{lookup}__in": RawSQL(
+                    f"SELECT id FROM {Message._meta.db_table} "
+                    "WHERE MATCH(content) AGAINST (%s IN NATURAL LANGUAGE MODE)",
+                    [query],
+                )
+            }
+        )
+
+
+class ScanBackend(BaseSearchBackend):
+    """Unindexed fallback for databases without a full-text backend."""
+
+    def search_ids(self, query, user=None, limit=DEFAULT_LIMIT):
+        terms = query.split()
+        if not terms:
+            return []
+        qs = Message.objects.all()
+        for term in terms:
+            qs = qs.filter(content__icontains=term)
+        if user is not None:
+            qs = qs.filter(Q(sender=user) | Q(receiver=user))
+        return list(qs.values_list("pk", flat=True)[:limit])
+
+    def match_filter(self, query, lookup="pk"):
+        terms = query.split()
+        if not terms:
+            return Q(pk__in=[])
+        qs = Message.objects.all()
+        for term in terms:
+            qs = qs.filter(content__icontains=term)
+        return Q(**{f"{lookup}__in": qs.values("pk")})
+
+
+_BACKENDS = {
+    "sqlite": SQLiteFTS5Backend,
+    "mysql": MySQLFullTextBackend,
+}
+
+
+def get_backend():
+    """Return the search backend for the default database."""
+    return _BACKENDS.get(connection.vendor, ScanBackend)()
+
+
+def search_messages(query, user=None, limit=DEFAULT_LIMIT):
+    """Return matching messages (sender/receiver loaded), best match first."""
+    ids = get_backend().search_ids(query, user=user, limit=limit)
+    found = Message.objects.select_related("sender", "receiver").in_bulk(ids)
+    return [found[pk] for pk in ids if pk in found]
@@ -0,0 +1,240 @@
+"""Synthetic messaging data for load tests and benchmarks.
+
+`seed_dataset` writes users, threaded messages, their notifications, edit
+history and unread counters with batched `bulk_create` calls. Message ids
+are assigned up front so thread positions (`thread_root`, `path`, `depth`)
+can be computed in Python instead of by the per-row ``pre_save`` signal.
+
+Shape of the data:
+
+* Users have skewed activity: low-numbered users send and receive far more
+  than the rest, so "heavy" users exist for deletion and inbox benchmarks.
+* A message is a reply with probability `reply_rate`. Replies join one of
+  the threads active among the last `active_window` messages, with
+  probability proportional to that recent activity: busy threads grow
+  busier (a heavy-tailed size distribution) until they go quiet. Within
+  the thread a reply answers the newest message with probability
+  `deepen_rate` (long chains) and a random message otherwise (fan-out);
+  nothing is nested below `max_depth`.
+* A fraction `edit_rate` of the messages is edited 1 to `max_edits` times.
+* A fraction `read_rate` of the messages (and their notifications) is read.
+
+Everything is driven by one `random.Random(seed)`, so a given set of
+parameters always produces the same dataset.
+"""
+
+import random
+from collections import deque
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.color import no_style
+from django.db import connection, transaction
+
+from .dispatch import coalesce_key, get_coalesce_mode
+from .models import (
+    ArchivedMessage,
+    Message,
+    MessageHistory,
+    Notification,
+    UnreadCounter,
+    path_segment,
+)
+from .search import get_backend as get_search_backend
+
+DEFAULTS = {
+    "users": 100,
+    "messages": 5000,
+    "reply_rate": 0.7,
+    "deepen_rate": 0.5,
+    "max_depth": 8,
+    "active_window": 1000,
+    "edit_rate": 0.1,
+    "max_edits": 5,
+    "read_rate": 0.5,
+    "prefix": "seed-user-",
+    "seed": 0,
+    "batch_size": 1000,
+}
+
+_WORDS = (
+    "hello thanks meeting tomorrow project update review draft deadline "
+    "lunch coffee call notes plan budget release bug fix test deploy "
+    "question answer idea agenda report weekend travel photo link file"
+).split()
+
+
+def _text(rng, low=4, high=30):
+    return " ".join(rng.choice(_WORDS) for _ in range(rng.randint(low, high)))
+
+
+def _edit(rng, content):
+    words = content.split()
+    words[rng.randrange(len(words))] = rng.choice(_WORDS)
+    if rng.random() < 0.5:
+        words.append(rng.choice(_WORDS))
+    return " ".join(words)
+
+
+def _next_pk():
+    # Archived messages keep their ids, so new ids must stay above them too
+    return (
+        max(
+            Message.objects.order_by("-pk").values_list("pk", flat=True).first() or 0,
+            ArchivedMessage.objects.order_by("-pk").values_list("pk", flat=True).first()
+            or 0,
+        )
+        + 1
+    )
+
+
+def _create_users(count, prefix, batch_size):
+    user_model = get_user_model()
+    password = make_password(None)
+    user_model.objects.bulk_create(
+        (user_model(username=f"{prefix}{i}", password=password) for i in range(count)),
+        batch_size=batch_size,
+    )
+    # Re-read: MySQL cannot return ids from a bulk INSERT
+    return list(
+        user_model.objects.filter(username__startswith=prefix)
+        .order_by("pk")
+        .values_list("pk", flat=True)
+    )
+
+
+def seed_dataset(progress=None, **params):
+    """Create a synthetic dataset; return the number of rows written per kind.
+
+    Keyword arguments override `DEFAULTS`. `prefix` must not be used by
+    existing usernames. `progress`, if given, is called with the running
+    totals after every batch of messages.
+    """
+    unknown = set(params) - set(DEFAULTS)
+    if unknown:
+        raise TypeError(f"Unknown dataset parameters: {sorted(unknown)}")
+    p = {**DEFAULTS, **params}
+    if p["users"] < 2:
+        raise ValueError("A dataset needs at least two users")
+    rng = random.Random(p["seed"])
+    batch_size = p["batch_size"]
+    search_backend = get_search_backend()
+    coalesce_mode = get_coalesce_mode()
+
+    with transaction.atomic():
+        user_ids = _create_users(p["users"], p["prefix"], batch_size)
+
+        def pick_user(exclude=None):
+            # Quadratic skew: the first users are by far the most active
+            while True:
+                user_id = user_ids[int(len(user_ids) * rng.random() ** 2)]
+                if user_id != exclude:
+                    return user_id
+
+        # Per thread: (pk, depth, descendant_path, sender_id, receiver_id)
+        threads = {}
+        # Thread roots of the latest messages; sampling it uniformly picks a
+        # thread with probability proportional to its recent activity
+        message_roots = deque(maxlen=p["active_window"])
+        next_pk = _next_pk()
+        totals = {
+            "users": len(user_ids),
+            "threads": 0,
+            "messages": 0,
+            "history": 0,
+            "notifications": 0,
+        }
+
+        for start in range(0, p["messages"], batch_size):
+            messages, history = [], []
+            for _ in range(min(batch_size, p["messages"] - start)):
+                pk, next_pk = next_pk, next_pk + 1
+                message = Message(pk=pk, content=_text(rng))
+                if message_roots and rng.random() < p["reply_rate"]:
+                    nodes = threads[rng.choice(message_roots)]
+                    if rng.random() < p["deepen_rate"]:
+                        parent = nodes[-1]
+                    else:
+                        parent = rng.choice(nodes)
+                    if parent[1] >= p["max_depth"]:
+                        parent = nodes[0]
+                    parent_pk, depth, descendant_path, p_sender, p_receiver = parent
+                    root_pk = nodes[0][0]
+                    message.parent_message_id = parent_pk
+                    message.thread_root_id = root_pk
+                    message.path = descendant_path
+                    message.depth = depth + 1
+                    # Mostly an answer from the parent's receiver
+                    if rng.random() < 0.8:
+                        message.sender_id = p_receiver
+                    else:
+                        message.sender_id = pick_user(exclude=p_sender)
+                    message.receiver_id = p_sender
+                else:
+                    root_pk = pk
+                    message.sender_id = pick_user()
+                    message.receiver_id = pick_user(exclude=message.sender_id)
+                    threads[pk] = []
+                    totals["threads"] += 1
+                threads[root_pk].append(
+                    (
+                        pk,
+                        message.depth,
+                        message.path + path_segment(pk),
+                        message.sender_id,
+                        message.receiver_id,
+                    )
+                )
+                message_roots.append(root_pk)
+                message.read = rng.random() < p["read_rate"]
+
+                if rng.random() < p["edit_rate"]:
+                    edits = rng.randint(1, p["max_edits"])
+                    for seq in range(1, edits + 1):
+                        entry = MessageHistory(
+                            message_id=pk, seq=seq, edited_by_id=message.sender_id
+                        )
+                        new_content = _edit(rng, message.content)
+                        entry.set_content(message.content, new_content)
+                        history.append(entry)
+                        message.content = new_content
+                    message.edited = True
+                    message.edit_count = edits
+                messages.append(message)
+
+            Message.objects.bulk_create(messages)
+            MessageHistory.objects.bulk_create(history)
+            notifications = []
+            for m in messages:
+                notification = Notification(
+                    user_id=m.receiver_id, message_id=m.pk, read=m.read
+                )
+                if coalesce_mode != "off" and not m.read:
+                    notification.coalesce_key = coalesce_key(
+                        coalesce_mode, m.pk, m.sender_id, m.thread_root_id
+                    )
+                notifications.append(notification)
+            # A coalesced conversation already holding an unread row keeps it
+            Notification.objects.bulk_create(notifications, ignore_conflicts=True)
+            if search_backend.maintains_index:
+                search_backend.index((m.pk, m.content) for m in messages)
+
+            totals["messages"] += len(messages)
+            totals["history"] += len(history)
+            totals["notifications"] += len(notifications)
+            if progress is not None:
+                progress(dict(totals))
+
+        # Explicit ids do not advance sequences on PostgreSQL
+        reset_sql = connection.ops.sequence_reset_sql(
+            no_style(), [Message, MessageHistory, Notification]
+        )
+        if reset_sql:
+            with connection.cursor() as cursor:
+                for sql in reset_sql:
+                    cursor.execute(sql)
+
+        # bulk_create skips the post_save hook that creates counters
+        for i in range(0, len(user_ids), batch_size):
+            UnreadCounter.objects.reconcile(user_ids[i : i + batch_size])
+    return totals
@@ -2,58 +2,232 @@ from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django.db.models.signals import pre_save
 from django.db.models.signals import post_delete
+from django.db import transaction
+from django.db.models import F, Max, OuterRef, Subquery
 
+from .dispatch import enqueue_notification
+from .events import message_event, notification_event, publish_on_commit
 from .models import Message, Notification
 from .models import MessageHistory
+from .models import ThreadTree
+from .models import UnreadCounter
+from .search import get_backend as get_search_backend
+from .thread_cache import invalidate_threads
 from django.contrib.auth import get_user_model
 
 
-@receiver(post_delete, sender=get_user_model())
-def cleanup_user_related_data(sender, instance, **kwargs):
-    """Ensure messages, notifications and message histories related to a user are removed.
-
-    Note: Many of these will be removed by FK `on_delete=CASCADE` but we explicitly
-    delete related objects that reference the user directly (notifications, history
-    entries where edited_by references the user) to ensure no orphaned data remains.
-    """
-    # Delete notifications that belong to the user
-    Notification.objects.filter(user=instance).delete()
-
-    # Delete message history entries where this user was recorded as the editor
-    MessageHistory.objects.filter(edited_by=instance).delete()
-
-    # Delete messages where the user was sender or receiver (cascades to related objects)
-    Message.objects.filter(sender=instance).delete()
-    Message.objects.filter(receiver=instance).delete()
+@receiver(post_save, sender=get_user_model())
+def create_unread_counter(sender, instance, created, **kwargs):
+    """Start every new user with an empty unread counter row."""
+    if created:
+        UnreadCounter.objects.get_or_create(user=instance)
 
 
 @receiver(post_save, sender=Message)
 def create_notification_on_message(sender, instance, created, **kwargs):
-    """Create a Notification for the receiver whenever a new Message is created."""
+    """Create a Notification for the receiver whenever a new Message is created.
+
+    Depending on MESSAGING_NOTIFICATION_DISPATCH the row is written inline or
+    queued for a worker (see messaging.dispatch).
+    """
     if not created:
         return
 
-    Notification.objects.create(user=instance.receiver, message=instance)
+    enqueue_notification(instance)
 
 
 @receiver(pre_save, sender=Message)
-def log_message_edit(sender, instance, **kwargs):
+def set_thread_position(sender, instance, **kwargs):
+    """Fill the materialized thread path of a Message before it is inserted."""
+    if not instance._state.adding:
+        return
+
+    instance.assign_thread_position()
+
+
+@receiver(pre_save, sender=Message)
+def log_message_edit(sender, instance, update_fields=None, using=None, **kwargs):
     """Before a Message is updated, save the old content into MessageHistory.
 
-    Note: pre_save runs for creates as well; we only act when the instance already
-    exists in the database (i.e., has a PK and is not being created).
+    Saves that leave the content as it was loaded (`LoadedStateMixin`) cost
+    no query. Otherwise the message row is read and locked with one query:
+    the version replaced is the stored content and the edit number follows
+    the stored history, so saving two copies of a message loaded at the
+    same time records two consecutive edits. Creates and saves whose
+    `update_fields` leave out `content` are skipped.
     """
-    if instance.pk is None:
+    if instance._state.adding:
         # New message, nothing to log
         return
-
-    try:
-        old = Message.objects.get(pk=instance.pk)
-    except Message.DoesNotExist:
+    if update_fields is not None and "content" not in update_fields:
         return
 
-    # If content changed, record the old content
-    if old.content != instance.content:
-        MessageHistory.objects.create(message=instance, old_content=old.content)
+    if instance.loaded_values.get("content") == instance.content:
+        return
+    last_seq = (
+        MessageHistory.objects.filter(message_id=OuterRef("pk"))
+        .order_by()
+        .values("message_id")
+        .annotate(seq=Max("seq"))
+        .values("seq")
+    )
+    with transaction.atomic(using=using):
+        stored = (
+            sender.objects.using(using)
+            .select_for_update()
+            .filter(pk=instance.pk)
+            .order_by()
+            .annotate(last_seq=Subquery(last_seq))
+            .values_list("content", "edit_count", "last_seq")
+            .first()
+        )
+        if stored is None or stored[0] == instance.content:
+            return
+        old_content, edit_count, last_seq = stored
+        # Record the old content as a delta against the new one
+        entry = MessageHistory(message=instance, seq=(last_seq or 0) + 1)
+        entry.set_content(old_content, instance.content)
+        entry.save(using=using)
         # mark the message as edited
-        instance.edited = True
+        sender.objects.using(using).filter(pk=instance.pk).update(
+            edited=True, edit_count=F("edit_count") + 1
+        )
+    instance.edited = True
+    instance.edit_count = edit_count + 1
+
+
+@receiver(pre_save, sender=Message)
+@receiver(pre_save, sender=Notification)
+def load_old_read_state(sender, instance, update_fields=None, **kwargs):
+    """Make sure the pre-save `read` value is known to `_unread_delta`.
+
+    Free for loaded instances; others read it from the row before it
+    changes.
+    """
+    if instance._state.adding:
+        return
+    if update_fields is not None and "read" not in update_fields:
+        return
+    instance.loaded_value("read")
+
+
+def _unread_delta(instance, created, update_fields):
+    """Return +1/-1/0: how saving `instance` changed the unread count of its owner."""
+    if created:
+        return 0 if instance.read else 1
+    if update_fields is not None and "read" not in update_fields:
+        return 0
+    old_read = instance.loaded_values.get("read")
+    if old_read is None or old_read == instance.read:
+        return 0
+    return -1 if instance.read else 1
+
+
+@receiver(post_save, sender=Message)
+def update_unread_message_counter(
+    sender, instance, created, update_fields=None, **kwargs
+):
+    """Keep the receiver's unread message counter in step with the Message."""
+    delta = _unread_delta(instance, created, update_fields)
+    if delta:
+        UnreadCounter.objects.adjust(instance.receiver_id, messages=delta)
+
+
+@receiver(post_save, sender=Notification)
+def update_unread_notification_counter(
+    sender, instance, created, update_fields=None, **kwargs
+):
+    """Keep the user's unread notification counter in step with the Notification."""
+    delta = _unread_delta(instance, created, update_fields)
+    if delta:
+        UnreadCounter.objects.adjust(instance.user_id, notifications=delta)
+
+
+@receiver(post_delete, sender=Message)
+def decrement_unread_message_counter(sender, instance, **kwargs):
+    """Deleting an unread Message lowers the receiver's unread counter."""
+    if not instance.read:
+        UnreadCounter.objects.adjust(instance.receiver_id, messages=-1)
+
+
+@receiver(post_delete, sender=Notification)
+def decrement_unread_notification_counter(sender, instance, **kwargs):
+    """Deleting an unread Notification lowers the user's unread counter."""
+    if not instance.read:
+        UnreadCounter.objects.adjust(instance.user_id, notifications=-1)
+
+
+@receiver(post_save, sender=Message)
+def invalidate_thread_cache_on_save(
+    sender, instance, created, update_fields=None, **kwargs
+):
+    """Bump the cached thread's version once a change to one of its messages commits.
+
+    New roots have nothing cached yet, and read-state changes are skipped:
+    unread flags are per viewer and never part of the cached tree.
+    """
+    if created and instance.thread_root_id is None:
+        return
+    if update_fields is not None and set(update_fields) <= {"read"}:
+        return
+    if not created and instance.changed_fields() <= {"read"}:
+        return
+
+    root_pk = instance.thread_root_pk
+    transaction.on_commit(lambda: invalidate_threads([root_pk]))
+
+
+@receiver(post_delete, sender=Message)
+def invalidate_thread_cache_on_delete(sender, instance, **kwargs):
+    """Bump the cached thread's version once a message deletion commits."""
+    root_pk = instance.thread_root_pk
+    transaction.on_commit(lambda: invalidate_threads([root_pk]))
+
+
+@receiver(post_save, sender=Message)
+def append_reply_to_thread_tree(sender, instance, created, **kwargs):
+    """Add a new reply to the stored compact tree of its thread."""
+    if created and instance.thread_root_id is not None:
+        ThreadTree.objects.append(instance)
+
+
+@receiver(post_delete, sender=Message)
+def remove_reply_from_thread_tree(sender, instance, **kwargs):
+    """Tombstone a deleted reply in the stored compact tree of its thread."""
+    if instance.thread_root_id is not None:
+        ThreadTree.objects.remove(instance)
+
+
+@receiver(post_save, sender=Message)
+def update_search_index(sender, instance, created, update_fields=None, **kwargs):
+    """Index new messages and re-index edited content in the full-text index."""
+    backend = get_search_backend()
+    if not backend.maintains_index:
+        return
+    if update_fields is not None and "content" not in update_fields:
+        return
+    if not created and "content" not in instance.changed_fields():
+        return
+    backend.index([(instance.pk, instance.content)])
+
+
+@receiver(post_delete, sender=Message)
+def remove_from_search_index(sender, instance, **kwargs):
+    """Drop a deleted message from the full-text index."""
+    backend = get_search_backend()
+    if backend.maintains_index:
+        backend.remove([instance.pk])
+
+
+@receiver(post_save, sender=Message)
+def publish_message_event(sender, instance, created, **kwargs):
+    """Push a new message to its receiver's live inbox streams on commit."""
+    if created:
+        publish_on_commit([(instance.receiver_id, message_event(instance))])
+
+
+@receiver(post_save, sender=Notification)
+def publish_notification_event(sender, instance, created, **kwargs):
+    """Push a new notification to its user's live inbox streams on commit."""
+    if created:
+        publish_on_commit([(instance.user_id, notification_event(instance))])
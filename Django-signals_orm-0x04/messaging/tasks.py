@@ -0,0 +1,21 @@
+from celery import shared_task
+
+from .deletion import delete_user_data
+from .dispatch import deliver_notifications
+
+
+@shared_task(
+    acks_late=True,
+    autoretry_for=(Exception,),
+    retry_backoff=True,
+    max_retries=5,
+)
+def deliver_notifications_task(message_ids):
+    """Create the notifications of a batch of messages (idempotent, retried)."""
+    return deliver_notifications(message_ids)
+
+
+@shared_task(acks_late=True)
+def delete_user_data_task(user_id):
+    """Delete a user and their messaging data in batches (re-runnable)."""
+    return delete_user_data(user_id)
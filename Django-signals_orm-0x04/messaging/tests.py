@@ -1,20 +1,59 @@
+import asyncio
+import csv
+import json
+import tempfile
 import unittest
+from datetime import timedelta
+from io import StringIO
 
 try:
     from django.test import TestCase  # type: ignore
 except Exception:
     TestCase = unittest.TestCase
 
+from asgiref.sync import sync_to_async  # type: ignore
 from django.contrib.auth import get_user_model  # type: ignore
+from django.core.cache import cache  # type: ignore
+from django.core.management import call_command  # type: ignore
+from django.core.signals import request_finished  # type: ignore
+from django.db import close_old_connections  # type: ignore
+from django.db import connection, transaction  # type: ignore
+from django.db.models import Q  # type: ignore
+from django.http import Http404, HttpResponse  # type: ignore
+from django.test import RequestFactory, override_settings  # type: ignore
+from django.test.utils import CaptureQueriesContext  # type: ignore
+from django.urls import reverse  # type: ignore
+from django.utils import timezone  # type: ignore
+from messaging_app import profiling  # type: ignore
 
 
+from . import events, thread_cache
+from .archive import archive_cutoff, archive_threads, get_archived_thread_tree
+from .broadcast import broadcast_message
+from .deletion import delete_user_data
+from .export import iter_export
+from .dispatch import _insert_new, deliver_notifications
 from .models import Message, Notification
+from .models import ArchivedMessage, ArchivedMessageHistory, ArchivedNotification
 from .models import MessageHistory
-
+from .models import ThreadTree
+from .models import UnreadCounter
+from .models import path_segment
+from .pagination import InvalidCursor
+from .search import get_backend as get_search_backend
+from .search import search_messages
+from .seed import seed_dataset
 
 User = get_user_model()
 
 
+class RecordingBroker(events.InProcessBroker):
+    published = []
+
+    def publish(self, user_id, event):
+        self.published.append((user_id, event))
+
+
 class MessagingSignalTests(TestCase):
     def setUp(self):
         self.alice = User.objects.create_user(username="alice", password="password")
@@ -112,3 +151,1078 @@ class MessagingSignalTests(TestCase):
         unread_qs = Message.unread.unread_for_user(self.bob)
         self.assertIn(m1, list(unread_qs))
         self.assertNotIn(m2, list(unread_qs))
+
+    def test_replies_store_materialized_thread_path(self):
+        root = Message.objects.create(
+            sender=self.alice, receiver=self.bob, content="Root"
+        )
+        r1 = Message.objects.create(
+            sender=self.bob, receiver=self.alice, content="Reply 1", parent_message=root
+        )
+        r1_1 = Message.objects.create(
+            sender=self.alice, receiver=self.bob, content="Reply 1.1", parent_message=r1
+        )
+        Message.objects.create(
+            sender=self.alice, receiver=self.bob, content="Reply 2", parent_message=root
+        )
+
+        self.assertIsNone(root.thread_root_id)
+        self.assertEqual((root.depth, r1.depth, r1_1.depth), (0, 1, 2))
+        self.assertEqual(r1_1.thread_root_id, root.pk)
+        self.assertEqual(r1_1.path, root.descendant_path + path_segment(r1.pk))
+
+        self.assertEqual(root.subtree_count(), 3)
+        self.assertEqual(list(r1.descendants()), [r1_1])
+        self.assertEqual(root.descendants(max_depth=1).count(), 2)
+
+    def test_get_thread_loads_whole_thread_in_one_query(self):
+        root = Message.objects.create(
+            sender=self.alice, receiver=self.bob, content="Root"
+        )
+        parent = root
+        for i in range(10):
+            parent = Message.objects.create(
+                sender=self.bob,
+                receiver=self.alice,
+                content=f"Reply {i}",
+                parent_message=parent,
+            )
+
+        with self.assertNumQueries(1):
+            tree = root.get_thread()
+            depth = 0
+            while tree["replies"]:
+                tree = tree["replies"][0]
+                tree["message"].sender.username
+                depth += 1
+        self.assertEqual(depth, 10)
+
+        with self.assertNumQueries(2):
+            roots = list(Message.fetch_thread_root_messages())
+            self.assertEqual(len(roots[0].get_thread()["replies"]), 1)
+
+    def test_thread_list_counts_replies_without_loading_them(self):
+        root = Message.objects.create(sender=self.alice, receiver=self.bob, content="R")
+        parent = root
+        for i in range(3):
+            parent = Message.objects.create(
+                sender=self.bob,
+                receiver=self.alice,
+                content=f"R{i}",
+                parent_message=parent,
+            )
+        self.client.force_login(self.bob)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse("messaging-thread-list"))
+        self.assertContains(response, "(3 replies,")
+        self.assertFalse(
+            [q for q in ctx.captured_queries if 'thread_root_id" IN' in q["sql"]]
+        )
+
+    def test_backfill_thread_paths_command(self):
+        root = Message.objects.create(
+            sender=self.alice, receiver=self.bob, content="Root"
+        )
+        reply = Message.objects.create(
+            sender=self.bob, receiver=self.alice, content="Reply", parent_message=root
+        )
+        Message.objects.filter(pk=reply.pk).update(thread_root=None, path="", depth=0)
+
+        call_command("backfill_thread_paths", stdout=StringIO())
+
+        reply.refresh_from_db()
+        self.assertEqual(reply.thread_root_id, root.pk)
+        self.assertEqual(reply.depth, 1)
+        self.assertEqual(reply.path, root.descendant_path)
+
+    def test_keyset_pagination_walks_pages_without_offset(self):
+        msgs = [
+            Message.objects.create(
+                sender=self.alice, receiver=self.bob, content=f"Message {i}"
+            )
+            for i in range(7)
+        ]
+        # Force identical timestamps so the id tie-breaker is exercised
+        Message.objects.filter(pk__in=[m.pk for m in msgs[2:5]]).update(
+            timestamp=msgs[3].timestamp
+        )
+        expected = list(Message.objects.order_by("-timestamp", "-pk"))
+
+        unread = Message.unread.unread_for_user(self.bob)
+        seen, cursor = [], None
+        while True:
+            with CaptureQueriesContext(connection) as ctx:
+                page = unread.keyset_page(cursor, per_page=3)
+            self.assertNotIn("OFFSET", ctx.captured_queries[0]["sql"].upper())
+            seen.extend(page.object_list)
+            if not page.has_next:
+                break
+            cursor = page.next_cursor
+        self.assertEqual(seen, expected)
+
+        back = unread.keyset_page(page.prev_cursor, per_page=3)
+        self.assertEqual(back.object_list, expected[3:6])
+        self.assertTrue(back.has_next)
+
+        with self.assertRaises(InvalidCursor):
+            unread.keyset_page("not-a-cursor")
+
+    def test_unread_counters_follow_messages_and_notifications(self):
+        m1 = Message.objects.create(sender=self.alice, receiver=self.bob, content="1")
+        m2 = Message.objects.create(sender=self.alice, receiver=self.bob, content="2")
+
+        with self.assertNumQueries(1):
+            counter = UnreadCounter.objects.for_user(self.bob)
+        self.assertEqual(
+            (counter.unread_messages, counter.unread_notifications), (2, 2)
+        )
+
+        m1.read = True
+        m1.save()
+        notif = Notification.objects.get(message=m2)
+        notif.read = True
+        notif.save()
+        m2.delete()
+
+        # m1's notification is still unread
+        counter = UnreadCounter.objects.for_user(self.bob)
+        self.assertEqual(
+            (counter.unread_messages, counter.unread_notifications), (0, 1)
+        )
+
+    def test_reconcile_unread_counters_command(self):
+        Message.objects.create(sender=self.alice, receiver=self.bob, content="1")
+        # Queryset updates bypass the signals and leave the counter drifted
+        Message.objects.update(read=True)
+        UnreadCounter.objects.filter(user=self.alice).delete()
+
+        call_command("reconcile_unread_counters", batch_size=1, stdout=StringIO())
+
+        bob = UnreadCounter.objects.get(user=self.bob)
+        self.assertEqual((bob.unread_messages, bob.unread_notifications), (0, 1))
+        self.assertTrue(UnreadCounter.objects.filter(user=self.alice).exists())
+
+    def test_broadcast_message_matches_per_message_signal(self):
+        carol = User.objects.create_user(username="carol", password="password")
+        receivers = [self.bob.pk, carol.pk, self.bob.pk]
+
+        created = broadcast_message(self.alice, receivers, "Announcement", batch_size=1)
+
+        self.assertEqual(created, 2)
+        for user in (self.bob, carol):
+            msg = Message.objects.get(sender=self.alice, receiver=user)
+            self.assertEqual(msg.content, "Announcement")
+            self.assertEqual(msg.depth, 0)
+            self.assertEqual(
+                Notification.objects.filter(user=user, message=msg, read=False).count(),
+                1,
+            )
+            counter = UnreadCounter.objects.for_user(user)
+            self.assertEqual(
+                (counter.unread_messages, counter.unread_notifications), (1, 1)
+            )
+
+    @override_settings(MESSAGING_NOTIFICATION_DISPATCH="eager")
+    def test_queued_notifications_are_batched_and_idempotent(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with transaction.atomic():
+                m1 = Message.objects.create(
+                    sender=self.alice, receiver=self.bob, content="1"
+                )
+                m2 = Message.objects.create(
+                    sender=self.alice, receiver=self.bob, content="2"
+                )
+                # Nothing is written until the transaction commits
+                self.assertFalse(Notification.objects.exists())
+
+        # One on_commit hook delivers the whole transaction's batch
+        flushes = [c for c in callbacks if getattr(c, "__name__", "") == "flush"]
+        self.assertEqual(len(flushes), 1)
+        self.assertEqual(Notification.objects.filter(user=self.bob).count(), 2)
+
+        # A retried job must not duplicate rows or counters
+        self.assertEqual(deliver_notifications([m1.pk, m2.pk]), 0)
+        self.assertEqual(Notification.objects.count(), 2)
+        self.assertEqual(
+            UnreadCounter.objects.for_user(self.bob).unread_notifications, 2
+        )
+
+        # Rows a concurrent delivery wrote first are not reported as ours
+        Notification.objects.filter(message=m2).delete()
+        inserted = _insert_new(
+            [
+                Notification(user=self.bob, message=m1),
+                Notification(user=self.bob, message=m2),
+            ]
+        )
+        self.assertEqual([n.message_id for n in inserted], [m2.pk])
+
+        # A rolled-back savepoint drops its flush hook; later messages get a new one
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                try:
+                    with transaction.atomic():
+                        Message.objects.create(
+                            sender=self.alice, receiver=self.bob, content="3"
+                        )
+                        raise RuntimeError
+                except RuntimeError:
+                    pass
+                m4 = Message.objects.create(
+                    sender=self.alice, receiver=self.bob, content="4"
+                )
+        self.assertTrue(Notification.objects.filter(message=m4).exists())
+
+    def test_saving_deferred_message_reads_the_old_values(self):
+        msg = Message.objects.create(sender=self.alice, receiver=self.bob, content="Hi")
+        # Loaded without them: the handlers read the old values from the row
+        deferred = Message.objects.defer("content", "read").get(pk=msg.pk)
+        deferred.content = "Hi there"
+        deferred.read = True
+        with CaptureQueriesContext(connection) as ctx:
+            deferred.save(update_fields=["content", "read"])
+        selects = [q for q in ctx.captured_queries if q["sql"].startswith("SELECT")]
+        self.assertEqual(len(selects), 2)
+        self.assertEqual(MessageHistory.objects.get(message=msg).old_content, "Hi")
+        self.assertEqual(UnreadCounter.objects.for_user(self.bob).unread_messages, 0)
+
+    def test_saving_loaded_message_needs_no_extra_select(self):
+        Message.objects.create(sender=self.alice, receiver=self.bob, content="Hi")
+        msg = Message.objects.get(receiver=self.bob)
+
+        # Flipping `read` only: UPDATE + unread counter UPDATE, no SELECT
+        msg.read = True
+        with CaptureQueriesContext(connection) as ctx:
+            msg.save(update_fields=["read"])
+        self.assertFalse(
+            [q for q in ctx.captured_queries if q["sql"].startswith("SELECT")]
+        )
+
+        # An edit: one SELECT, reading and locking the stored row
+        msg.content = "Hi there"
+        with CaptureQueriesContext(connection) as ctx:
+            msg.save()
+        self.assertEqual(
+            len([q for q in ctx.captured_queries if q["sql"].startswith("SELECT")]), 1
+        )
+        self.assertEqual(msg.history().get().old_content, "Hi")
+
+        # update_fields without `content` does not log an edit
+        msg.content = "Unsaved"
+        msg.save(update_fields=["read"])
+        self.assertEqual(msg.history().count(), 1)
+
+    def test_bulk_edit_writes_history_in_bulk(self):
+        m1 = Message.objects.create(sender=self.alice, receiver=self.bob, content="a")
+        m2 = Message.objects.create(sender=self.alice, receiver=self.bob, content="b")
+
+        # Plus one DELETE and one INSERT per batch when the app keeps the
+        # full-text index itself
+        index_writes = 2 if get_search_backend().maintains_index else 0
+        with self.assertNumQueries(5 + index_writes):
+            changed = Message.objects.bulk_edit(
+                {m1.pk: "a2", m2.pk: "b"}, edited_by=self.alice
+            )
+
+        self.assertEqual(changed, 1)
+        m1.refresh_from_db()
+        self.assertEqual((m1.content, m1.edited), ("a2", True))
+        hist = MessageHistory.objects.get()
+        self.assertEqual((hist.message_id, hist.old_content), (m1.pk, "a"))
+        self.assertEqual(hist.edited_by, self.alice)
+
+    def test_delete_user_data_removes_threads_in_batches(self):
+        carol = User.objects.create_user(username="carol", password="password")
+        root = Message.objects.create(sender=self.alice, receiver=carol, content="R")
+        reply = Message.objects.create(
+            sender=carol, receiver=self.bob, content="R.1", parent_message=root
+        )
+        deep = Message.objects.create(
+            sender=self.bob, receiver=carol, content="R.1.1", parent_message=reply
+        )
+        Message.objects.create(
+            sender=carol, receiver=self.alice, content="R.2", parent_message=root
+        )
+        other = Message.objects.create(sender=carol, receiver=self.bob, content="X")
+        bob_reply = Message.objects.create(
+            sender=self.bob, receiver=carol, content="X.1", parent_message=other
+        )
+        bob_reply.content = "X.1 edited"
+        bob_reply.save()
+        MessageHistory.objects.create(
+            message=other, old_content="?", edited_by=self.alice
+        )
+
+        stages = []
+        stats = delete_user_data(
+            self.alice.pk,
+            batch_size=1,
+            progress=lambda stage, total: stages.append(stage),
+        )
+
+        self.assertFalse(User.objects.filter(pk=self.alice.pk).exists())
+        # The whole thread alice started goes, replies by others included
+        self.assertFalse(Message.objects.filter(thread_root=root.pk).exists())
+        self.assertFalse(Message.objects.filter(pk__in=[root.pk, deep.pk]).exists())
+        self.assertEqual(stats["messages"], 4)
+        self.assertEqual(stats["history"], 1)
+        self.assertIn("messages", stages)
+        # Unrelated threads survive, counters reflect the raw deletes
+        self.assertEqual(
+            set(Message.objects.values_list("pk", flat=True)), {other.pk, bob_reply.pk}
+        )
+        self.assertEqual(MessageHistory.objects.get().message_id, bob_reply.pk)
+        counter = UnreadCounter.objects.get(user=carol)
+        self.assertEqual(
+            (counter.unread_messages, counter.unread_notifications), (1, 1)
+        )
+        call_command("reconcile_unread_counters", stdout=StringIO())
+        counter.refresh_from_db()
+        self.assertEqual(
+            (counter.unread_messages, counter.unread_notifications), (1, 1)
+        )
+
+    def test_thread_cache_is_versioned_and_invalidated_by_signals(self):
+        cache.clear()
+        thread_cache.reset_stats()
+        root = Message.objects.create(sender=self.alice, receiver=self.bob, content="R")
+        with self.captureOnCommitCallbacks(execute=True):
+            Message.objects.create(
+                sender=self.bob, receiver=self.alice, content="R.1", parent_message=root
+            )
+
+        tree = thread_cache.get_thread_tree(root)
+        with self.assertNumQueries(0):
+            self.assertEqual(thread_cache.get_thread_tree(root), tree)
+        self.assertEqual(len(tree["replies"]), 1)
+
+        # Read-state changes keep the shared tree
+        with self.captureOnCommitCallbacks(execute=True):
+            root.read = True
+            root.save()
+        thread_cache.get_thread_tree(root)
+
+        # A new reply bumps the version and the next read rebuilds
+        with self.captureOnCommitCallbacks(execute=True):
+            Message.objects.create(
+                sender=self.bob, receiver=self.alice, content="R.2", parent_message=root
+            )
+        self.assertEqual(len(thread_cache.get_thread_tree(root)["replies"]), 2)
+
+        # One invalidation per reply, none for the read flip
+        self.assertEqual(
+            thread_cache.stats(), {"hits": 2, "misses": 2, "invalidations": 2}
+        )
+
+    def test_thread_tree_is_maintained_incrementally(self):
+        root = Message.objects.create(sender=self.alice, receiver=self.bob, content="R")
+        r1 = Message.objects.create(
+            sender=self.bob, receiver=self.alice, content="R.1", parent_message=root
+        )
+        tree = ThreadTree.objects.for_root(root.pk)
+        self.assertEqual((tree.ids, tree.parents), ([root.pk, r1.pk], [-1, 0]))
+
+        r1_1 = Message.objects.create(
+            sender=self.alice, receiver=self.bob, content="R.1.1", parent_message=r1
+        )
+        r2 = Message.objects.create(
+            sender=self.alice, receiver=self.bob, content="R.2", parent_message=root
+        )
+        tree.refresh_from_db()
+        self.assertEqual(tree.ids, [root.pk, r1.pk, r1_1.pk, r2.pk])
+        self.assertEqual(tree.parents, [-1, 0, 1, 0])
+        self.assertEqual(tree.senders[1], self.bob.pk)
+
+        # One fetch of the structure plus one batched fetch of the bodies
+        with self.assertNumQueries(2):
+            nested = ThreadTree.objects.for_root(root.pk).nested()
+            self.assertEqual(nested["replies"][0]["replies"][0]["message"], r1_1)
+            nested["replies"][1]["message"].sender.username
+
+        r2.delete()
+        tree.refresh_from_db()
+        self.assertEqual(tree.ids, [root.pk, r1.pk, r1_1.pk, None])
+        self.assertEqual(tree.subtree_ids(root.pk), [root.pk, r1.pk, r1_1.pk])
+
+        # Tombstones past half the tree trigger a compacting rebuild
+        r1.delete()
+        tree.refresh_from_db()
+        self.assertEqual((tree.ids, tree.parents), ([root.pk], [-1]))
+
+        # A stored tree missing a parent (a racing build) is rebuilt, not broken
+        r3 = Message.objects.create(
+            sender=self.bob, receiver=self.alice, content="R.3", parent_message=root
+        )
+        ThreadTree.objects.filter(root=root).update(ids=[root.pk], parents=[-1])
+        r3_1 = Message.objects.create(
+            sender=self.alice, receiver=self.bob, content="R.3.1", parent_message=r3
+        )
+        tree.refresh_from_db()
+        self.assertEqual(
+            (tree.ids, tree.parents), ([root.pk, r3.pk, r3_1.pk], [-1, 0, 1])
+        )
+
+        # So is one read before a reply was added
+        stale = ThreadTree(
+            root=root, ids=[root.pk], parents=[-1], senders=[self.alice.pk]
+        )
+        self.assertEqual(stale.subtree_ids(r3.pk), [r3.pk, r3_1.pk])
+        self.assertEqual(stale.nested(r3_1.pk)["message"], r3_1)
+
+        out = StringIO()
+        call_command("benchmark_thread_tree", sizes="10,50", replies=3, stdout=out)
+        self.assertIn("50 nodes: append", out.getvalue())
+        self.assertFalse(User.objects.filter(username="benchmark-tree-user"))
+
+    def test_export_streams_messages_threads_and_history(self):
+        root = Message.objects.create(sender=self.alice, receiver=self.bob, content="R")
+        reply = Message.objects.create(
+            sender=self.bob, receiver=self.alice, content="R.1", parent_message=root
+        )
+        reply.content = "R.1 edited"
+        reply.save()
+        reply.content = "R.1 edited twice"
+        reply.save()
+        Message.objects.create(sender=self.bob, receiver=self.bob, content="Not alice")
+
+        # One row per page: the history of one message spans two pages
+        records = [json.loads(line) for line in iter_export(self.alice, chunk_size=1)]
+        self.assertEqual(
+            [(r["type"], r["message_id"]) for r in records],
+            [("message", root.pk), ("message", reply.pk)] + [("history", reply.pk)] * 2,
+        )
+        self.assertEqual(records[1]["thread_root_id"], root.pk)
+        self.assertEqual([r["content"] for r in records[2:]], ["R.1 edited", "R.1"])
+
+        rows = list(csv.DictReader(iter_export(self.alice, "csv", chunk_size=2)))
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(rows[1]["content"], "R.1 edited twice")
+
+        with tempfile.NamedTemporaryFile("r", suffix=".ndjson") as out:
+            call_command("export_user_data", "alice", out.name, stdout=StringIO())
+            self.assertEqual(len(out.readlines()), 4)
+
+    def test_search_ranks_and_scopes_and_follows_edits(self):
+        carol = User.objects.create_user(username="carol", password="password")
+        weak = Message.objects.create(
+            sender=self.alice, receiver=self.bob, content="lunch later maybe"
+        )
+        strong = Message.objects.create(
+            sender=self.bob, receiver=self.alice, content="lunch lunch lunch today"
+        )
+        other = Message.objects.create(
+            sender=carol, receiver=self.bob, content="lunch with carol"
+        )
+
+        self.assertEqual(search_messages("lunch", user=self.alice), [strong, weak])
+        self.assertIn(other, search_messages("lunch"))
+        self.assertEqual(search_messages('lunch "today'), [strong])
+
+        weak.content = "dinner instead"
+        weak.save()
+        self.assertEqual(search_messages("lunch", user=self.alice), [strong])
+        self.assertEqual(search_messages("dinner"), [weak])
+
+        Message.objects.bulk_edit({strong.pk: "breakfast"})
+        strong.delete()
+        self.assertEqual(search_messages("breakfast"), [])
+
+        search_backend = get_search_backend()
+        if search_backend.maintains_index:
+            search_backend.clear()
+            self.assertEqual(search_messages("carol"), [])
+            # An entry left behind by a message deleted without its signals
+            search_backend.index([(other.pk + 1000, "carol stale")])
+            out = StringIO()
+            call_command("rebuild_search_index", batch_size=1, stdout=out)
+            self.assertIn("pruned 1 stale", out.getvalue())
+        self.assertEqual(search_messages("carol"), [other])
+
+    def _changelist_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_admin_changelists_use_constant_queries(self):
+        admin_user = User.objects.create_superuser(
+            username="admin", password="password"
+        )
+        self.client.force_login(admin_user)
+
+        def add_rows(n):
+            for i in range(n):
+                root = Message.objects.create(
+                    sender=self.alice, receiver=self.bob, content=f"R{i}"
+                )
+                reply = Message.objects.create(
+                    sender=self.bob,
+                    receiver=self.alice,
+                    content=f"R{i}.1",
+                    parent_message=root,
+                )
+                reply.content = f"R{i}.1 edited"
+                reply.save()
+
+        urls = [
+            reverse(f"admin:messaging_{model}_changelist")
+            for model in ("message", "notification", "messagehistory")
+        ]
+        add_rows(2)
+        few = [self._changelist_queries(url) for url in urls]
+        add_rows(8)
+        many = [self._changelist_queries(url) for url in urls]
+        self.assertEqual(few, many)
+
+        response = self.client.get(urls[0])
+        root = Message.objects.filter(parent_message=None).first()
+        row = next(r for r in response.context["cl"].result_list if r.pk == root.pk)
+        self.assertEqual(row.reply_count, 1)
+
+        # Content search goes through the full-text index, as a subquery
+        for url in (urls[0], urls[2]):
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.get(url, {"q": "edited"})
+            self.assertEqual(len(response.context["cl"].result_list), 10)
+            fts = [q["sql"] for q in ctx.captured_queries if "_fts" in q["sql"]]
+            self.assertTrue(fts)
+            self.assertFalse([sql for sql in fts if sql.startswith("SELECT m.id")])
+
+    @override_settings(MESSAGING_HISTORY_SNAPSHOT_INTERVAL=3)
+    def test_history_is_stored_as_deltas_and_reconstructed(self):
+        versions = [f"Version {i} of a fairly long message body." for i in range(8)]
+        msg = Message.objects.create(
+            sender=self.alice, receiver=self.bob, content=versions[0]
+        )
+        for content in versions[1:]:
+            msg.content = content
+            msg.save()
+
+        entries = list(MessageHistory.objects.order_by("seq"))
+        self.assertEqual([e.seq for e in entries], list(range(1, 8)))
+        self.assertEqual(
+            [e.delta is None for e in entries],
+            [False, False, True, False, False, True, False],
+        )
+
+        with self.assertNumQueries(1):
+            old = [e.old_content for e in msg.history()]
+        self.assertEqual(old, versions[-2::-1])
+        # A lone entry replays the newer deltas up to the nearest snapshot
+        self.assertEqual(MessageHistory.objects.get(seq=1).old_content, versions[0])
+        self.assertEqual(MessageHistory.objects.get(seq=7).old_content, versions[6])
+
+        # Deleting an entry turns the one below it into a snapshot
+        carol = User.objects.create_user(username="carol", password="password")
+        entries[1].edited_by = carol
+        entries[1].save()
+        delete_user_data(carol.pk)
+        remaining = list(msg.history())
+        self.assertEqual(len(remaining), 6)
+        self.assertIsNone(remaining[-1].delta)
+        self.assertEqual(remaining[-1].old_content, versions[0])
+
+    @override_settings(MESSAGING_HISTORY_SNAPSHOT_INTERVAL=2)
+    def test_history_survives_content_written_without_save(self):
+        body = "A long enough message body that deltas pay off"
+        versions = [f"{body}, version {i}." for i in range(4)]
+        msg = Message.objects.create(
+            sender=self.alice, receiver=self.bob, content=versions[0]
+        )
+        for content in versions[1:]:
+            msg.content = content
+            msg.save()
+        Message.objects.filter(pk=msg.pk).update(content="Rewritten behind its back")
+
+        # Edit 3's delta no longer fits: it falls back to the nearest
+        # snapshot (edit 2's); the older entries are still exact
+        expected = [versions[1], versions[1], versions[0]]
+        entries = list(Message.objects.get(pk=msg.pk).history())
+        self.assertIsNotNone(entries[0].delta)
+        self.assertEqual([e.old_content for e in entries], expected)
+        self.assertEqual(
+            [MessageHistory.objects.get(pk=e.pk).old_content for e in entries],
+            expected,
+        )
+        records = [json.loads(line) for line in iter_export(self.alice)]
+        records = [r for r in records if r["type"] == "history"]
+        self.assertEqual([r["content"] for r in records], expected)
+
+    def test_editing_stale_copies_records_consecutive_edits(self):
+        msg = Message.objects.create(sender=self.alice, receiver=self.bob, content="v0")
+        first = Message.objects.get(pk=msg.pk)
+        second = Message.objects.get(pk=msg.pk)
+        first.content = "v1"
+        first.save()
+        second.content = "v2"
+        second.save()
+
+        msg.refresh_from_db()
+        self.assertEqual((msg.content, msg.edit_count), ("v2", 2))
+        entries = list(msg.history())
+        self.assertEqual([e.seq for e in entries], [2, 1])
+        # Each entry holds the version its edit actually replaced
+        self.assertEqual([e.old_content for e in entries], ["v1", "v0"])
+
+    def test_compress_message_history_converts_full_rows(self):
+        body = "A long enough message body that deltas pay off"
+        msg = Message.objects.create(
+            sender=self.alice, receiver=self.bob, content=body + ", final."
+        )
+        versions = [body + ", take one.", body + ", take two.", body + ", take three."]
+        # Full-text rows, numbered in id order as migration 0011 leaves them
+        for seq, content in enumerate(versions, 1):
+            MessageHistory.objects.create(message=msg, old_content=content, seq=seq)
+
+        call_command("compress_message_history", batch_size=1, stdout=StringIO())
+        entries = list(msg.history())
+        self.assertEqual([e.seq for e in entries], [3, 2, 1])
+        self.assertTrue(all(e.delta is not None for e in entries))
+        self.assertEqual([e.old_content for e in entries], versions[::-1])
+        msg.refresh_from_db()
+        self.assertEqual(msg.edit_count, 3)
+
+    @override_settings(MESSAGING_NOTIFICATION_COALESCE="thread")
+    def test_coalesced_notifications_and_bulk_mark_read(self):
+        root = Message.objects.create(sender=self.alice, receiver=self.bob, content="R")
+        for i in range(2):
+            latest = Message.objects.create(
+                sender=self.alice,
+                receiver=self.bob,
+                content=f"R.{i}",
+                parent_message=root,
+            )
+        Message.objects.create(sender=self.alice, receiver=self.bob, content="Other")
+
+        # One unread row per thread, pointing at its newest message
+        notification = Notification.objects.get(user=self.bob, message=latest)
+        self.assertEqual(notification.count, 3)
+        self.assertEqual(Notification.objects.filter(user=self.bob).count(), 2)
+        counter = UnreadCounter.objects.for_user(self.bob)
+        self.assertEqual(counter.unread_notifications, 2)
+
+        self.client.force_login(self.bob)
+        response = self.client.post(
+            reverse("messaging-notifications-read"), {"thread": root.pk}
+        )
+        self.assertEqual(response.json(), {"marked": 1})
+        counter.refresh_from_db()
+        self.assertEqual(counter.unread_notifications, 1)
+
+        # The read row released its key: the next reply opens a new one
+        Message.objects.create(
+            sender=self.alice, receiver=self.bob, content="R.2", parent_message=root
+        )
+        self.assertEqual(Notification.objects.filter(user=self.bob).count(), 3)
+
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(Notification.objects.mark_read(self.bob), 2)
+        updates = [
+            q
+            for q in ctx.captured_queries
+            if q["sql"].startswith('UPDATE "messaging_notification"')
+        ]
+        self.assertEqual(len(updates), 1)
+        counter.refresh_from_db()
+        self.assertEqual(counter.unread_notifications, 0)
+
+        # Losing the insert race to a concurrent writer folds our count into
+        # the winner's row instead of dropping it
+        Message.objects.create(sender=self.bob, receiver=self.alice, content="S")
+        # Newer messages to point at, created without the signals
+        newer = Message.objects.bulk_create(
+            [
+                Message(sender=self.bob, receiver=self.alice, content=f"S.{i}")
+                for i in range(2)
+            ]
+        )
+        key = Notification.objects.get(user=self.alice).coalesce_key
+        inserted, folded = Notification.objects._insert_coalesced(
+            {
+                (self.alice.pk, key): (2, newer[1].pk),
+                (self.bob.pk, "new"): (1, root.pk),
+            },
+            timezone.now(),
+        )
+        self.assertEqual(
+            [(n.user_id, n.coalesce_key) for n in inserted], [(self.bob.pk, "new")]
+        )
+        notification = Notification.objects.get(user=self.alice)
+        self.assertEqual(
+            (notification.count, notification.message_id), (3, newer[1].pk)
+        )
+        self.assertEqual([n.pk for n in folded], [notification.pk])
+
+    @override_settings(
+        MESSAGING_NOTIFICATION_COALESCE="sender",
+        MESSAGING_EVENT_BROKER="messaging.tests.RecordingBroker",
+    )
+    def test_coalesced_notifications_publish_events(self):
+        events.reset_broker()
+        RecordingBroker.published = []
+        for i in range(2):
+            with self.captureOnCommitCallbacks(execute=True):
+                Message.objects.create(
+                    sender=self.alice, receiver=self.bob, content=str(i)
+                )
+        with self.captureOnCommitCallbacks(execute=True):
+            broadcast_message(self.alice, [self.bob.pk], "All")
+        events.reset_broker()
+
+        notification = Notification.objects.get(user=self.bob)
+        published = [
+            (user_id, event["id"], event["count"])
+            for user_id, event in RecordingBroker.published
+            if event["type"] == "notification"
+        ]
+        self.assertEqual(
+            published, [(self.bob.pk, notification.pk, n) for n in (1, 2, 3)]
+        )
+
+    @override_settings(
+        MESSAGING_NOTIFICATION_DISPATCH="eager",
+        MESSAGING_NOTIFICATION_COALESCE="sender",
+    )
+    def test_queued_coalesced_notifications_are_idempotent(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                ids = [
+                    Message.objects.create(
+                        sender=self.alice, receiver=self.bob, content=str(i)
+                    ).pk
+                    for i in range(3)
+                ]
+        self.assertEqual(deliver_notifications(ids), 0)
+        notification = Notification.objects.get(user=self.bob)
+        self.assertEqual((notification.count, notification.message_id), (3, ids[-1]))
+        self.assertEqual(
+            UnreadCounter.objects.for_user(self.bob).unread_notifications, 1
+        )
+
+    def test_cold_threads_are_archived_with_their_rows(self):
+        cold = Message.objects.create(sender=self.alice, receiver=self.bob, content="C")
+        cold_reply = Message.objects.create(
+            sender=self.bob, receiver=self.alice, content="C.1", parent_message=cold
+        )
+        cold_reply.content = "C.1 edited"
+        cold_reply.save()
+        warm = Message.objects.create(sender=self.alice, receiver=self.bob, content="W")
+        Message.objects.filter(pk__in=[cold.pk, cold_reply.pk, warm.pk]).update(
+            timestamp=timezone.now() - timedelta(days=60)
+        )
+        # A recent reply keeps the whole thread warm
+        Message.objects.create(
+            sender=self.bob, receiver=self.alice, content="W.1", parent_message=warm
+        )
+
+        stats = archive_threads(archive_cutoff(30), batch_size=1)
+        self.assertEqual(
+            stats, {"threads": 1, "messages": 2, "notifications": 2, "history": 1}
+        )
+        self.assertFalse(Message.objects.filter(pk__in=[cold.pk, cold_reply.pk]))
+        self.assertEqual(Message.objects.count(), 2)
+        archived = ArchivedMessage.objects.get(pk=cold_reply.pk)
+        self.assertEqual(
+            (archived.thread_root_id, archived.content), (cold.pk, "C.1 edited")
+        )
+        self.assertEqual(ArchivedMessageHistory.objects.get().snapshot, "C.1")
+        counter = UnreadCounter.objects.get(user=self.bob)
+        self.assertEqual(
+            (counter.unread_messages, counter.unread_notifications), (1, 1)
+        )
+
+        # Thread views fall back to the archive
+        tree = get_archived_thread_tree(cold.pk)
+        self.assertEqual(tree["replies"][0]["message"].pk, cold_reply.pk)
+        self.assertIsNone(get_archived_thread_tree(warm.pk))
+
+        # Re-running only picks up what is still cold
+        self.assertEqual(archive_threads(archive_cutoff(30)), {})
+
+        # Batches are capped by rows; a thread larger than the cap goes alone
+        roots = []
+        for i in range(3):
+            root = Message.objects.create(
+                sender=self.alice, receiver=self.bob, content=f"R{i}"
+            )
+            Message.objects.create(
+                sender=self.bob, receiver=self.alice, content="r", parent_message=root
+            )
+            roots.append(root.pk)
+        Message.objects.filter(Q(pk__in=roots) | Q(thread_root_id__in=roots)).update(
+            timestamp=timezone.now() - timedelta(days=60)
+        )
+        batches = []
+        stats = archive_threads(
+            archive_cutoff(30), max_rows=3, progress=lambda s: batches.append(s)
+        )
+        self.assertEqual((stats["threads"], stats["messages"]), (3, 6))
+        self.assertEqual(len(batches), 3)
+
+        delete_user_data(self.alice.pk)
+        self.assertFalse(ArchivedMessage.objects.exists())
+        self.assertFalse(ArchivedNotification.objects.exists())
+
+    @override_settings(QUERY_PROFILING_SAMPLE_RATE=1.0)
+    def test_query_profiling_middleware_flags_n_plus_one(self):
+        profiling.stats.reset()
+
+        def n_plus_one_view(request):
+            for user in User.objects.all():
+                for _ in range(3):
+                    Message.objects.filter(sender=user).exists()
+            return HttpResponse()
+
+        middleware = profiling.QueryProfilingMiddleware(n_plus_one_view)
+        with self.assertLogs("messaging_app.profiling", "WARNING") as logs:
+            middleware(RequestFactory().get("/"))
+        self.assertIn("6x SELECT", logs.output[0])
+
+        staff = User.objects.create_user(
+            username="staff", password="password", is_staff=True
+        )
+        self.client.force_login(staff)
+        self.client.post(reverse("messaging-notifications-read"))
+        data = self.client.get(reverse("query-stats")).json()
+        self.assertEqual(data["<unresolved>"]["requests"], 1)
+        self.assertEqual(data["<unresolved>"]["queries"], 7)
+        self.assertEqual(len(data["<unresolved>"]["n_plus_one"]), 1)
+        self.assertEqual(data["messaging-notifications-read"]["requests"], 1)
+
+        self.client.force_login(self.bob)
+        self.assertEqual(self.client.get(reverse("query-stats")).status_code, 403)
+
+    def test_seed_dataset_builds_consistent_threads(self):
+        totals = seed_dataset(users=10, messages=300, edit_rate=0.3, batch_size=64)
+        self.assertEqual(totals["messages"], 300)
+        self.assertEqual(Notification.objects.count(), 300)
+
+        seeded = Message.objects.filter(sender__username__startswith="seed-user-")
+        by_pk = seeded.in_bulk()
+        for msg in by_pk.values():
+            if msg.parent_message_id is None:
+                self.assertEqual(
+                    (msg.thread_root_id, msg.path, msg.depth), (None, "", 0)
+                )
+                continue
+            parent = by_pk[msg.parent_message_id]
+            self.assertEqual(msg.thread_root_id, parent.thread_root_pk)
+            self.assertEqual(msg.path, parent.descendant_path)
+            self.assertEqual(msg.depth, parent.depth + 1)
+            self.assertNotEqual(msg.sender_id, msg.receiver_id)
+        self.assertEqual(totals["threads"], seeded.filter(depth=0).count())
+
+        edited = seeded.filter(edited=True).first()
+        entries = list(edited.history())
+        self.assertEqual(
+            [e.seq for e in entries], list(range(edited.edit_count, 0, -1))
+        )
+        self.assertTrue(all(e.old_content for e in entries))
+        self.assertEqual(
+            UnreadCounter.objects.reconcile(
+                list(User.objects.values_list("pk", flat=True))
+            ),
+            0,
+        )
+        # Ids keep counting from the seeded rows
+        msg = Message.objects.create(sender=self.alice, receiver=self.bob, content="x")
+        self.assertGreater(msg.pk, max(by_pk))
+
+    def test_benchmark_suite_writes_comparable_results(self):
+        with tempfile.NamedTemporaryFile(suffix=".json") as f:
+            call_command(
+                "benchmark_suite",
+                users=12,
+                messages=200,
+                repeat=2,
+                output=f.name,
+                stdout=StringIO(),
+                stderr=StringIO(),
+            )
+            results = json.load(f)
+            self.assertEqual(
+                set(results["scenarios"]),
+                {
+                    "thread_list",
+                    "thread_detail_cold",
+                    "thread_detail_warm",
+                    "inbox",
+                    "admin_message_changelist",
+                    "admin_notification_changelist",
+                    "admin_messagehistory_changelist",
+                    "send_message",
+                    "delete_user",
+                },
+            )
+            for summary in results["scenarios"].values():
+                self.assertEqual(summary["runs"], 2)
+                self.assertGreater(summary["queries"]["max"], 0)
+            # The run is rolled back
+            self.assertFalse(User.objects.filter(username__startswith="seed-user-"))
+
+            out = StringIO()
+            call_command(
+                "benchmark_suite",
+                users=12,
+                messages=200,
+                repeat=2,
+                compare=f.name,
+                tolerance=100,
+                stdout=out,
+                stderr=StringIO(),
+            )
+            self.assertIn("thread_detail_warm", out.getvalue())
+
+    @override_settings(MESSAGING_EVENTS_QUEUE_SIZE=2)
+    async def test_event_subscription_resyncs_slow_consumers(self):
+        events.reset_broker()
+        broker = events.get_broker()
+        subscription = await broker.subscribe(self.bob.pk)
+        for i in range(5):
+            broker.publish(self.bob.pk, {"type": "message", "id": i})
+        broker.publish(self.alice.pk, {"type": "message", "id": 99})
+        await asyncio.sleep(0)
+        # Every buffered event was replaced by one resync
+        self.assertIs(await subscription.get(timeout=1), events.RESYNC)
+        self.assertTrue(subscription.queue.empty())
+        self.assertEqual(subscription.dropped, 5)
+        subscription.close()
+        self.assertEqual(broker.subscriber_count(), 0)
+        events.reset_broker()
+
+    @override_settings(MESSAGING_EVENTS_HEARTBEAT=0.01)
+    async def test_inbox_stream_pushes_new_messages(self):
+        events.reset_broker()
+        await sync_to_async(self.async_client.force_login)(self.bob)
+        response = await self.async_client.get(reverse("messaging-inbox-events"))
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        stream = response.streaming_content
+        self.assertIn(b"event: hello", await anext(stream))
+        self.assertEqual(await anext(stream), b": heartbeat\n\n")
+
+        def send():
+            with self.captureOnCommitCallbacks(execute=True):
+                return Message.objects.create(
+                    sender=self.alice, receiver=self.bob, content="Live"
+                )
+
+        msg = await sync_to_async(send)()
+        chunks = []
+        while len(chunks) < 2:
+            chunk = await anext(stream)
+            if not chunk.startswith(b":"):
+                chunks.append(chunk.decode())
+        chunks.sort()
+        self.assertTrue(chunks[0].startswith("event: message\n"))
+        payload = json.loads(chunks[0].split("data: ", 1)[1])
+        self.assertEqual((payload["id"], payload["content"]), (msg.pk, "Live"))
+        self.assertTrue(chunks[1].startswith("event: notification\n"))
+
+        # The server closes the response when the client goes away
+        await stream.aclose()
+        request_finished.disconnect(close_old_connections)
+        try:
+            await sync_to_async(response.close)()
+        finally:
+            request_finished.connect(close_old_connections)
+        self.assertEqual(events.get_broker().subscriber_count(), 0)
+        events.reset_broker()
+
+        # The sync WSGI stack cannot hold a stream open
+        await sync_to_async(self.client.force_login)(self.bob)
+        response = await sync_to_async(self.client.get)(
+            reverse("messaging-inbox-events")
+        )
+        self.assertEqual(response.status_code, 501)
+
+    async def test_async_read_views_render_like_the_sync_views(self):
+        from chats import views as chat_views
+
+        from . import async_views, views
+
+        def setup():
+            root = Message.objects.create(
+                sender=self.alice, receiver=self.bob, content="Root"
+            )
+            reply = Message.objects.create(
+                sender=self.bob,
+                receiver=self.alice,
+                content="Reply",
+                parent_message=root,
+            )
+            Message.objects.create(
+                sender=self.alice,
+                receiver=self.bob,
+                content="Again",
+                parent_message=reply,
+            )
+            return root
+
+        root = await sync_to_async(setup)()
+        pairs = [
+            (views.inbox, async_views.inbox, {}),
+            (views.thread_list, async_views.thread_list, {}),
+            (views.thread_detail, async_views.thread_detail, {"pk": root.pk}),
+            (
+                chat_views.conversation_messages,
+                chat_views.aconversation_messages,
+                {"message_pk": root.pk},
+            ),
+        ]
+        for sync_view, async_view, kwargs in pairs:
+            request = RequestFactory().get("/")
+            request.user = self.bob
+            expected = await sync_to_async(sync_view)(request, **kwargs)
+            request = RequestFactory().get("/")
+            request.user = self.bob
+            response = await async_view(request, **kwargs)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.content, expected.content)
+
+        # Unknown threads are still a 404
+        request = RequestFactory().get("/")
+        request.user = self.bob
+        with self.assertRaises(Http404):
+            await async_views.thread_detail(request, pk=root.pk + 100)
+
+
+@unittest.skipUnless(connection.vendor == "sqlite", "EXPLAIN format is SQLite's")
+class QueryPlanTests(TestCase):
+    """Hot listing queries must seek an index and never sort in a temp B-tree."""
+
+    def setUp(self):
+        self.alice = User.objects.create_user(username="alice", password="password")
+        self.bob = User.objects.create_user(username="bob", password="password")
+        self.msg = Message.objects.create(
+            sender=self.alice, receiver=self.bob, content="Hello Bob"
+        )
+
+    def assertUsesIndex(self, qs):
+        plan = qs.explain()
+        self.assertNotIn("USE TEMP B-TREE", plan)
+        for line in plan.splitlines():
+            self.assertNotRegex(line, r"\bSCAN messaging_", plan)
+        return plan
+
+    def test_unread_for_user_uses_index(self):
+        qs = Message.unread.unread_for_user(self.bob).select_related("sender")
+        plan = self.assertUsesIndex(qs)
+        self.assertIn("msg_unread_receiver_ts_idx", plan)
+        # Keyset pages add a range predicate and the id tie-breaker
+        page_qs = qs.filter(
+            Q(timestamp__lt=self.msg.timestamp)
+            | Q(timestamp=self.msg.timestamp, pk__lt=self.msg.pk)
+        ).order_by("-timestamp", "-pk")
+        self.assertUsesIndex(page_qs)
+
+    def test_thread_root_listing_uses_index(self):
+        qs = Message.fetch_thread_root_messages().order_by("-timestamp", "-pk")
+        plan = self.assertUsesIndex(qs)
+        self.assertIn("msg_parent_ts_idx", plan)
+
+    def test_notification_listing_uses_index(self):
+        plan = self.assertUsesIndex(
+            Notification.objects.filter(user=self.bob, read=False)
+        )
+        self.assertIn("notif_user_created_idx", plan)
+        self.assertUsesIndex(Notification.objects.filter(user=self.bob))
@@ -0,0 +1,143 @@
+"""Versioned cache for thread trees.
+
+Every thread (identified by its root message id) has a version number in
+the cache. Cached trees are stored under a key that includes the version,
+so they can be kept indefinitely: the Message save/delete signals (and the
+bulk write paths) bump the version, which makes every older entry
+unreachable. Only the tree shared by all viewers is cached; per-viewer
+state such as unread flags is computed on each request.
+
+Hit, miss and invalidation counts are kept per process (see `stats`).
+"""
+
+import threading
+import time
+from collections import Counter
+from functools import partial
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+
+from .models import ThreadTree
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def _cache():
+    return caches[getattr(settings, "MESSAGING_THREAD_CACHE_ALIAS", "default")]
+
+
+def _timeout():
+    # None keeps entries until evicted; stale versions simply age out
+    return getattr(settings, "MESSAGING_THREAD_CACHE_TIMEOUT", None)
+
+
+def _count(event, n=1):
+    with _stats_lock:
+        _stats[event] += n
+
+
+def stats():
+    """Return this process's ``{"hits", "misses", "invalidations"}`` counts."""
+    with _stats_lock:
+        return {
+            "hits": _stats["hits"],
+            "misses": _stats["misses"],
+            "invalidations": _stats["invalidations"],
+        }
+
+
+def reset_stats():
+    with _stats_lock:
+        _stats.clear()
+
+
+def _version_key(root_pk):
+    return f"messaging:thread:{root_pk}:version"
+
+
+def _initial_version():
+    # Start from the clock so a version key lost to eviction can never
+    # come back with a number an older cached tree was stored under.
+    return int(time.time() * 1000)
+
+
+def thread_version(root_pk):
+    """Return the current cache version of the thread rooted at `root_pk`."""
+    cache = _cache()
+    key = _version_key(root_pk)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _initial_version(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+async def athread_version(root_pk):
+    """Async version of `thread_version`."""
+    cache = _cache()
+    key = _version_key(root_pk)
+    version = await cache.aget(key)
+    if version is None:
+        await cache.aadd(key, _initial_version(), timeout=None)
+        version = await cache.aget(key)
+    return version
+
+
+def invalidate_threads(root_pks):
+    """Bump the version of every thread in `root_pks`."""
+    cache = _cache()
+    root_pks = set(root_pks)
+    for root_pk in root_pks:
+        key = _version_key(root_pk)
+        try:
+            cache.incr(key)
+        except ValueError:
+            # No version yet: nothing of this thread can be cached
+            cache.add(key, _initial_version(), timeout=None)
+    _count("invalidations", len(root_pks))
+
+
+def _load_thread(message):
+    return ThreadTree.objects.for_root(message.thread_root_pk).nested(message.pk)
+
+
+def _tree_key(message, version):
+    return f"messaging:thread:{message.thread_root_pk}:v{version}:tree:{message.pk}"
+
+
+def get_thread_tree(message, build=None):
+    """Return the cached tree of `message`, building it on a miss.
+
+    `message` only needs `pk` and `thread_root_id` loaded. `build()` returns
+    the tree; it defaults to the thread's stored `ThreadTree` plus one
+    batched fetch of the message bodies and is only called on a miss.
+    """
+    cache = _cache()
+    key = _tree_key(message, thread_version(message.thread_root_pk))
+    tree = cache.get(key)
+    if tree is not None:
+        _count("hits")
+        return tree
+
+    _count("misses")
+    tree = build() if build is not None else _load_thread(message)
+    cache.set(key, tree, timeout=_timeout())
+    return tree
+
+
+async def aget_thread_tree(message, build=None):
+    """Async version of `get_thread_tree`; a miss runs `build()` in a thread."""
+    cache = _cache()
+    key = _tree_key(message, await athread_version(message.thread_root_pk))
+    tree = await cache.aget(key)
+    if tree is not None:
+        _count("hits")
+        return tree
+
+    _count("misses")
+    tree = await sync_to_async(build or partial(_load_thread, message))()
+    await cache.aset(key, tree, timeout=_timeout())
+    return tree
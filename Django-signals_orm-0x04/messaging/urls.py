@@ -1,10 +1,22 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import async_views, views
+
+# The ASGI deployment serves the read views with their async versions
+read_views = async_views if getattr(settings, "MESSAGING_ASYNC_VIEWS", False) else views
 
 urlpatterns = [
     path("delete-account/", views.delete_user, name="messaging-delete-account"),
-    path("threads/", views.thread_list, name="messaging-thread-list"),
-    path("threads/<int:pk>/", views.thread_detail, name="messaging-thread-detail"),
-    path("inbox/", views.inbox, name="messaging-inbox"),
+    path("threads/", read_views.thread_list, name="messaging-thread-list"),
+    path("threads/<int:pk>/", read_views.thread_detail, name="messaging-thread-detail"),
+    path("inbox/", read_views.inbox, name="messaging-inbox"),
+    path("inbox/events/", views.inbox_stream, name="messaging-inbox-events"),
     path("send/", views.send_message, name="messaging-send-message"),
+    path(
+        "notifications/read/",
+        views.mark_notifications_read,
+        name="messaging-notifications-read",
+    ),
+    path("search/", views.search, name="messaging-search"),
+    path("export/", views.export_data, name="messaging-export"),
 ]
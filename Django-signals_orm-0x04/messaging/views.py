@@ -1,90 +1,137 @@
+import asyncio
+import json
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import logout
+from django.core.handlers.asgi import ASGIRequest
 from django.contrib.auth.decorators import login_required
+from django.conf import settings
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import redirect
 from django.shortcuts import render, get_object_or_404
 from django.db.models import Q
 from django.contrib.auth import get_user_model
 from django.views.decorators.http import require_POST
 from django.urls import reverse
-from django.views.decorators.cache import cache_page
 
-from .models import Message
+from .archive import get_archived_thread_tree
+from .async_views import alogin_required
+from .deletion import delete_user_data
+from .events import RESYNC, get_broker
+from .export import FORMATS, iter_export
+from .models import Message, Notification, UnreadCounter
+from .pagination import DEFAULT_PAGE_SIZE, InvalidCursor
+from .search import search_messages
+from .thread_cache import get_thread_tree
+
+DEFAULT_EVENTS_HEARTBEAT = 15
+DEFAULT_EVENTS_MAX_AGE = 300
+
+
+def _keyset_page(request, queryset):
+    """Return the page of `queryset` selected by the ``cursor`` GET parameter."""
+    per_page = getattr(settings, "MESSAGING_PAGE_SIZE", DEFAULT_PAGE_SIZE)
+    try:
+        return queryset.keyset_page(request.GET.get("cursor"), per_page=per_page)
+    except InvalidCursor:
+        raise Http404("Invalid page cursor")
 
 
 @login_required
 def delete_user(request):
     """Delete the currently authenticated user and redirect to home.
 
-    This view deletes request.user which triggers the post_delete signal to
-    clean up related messaging data.
+    The account is deactivated and logged out first, then its data is removed
+    in bounded batches by `messaging.deletion.delete_user_data` - inline, or
+    by a Celery worker when ``MESSAGING_USER_DELETION`` is ``"celery"``.
     """
     user = request.user
-    # Log the user out after deletion might be handled by calling logout, but
-    # since the user is deleted we'll simply redirect.
-    user.delete()
+    user.is_active = False
+    user.save(update_fields=["is_active"])
+    logout(request)
+
+    if getattr(settings, "MESSAGING_USER_DELETION", "sync") == "celery":
+        from .tasks import delete_user_data_task
+
+        delete_user_data_task.delay(user.pk)
+    else:
+        delete_user_data(user.pk)
     return redirect("/")
 
 
 @login_required
 def thread_list(request):
-    """List root messages (threads) with one level of replies prefetched."""
-    # Use select_related for sender/receiver FKs and prefetch_related for replies
-    roots = Message.fetch_thread_root_messages()
-    return render(request, "messaging/thread_list.html", {"roots": roots})
+    """List root messages (threads), one keyset page at a time, with reply counts."""
+    # select_related for sender/receiver; replies are counted, not loaded
+    page = _keyset_page(request, Message.fetch_thread_summaries())
+    return render(
+        request,
+        "messaging/thread_list.html",
+        {"roots": page.object_list, "page": page},
+    )
 
 
-@cache_page(60)
 @login_required
 def thread_detail(request, pk):
     """Display a single thread (root message) with all replies built into a nested tree.
 
-    This uses a single prefetched queryset of all descendant messages and then
-    builds an in-memory tree to avoid N+1 queries.
+    The tree is shared by all viewers and served from the versioned thread
+    cache until a message in the thread changes (see `messaging.thread_cache`).
+    On a miss all descendants are fetched with one indexed query on the
+    materialized thread path. Per-viewer unread flags are computed per request.
+    Archived threads are served read-only from the archive tables.
     """
-    root = get_object_or_404(Message, pk=pk)
-
-    # Collect all descendants iteratively (BFS) to avoid N+1 queries.
-    # We select_related sender/receiver for each query to reduce DB hits.
-    all_msgs = [root]
-    ids = [root.pk]
-    while ids:
-        children = list(
-            Message.objects.filter(parent_message__in=ids).select_related(
-                "sender", "receiver"
-            )
+    message = (
+        Message.objects.only(
+            "pk", "thread_root_id", "path", "depth", "receiver_id", "read"
         )
-        # stop if no more children
-        if not children:
-            break
-        all_msgs.extend(children)
-        ids = [m.pk for m in children]
-
-    # Build id->message map and children map in-memory
-    msg_map = {m.pk: m for m in all_msgs}
-    children = {}
-    for m in all_msgs:
-        parent_id = getattr(m, "parent_message_id", None)
-        children.setdefault(parent_id, []).append(m)
-
-    def build_tree(msg):
-        return {
-            "message": msg,
-            "replies": [build_tree(c) for c in children.get(msg.pk, [])],
-        }
+        .filter(pk=pk)
+        .first()
+    )
+    if message is None:
+        # Threads moved out by `messaging.archive` are read from the archive
+        tree = get_archived_thread_tree(pk)
+        if tree is None:
+            raise Http404("No message matches the given query.")
+        return render(
+            request,
+            "messaging/thread_detail.html",
+            {"tree": tree, "unread_ids": set(), "archived": True},
+        )
+    tree = get_thread_tree(message)
 
-    tree = build_tree(root)
-    return render(request, "messaging/thread_detail.html", {"tree": tree})
+    unread_ids = set(
+        message.descendants()
+        .filter(receiver=request.user, read=False)
+        .values_list("pk", flat=True)
+    )
+    if message.receiver_id == request.user.pk and not message.read:
+        unread_ids.add(message.pk)
+    return render(
+        request,
+        "messaging/thread_detail.html",
+        {"tree": tree, "unread_ids": unread_ids},
+    )
 
 
 @login_required
 def inbox(request):
-    """Show messages received by the current user with sender preloaded."""
+    """Show messages received by the current user with sender preloaded.
+
+    Results are paginated by cursor (see `messaging.pagination`).
+    """
     # Use the custom manager to fetch unread messages and only retrieve minimal fields.
     qs = (
         Message.unread.unread_for_user(request.user)
         .select_related("sender")
         .only("id", "sender_id", "content", "timestamp")
     )
-    return render(request, "messaging/inbox.html", {"messages": qs})
+    page = _keyset_page(request, qs)
+    return render(
+        request,
+        "messaging/inbox.html",
+        {"messages": page.object_list, "page": page},
+    )
 
 
 @require_POST
@@ -101,3 +148,143 @@ def send_message(request):
     )
     # Redirect to the thread detail for the created message
     return redirect(reverse("messaging-thread-detail", kwargs={"pk": msg.pk}))
+
+
+@login_required
+def export_data(request):
+    """Stream the current user's messages, threads and edit history.
+
+    ``?format=ndjson`` (default) or ``?format=csv``. The response is built
+    chunk by chunk, so memory stays flat however large the export is.
+    """
+    fmt = request.GET.get("format", "ndjson")
+    if fmt not in FORMATS:
+        raise Http404("Unknown export format")
+    response = StreamingHttpResponse(
+        iter_export(request.user, fmt), content_type=FORMATS[fmt]
+    )
+    response["Content-Disposition"] = (
+        f'attachment; filename="messages-{request.user.pk}.{fmt}"'
+    )
+    return response
+
+
+@login_required
+def search(request):
+    """Full-text search (``?q=``) over the messages the user sent or received.
+
+    Results come ranked from the database's full-text index (see
+    `messaging.search`), best match first.
+    """
+    query = request.GET.get("q", "").strip()
+    results = search_messages(query, user=request.user) if query else []
+    return render(
+        request,
+        "messaging/search.html",
+        {"query": query, "results": results},
+    )
+
+
+@require_POST
+@login_required
+def mark_notifications_read(request):
+    """Mark the current user's unread notifications read in one UPDATE.
+
+    POST ``thread`` (a root message id) or ``sender`` (a user id) to mark a
+    single conversation read; without either, everything is marked read.
+    """
+    filters = {}
+    for name in ("thread", "sender"):
+        value = request.POST.get(name)
+        if value:
+            try:
+                filters[name] = int(value)
+            except ValueError:
+                raise Http404(f"Invalid {name}")
+    marked = Notification.objects.mark_read(request.user, **filters)
+    return JsonResponse({"marked": marked})
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def _unread_counts(user):
+    counter = UnreadCounter.objects.for_user(user)
+    return {
+        "unread_messages": counter.unread_messages,
+        "unread_notifications": counter.unread_notifications,
+    }
+
+
+class _InboxEventStream:
+    """The SSE chunks of one user's stream, subscribed on first iteration.
+
+    Django calls `close()` when the response ends, which drops the
+    subscription even if the iterator itself is abandoned.
+    """
+
+    def __init__(self, user, heartbeat, max_age):
+        self.user = user
+        self.heartbeat = heartbeat
+        self.max_age = max_age
+        self.subscription = None
+
+    def close(self):
+        if self.subscription is not None:
+            self.subscription.close()
+
+    async def __aiter__(self):
+        self.subscription = subscription = await get_broker().subscribe(self.user.pk)
+        try:
+            # Subscribed first, so nothing published after this read is missed
+            counts = await sync_to_async(_unread_counts)(self.user)
+            yield f"retry: 3000\n{_sse('hello', counts)}"
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + self.max_age
+            while (remaining := deadline - loop.time()) > 0:
+                try:
+                    event = await subscription.get(
+                        timeout=min(self.heartbeat, remaining)
+                    )
+                except asyncio.TimeoutError:
+                    # Keeps proxies from closing the idle connection
+                    yield ": heartbeat\n\n"
+                    continue
+                if event is RESYNC:
+                    counts = await sync_to_async(_unread_counts)(self.user)
+                    event = {**RESYNC, **counts}
+                yield _sse(event["type"], event)
+        finally:
+            self.close()
+
+
+@alogin_required
+async def inbox_stream(request):
+    """Push the current user's new messages and notifications as server-sent events.
+
+    The stream opens with a ``hello`` event carrying the unread counts,
+    then relays ``message`` and ``notification`` events (see
+    `messaging.events`) with a comment line every
+    ``MESSAGING_EVENTS_HEARTBEAT`` seconds while idle. A ``resync`` event
+    means events were dropped for a slow client, which should reload its
+    inbox. The stream ends after ``MESSAGING_EVENTS_MAX_AGE`` seconds and
+    the browser's EventSource reconnects. Idle streams hold no thread, so
+    this view is only served by the ASGI application.
+    """
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse(
+            "Event streams are served by messaging_app.asgi.", status=501
+        )
+    heartbeat = getattr(
+        settings, "MESSAGING_EVENTS_HEARTBEAT", DEFAULT_EVENTS_HEARTBEAT
+    )
+    max_age = getattr(settings, "MESSAGING_EVENTS_MAX_AGE", DEFAULT_EVENTS_MAX_AGE)
+    response = StreamingHttpResponse(
+        _InboxEventStream(request.user, heartbeat, max_age),
+        content_type="text/event-stream",
+    )
+    response["Cache-Control"] = "no-cache"
+    # Tell nginx-style proxies not to buffer the stream
+    response["X-Accel-Buffering"] = "no"
+    return response
@@ -0,0 +1,19 @@
+"""
+ASGI config for messaging_app project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+Serve it with an ASGI server, e.g. ``uvicorn messaging_app.asgi:application``.
+The live inbox streams (`messaging.views.inbox_stream`) need it: an idle
+stream is a suspended coroutine there instead of a blocked worker.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "messaging_app.settings")
+
+application = get_asgi_application()
@@ -0,0 +1,16 @@
+"""
+Celery application for messaging_app.
+
+Workers are started with ``celery -A messaging_app worker``. Tasks are
+discovered from the installed apps' ``tasks`` modules.
+"""
+
+import os
+
+from celery import Celery
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "messaging_app.settings")
+
+app = Celery("messaging_app")
+app.config_from_object("django.conf:settings", namespace="CELERY")
+app.autodiscover_tasks()
@@ -0,0 +1,246 @@
+"""Per-request query profiling with N+1 detection.
+
+`QueryProfilingMiddleware` wraps every database connection of a sampled
+request (``QUERY_PROFILING_SAMPLE_RATE``) with an execute wrapper that
+times each statement and reduces its SQL to a fingerprint: placeholders,
+literals and ``IN (...)`` lists collapsed, whitespace normalized. A
+fingerprint run more than ``QUERY_PROFILING_N_PLUS_ONE_THRESHOLD`` times in
+one request is flagged as a likely N+1 and logged.
+
+Per view, the process keeps request and query totals, histograms of query
+count and DB time per request, N+1 fingerprints and the slowest
+statements. `query_stats` serves them as JSON to staff users or to callers
+presenting ``QUERY_PROFILING_TOKEN``. Unsampled requests cost one random
+draw; statements run while a streaming response is consumed are not seen.
+"""
+
+import heapq
+import hmac
+import logging
+import random
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack
+from functools import lru_cache
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponseForbidden, JsonResponse
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SAMPLE_RATE = 0.05
+DEFAULT_N_PLUS_ONE_THRESHOLD = 5
+DEFAULT_SLOWEST = 5
+# Upper bounds of the histogram buckets; the last bucket is open-ended
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+DB_TIME_BUCKETS_MS = (1, 5, 10, 50, 100, 500, 1000)
+
+_SAVEPOINT = re.compile(r'"s\d+_x\d+"')
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)", re.IGNORECASE)
+_SPACE = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=4096)
+def fingerprint(sql):
+    """Return `sql` with literals and parameter lists collapsed."""
+    sql = _SAVEPOINT.sub('"?"', sql)
+    sql = _STRING.sub("?", sql)
+    sql = _NUMBER.sub("?", sql)
+    sql = _IN_LIST.sub("IN (...)", sql.replace("%s", "?"))
+    return _SPACE.sub(" ", sql).strip()
+
+
+def _bucket(value, bounds):
+    for bound in bounds:
+        if value <= bound:
+            return f"<={bound}"
+    return f">{bounds[-1]}"
+
+
+class _RequestProfile:
+    """Statements seen during one request; used as a DB execute wrapper."""
+
+    def __init__(self, slowest):
+        self.slowest = slowest
+        self.count = 0
+        self.duration = 0.0
+        self.fingerprints = Counter()
+        self.slow = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            self.count += 1
+            self.duration += duration
+            self.fingerprints[sql] += 1
+            if len(self.slow) < self.slowest:
+                heapq.heappush(self.slow, (duration, sql))
+            elif duration > self.slow[0][0]:
+                heapq.heapreplace(self.slow, (duration, sql))
+
+    def by_fingerprint(self):
+        """Return per-fingerprint counts; raw SQL is only normalized once here."""
+        counts = Counter()
+        for sql, n in self.fingerprints.items():
+            counts[fingerprint(sql)] += n
+        return counts
+
+
+class QueryStats:
+    """Thread-safe, in-process aggregate of the profiled requests per view."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = {}
+
+    def record(self, view, profile, n_plus_one, slowest):
+        db_ms = profile.duration * 1000
+        with self._lock:
+            stats = self._views.setdefault(
+                view,
+                {
+                    "requests": 0,
+                    "queries": 0,
+                    "db_time_ms": 0.0,
+                    "query_count_histogram": Counter(),
+                    "db_time_histogram": Counter(),
+                    "n_plus_one": Counter(),
+                    "slowest": [],
+                },
+            )
+            stats["requests"] += 1
+            stats["queries"] += profile.count
+            stats["db_time_ms"] += db_ms
+            stats["query_count_histogram"][
+                _bucket(profile.count, QUERY_COUNT_BUCKETS)
+            ] += 1
+            stats["db_time_histogram"][_bucket(db_ms, DB_TIME_BUCKETS_MS)] += 1
+            stats["n_plus_one"].update(n_plus_one)
+            merged = stats["slowest"] + [
+                (round(d * 1000, 3), fingerprint(sql)) for d, sql in profile.slow
+            ]
+            stats["slowest"] = heapq.nlargest(slowest, set(merged))
+
+    def snapshot(self):
+        """Return the aggregates as plain JSON-serializable data."""
+        with self._lock:
+            return {
+                view: {
+                    "requests": s["requests"],
+                    "queries": s["queries"],
+                    "avg_queries": s["queries"] / s["requests"],
+                    "db_time_ms": round(s["db_time_ms"], 3),
+                    "avg_db_time_ms": round(s["db_time_ms"] / s["requests"], 3),
+                    "query_count_histogram": dict(s["query_count_histogram"]),
+                    "db_time_histogram": dict(s["db_time_histogram"]),
+                    "n_plus_one": dict(s["n_plus_one"].most_common(10)),
+                    "slowest": [{"ms": ms, "sql": sql} for ms, sql in s["slowest"]],
+                }
+                for view, s in self._views.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self._views.clear()
+
+
+stats = QueryStats()
+
+
+class QueryProfilingMiddleware:
+    """Profile the queries of a sample of requests (see module docstring).
+
+    Works in both the sync (WSGI) and async (ASGI) middleware chains.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        self.sample_rate = getattr(
+            settings, "QUERY_PROFILING_SAMPLE_RATE", DEFAULT_SAMPLE_RATE
+        )
+        self.threshold = getattr(
+            settings,
+            "QUERY_PROFILING_N_PLUS_ONE_THRESHOLD",
+            DEFAULT_N_PLUS_ONE_THRESHOLD,
+        )
+        self.slowest = getattr(settings, "QUERY_PROFILING_SLOWEST", DEFAULT_SLOWEST)
+
+    def _sampled(self):
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def _wrap_connections(self, stack, profile):
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(profile))
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not self._sampled():
+            return self.get_response(request)
+
+        profile = _RequestProfile(self.slowest)
+        with ExitStack() as stack:
+            self._wrap_connections(stack, profile)
+            response = self.get_response(request)
+        self._record(request, profile)
+        return response
+
+    async def __acall__(self, request):
+        if not self._sampled():
+            return await self.get_response(request)
+
+        # Connections are context-local, so queries the view runs through
+        # sync_to_async go through these same wrappers
+        profile = _RequestProfile(self.slowest)
+        with ExitStack() as stack:
+            self._wrap_connections(stack, profile)
+            response = await self.get_response(request)
+        self._record(request, profile)
+        return response
+
+    def _record(self, request, profile):
+        match = getattr(request, "resolver_match", None)
+        view = (match.view_name or match._func_path) if match else "<unresolved>"
+        n_plus_one = {
+            fp: n for fp, n in profile.by_fingerprint().items() if n > self.threshold
+        }
+        if n_plus_one:
+            logger.warning(
+                "Likely N+1 in %s: %s",
+                view,
+                "; ".join(f"{n}x {fp}" for fp, n in n_plus_one.items()),
+            )
+        stats.record(view, profile, n_plus_one, self.slowest)
+
+
+def query_stats(request):
+    """Return the aggregated query profile as JSON (staff or token only).
+
+    ``?reset=1`` clears the aggregates after returning them.
+    """
+    token = getattr(settings, "QUERY_PROFILING_TOKEN", "")
+    presented = request.headers.get("X-Profiling-Token", "")
+    allowed = (token and hmac.compare_digest(presented, token)) or (
+        request.user.is_authenticated and request.user.is_staff
+    )
+    if not allowed:
+        return HttpResponseForbidden()
+    data = stats.snapshot()
+    if request.GET.get("reset"):
+        stats.reset()
+    return JsonResponse(data)
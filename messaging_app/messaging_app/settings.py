@@ -42,6 +42,7 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "messaging_app.profiling.QueryProfilingMiddleware",
 ]
 
 ROOT_URLCONF = "messaging_app.urls"
@@ -63,6 +64,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = "messaging_app.wsgi.application"
+ASGI_APPLICATION = "messaging_app.asgi.application"
 
 # Database
 DATABASES = {
@@ -112,6 +114,10 @@ MEDIA_ROOT = BASE_DIR / "media"
 # Default primary key field type
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
+# MySQL has no partial indexes; Django skips the conditional messaging
+# indexes there and the receiver/parent FK indexes are used instead.
+SILENCED_SYSTEM_CHECKS = ["models.W037"]
+
 # Caching configuration
 CACHES = {
     "default": {
@@ -122,6 +128,56 @@ CACHES = {
     }
 }
 
+# Celery (queued notification delivery)
+CELERY_BROKER_URL = os.getenv(
+    "CELERY_BROKER_URL", os.getenv("REDIS_URL", "redis://redis:6379/0")
+)
+CELERY_TASK_ACKS_LATE = True
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+
+# Messaging: how new-message notifications are created.
+# "sync" writes them inline, "eager" batches them in-process on commit and
+# "celery" hands the batches to a Celery worker.
+MESSAGING_NOTIFICATION_DISPATCH = os.getenv("MESSAGING_NOTIFICATION_DISPATCH", "sync")
+MESSAGING_NOTIFICATION_BATCH_SIZE = int(
+    os.getenv("MESSAGING_NOTIFICATION_BATCH_SIZE", "500")
+)
+# "thread" / "sender" keep one unread notification per thread / sender,
+# updated in place, instead of one per message ("off")
+MESSAGING_NOTIFICATION_COALESCE = os.getenv("MESSAGING_NOTIFICATION_COALESCE", "off")
+
+# Account deletion: "sync" deletes in the request, "celery" in a worker
+MESSAGING_USER_DELETION = os.getenv("MESSAGING_USER_DELETION", "sync")
+MESSAGING_DELETE_BATCH_SIZE = int(os.getenv("MESSAGING_DELETE_BATCH_SIZE", "500"))
+
+# Archival: threads with no message newer than this many days are moved to
+# the archive tables by `manage.py archive_messages`
+MESSAGING_ARCHIVE_AFTER_DAYS = int(os.getenv("MESSAGING_ARCHIVE_AFTER_DAYS", "365"))
+
+# Serve the messaging read views with their async versions; set it for the
+# ASGI deployment (messaging_app.asgi), leave it off under WSGI
+MESSAGING_ASYNC_VIEWS = os.getenv("MESSAGING_ASYNC_VIEWS", "False").lower() == "true"
+
+# Live inbox events (messaging.events): the broker fanning events out to
+# the SSE streams (RedisBroker to share them between processes), events
+# buffered per stream before it is told to resync, and the heartbeat and
+# maximum lifetime of a stream in seconds
+MESSAGING_EVENT_BROKER = os.getenv(
+    "MESSAGING_EVENT_BROKER", "messaging.events.InProcessBroker"
+)
+MESSAGING_EVENTS_REDIS_URL = os.getenv("MESSAGING_EVENTS_REDIS_URL", CELERY_BROKER_URL)
+MESSAGING_EVENTS_QUEUE_SIZE = int(os.getenv("MESSAGING_EVENTS_QUEUE_SIZE", "100"))
+MESSAGING_EVENTS_HEARTBEAT = float(os.getenv("MESSAGING_EVENTS_HEARTBEAT", "15"))
+MESSAGING_EVENTS_MAX_AGE = float(os.getenv("MESSAGING_EVENTS_MAX_AGE", "300"))
+
+# Query profiling (messaging_app.profiling): share of requests profiled,
+# repeats of one statement flagged as N+1, and the token for /_stats/queries/
+QUERY_PROFILING_SAMPLE_RATE = float(os.getenv("QUERY_PROFILING_SAMPLE_RATE", "0.05"))
+QUERY_PROFILING_N_PLUS_ONE_THRESHOLD = int(
+    os.getenv("QUERY_PROFILING_N_PLUS_ONE_THRESHOLD", "5")
+)
+QUERY_PROFILING_TOKEN = os.getenv("QUERY_PROFILING_TOKEN", "")
+
 # Logging configuration
 LOGGING = {
     "version": 1,
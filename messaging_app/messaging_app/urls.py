@@ -19,6 +19,8 @@ from django.contrib import admin
 from django.urls import path, include
 from django.http import HttpResponse
 
+from .profiling import query_stats
+
 
 def home(request):
     return HttpResponse("Welcome to the Messaging App API!")
@@ -29,4 +31,5 @@ urlpatterns = [
     path("", home, name="home"),
     path("messaging/", include("messaging.urls")),
     path("chats/", include("chats.urls")),
+    path("_stats/queries/", query_stats, name="query-stats"),
 ]
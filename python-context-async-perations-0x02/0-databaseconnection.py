@@ -1,25 +1,33 @@
 import sqlite3
 
+import shared  # noqa: F401  (puts python-decorators-0x01 on sys.path)
+from connection_pool import get_pool
+
 class DatabaseConnection:
     """A custom context manager for database connections"""
     
-    def __init__(self, db_name):
+    def __init__(self, db_name, pool=None):
         self.db_name = db_name
+        self.pool = pool
         self.connection = None
         self.cursor = None
     
     def __enter__(self):
-        """Enter the runtime context and return the connection"""
-        self.connection = sqlite3.connect(self.db_name)
+        """Enter the runtime context and return a cursor on a pooled connection"""
+        if self.pool is None:
+            self.pool = get_pool(self.db_name)
+        self.connection = self.pool.acquire()
         self.cursor = self.connection.cursor()
         return self.cursor
     
     def __exit__(self, exc_type, exc_val, exc_tb):
-        """Exit the runtime context and close the connection"""
+        """Exit the runtime context and return the connection to the pool"""
         if self.cursor:
             self.cursor.close()
+            self.cursor = None
         if self.connection:
-            self.connection.close()
+            self.pool.release(self.connection)
+            self.connection = None
         # Return False to propagate exceptions, True to suppress them
         return False
 
@@ -1,30 +1,43 @@
 import sqlite3
 
+import shared  # noqa: F401  (puts python-decorators-0x01 on sys.path)
+from connection_pool import get_pool
+
 class ExecuteQuery:
     """A reusable context manager for executing parameterized queries"""
     
-    def __init__(self, db_name, query, params=None):
+    def __init__(self, db_name, query, params=None, pool=None):
         self.db_name = db_name
         self.query = query
         self.params = params or ()
+        self.pool = pool
         self.connection = None
         self.cursor = None
         self.results = None
     
     def __enter__(self):
-        """Enter the runtime context and execute the query"""
-        self.connection = sqlite3.connect(self.db_name)
-        self.cursor = self.connection.cursor()
-        self.cursor.execute(self.query, self.params)
-        self.results = self.cursor.fetchall()
+        """Enter the runtime context and execute the query on a pooled connection"""
+        if self.pool is None:
+            self.pool = get_pool(self.db_name)
+        self.connection = self.pool.acquire()
+        try:
+            self.cursor = self.connection.cursor()
+            self.cursor.execute(self.query, self.params)
+            self.results = self.cursor.fetchall()
+        except BaseException:
+            # __exit__ does not run when __enter__ fails
+            self.__exit__(None, None, None)
+            raise
         return self.results
     
     def __exit__(self, exc_type, exc_val, exc_tb):
-        """Exit the runtime context and clean up resources"""
+        """Exit the runtime context and return the connection to the pool"""
         if self.cursor:
             self.cursor.close()
+            self.cursor = None
         if self.connection:
-            self.connection.close()
+            self.pool.release(self.connection)
+            self.connection = None
         return False
 
 # Example usage
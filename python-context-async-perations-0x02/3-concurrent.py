@@ -1,9 +1,12 @@
 import asyncio
 import aiosqlite
 
+import shared  # noqa: F401  (puts python-decorators-0x01 on sys.path)
+from query_profiler import ProfiledConnection, profiler
+
 async def async_fetch_users():
     """Fetch all users from the database"""
-    async with aiosqlite.connect("test.db") as db:
+    async with aiosqlite.connect("test.db", factory=ProfiledConnection) as db:
         async with db.execute("SELECT * FROM users") as cursor:
             results = await cursor.fetchall()
             print("All users:")
@@ -13,7 +16,7 @@ async def async_fetch_users():
 
 async def async_fetch_older_users():
     """Fetch users older than 40 from the database"""
-    async with aiosqlite.connect("test.db") as db:
+    async with aiosqlite.connect("test.db", factory=ProfiledConnection) as db:
         async with db.execute("SELECT * FROM users WHERE age > ?", (40,)) as cursor:
             results = await cursor.fetchall()
             print("Users older than 40:")
@@ -31,7 +34,7 @@ async def fetch_concurrently():
 
 async def setup_test_database():
     """Set up test database with sample data"""
-    async with aiosqlite.connect("test.db") as db:
+    async with aiosqlite.connect("test.db", factory=ProfiledConnection) as db:
         await db.execute("""
             CREATE TABLE IF NOT EXISTS users (
                 id INTEGER PRIMARY KEY,
@@ -57,4 +60,6 @@ async def main():
 
 if __name__ == "__main__":
     # Run the main async function
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
+    # Every statement above went through a profiled connection
+    print(profiler.report())
\ No newline at end of file
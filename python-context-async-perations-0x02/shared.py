@@ -0,0 +1,14 @@
+"""Make the helper modules of python-decorators-0x01 importable from here.
+
+`connection_pool` and `query_profiler` live there only; import this module
+before them.
+"""
+
+import os
+import sys
+
+SHARED_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir, 'python-decorators-0x01'
+)
+if SHARED_DIR not in sys.path:
+    sys.path.append(SHARED_DIR)
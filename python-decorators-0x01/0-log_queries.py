@@ -1,22 +1,17 @@
 import sqlite3
-import functools
+
+from query_profiler import profiler
 
 #### decorator to log SQL queries
 def log_queries(func):
-    @functools.wraps(func)
-    def wrapper(*args, **kwargs):
-        # Extract the query from keyword arguments
-        query = kwargs.get('query')
-        if query:
-            print(f"Executing query: {query}")
-        else:
-            # If query is passed as positional argument, try to find it
-            for arg in args:
-                if isinstance(arg, str) and arg.strip().upper().startswith(('SELECT', 'INSERT', 'UPDATE', 'DELETE')):
-                    print(f"Executing query: {arg}")
-                    break
-        return func(*args, **kwargs)
-    return wrapper
+    """Record each call in the query profiler: count, latency, rows, slow-query log.
+
+    Works on sync and async functions. The SQL is taken from the `query`
+    keyword argument or the first positional string that looks like SQL;
+    it is logged at DEBUG level (``query_profiler`` logger) instead of being
+    printed on every call.
+    """
+    return profiler.profile(func)
 
 @log_queries
 def fetch_all_users(query):
@@ -28,4 +23,5 @@ def fetch_all_users(query):
     return results
 
 #### fetch users while logging the query
-users = fetch_all_users(query="SELECT * FROM users")
\ No newline at end of file
+users = fetch_all_users(query="SELECT * FROM users")
+print(profiler.report())
@@ -1,18 +1,15 @@
-import sqlite3 
 import functools
 
+from connection_pool import get_pool
+
 def with_db_connection(func):
     @functools.wraps(func)
     def wrapper(*args, **kwargs):
-        # Establish database connection
-        conn = sqlite3.connect('users.db')
-        try:
+        # Borrow a pooled connection; it goes back to the pool even if an error occurs
+        with get_pool('users.db').connection() as conn:
             # Inject the connection as a keyword argument (not part of public signature)
             result = func(*args, conn=conn, **kwargs)
             return result
-        finally:
-            # Ensure connection is closed even if an error occurs
-            conn.close()
     return wrapper
 
 @with_db_connection 
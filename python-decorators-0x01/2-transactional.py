@@ -1,31 +1,19 @@
-import sqlite3 
 import functools
 
+from connection_pool import get_pool
+from transactions import transactional
+
 # Copy the with_db_connection decorator from previous task
 def with_db_connection(func):
     @functools.wraps(func)
     def wrapper(*args, **kwargs):
-        conn = sqlite3.connect('users.db')
-        try:
-            result = func(conn, *args, **kwargs)
-            return result
-        finally:
-            conn.close()
-    return wrapper
-
-# Transactional decorator
-def transactional(func):
-    @functools.wraps(func)
-    def wrapper(conn, *args, **kwargs):
-        try:
+        with get_pool('users.db').connection() as conn:
             result = func(conn, *args, **kwargs)
-            conn.commit()  # Commit if no exception
             return result
-        except Exception as e:
-            conn.rollback()  # Rollback on error
-            raise e  # Re-raise the exception
     return wrapper
 
+# Transactional decorator: nested calls become savepoints, and
+# transactional(group=GroupCommit(...)) shares commits (see transactions.py)
 @with_db_connection 
 @transactional 
 def update_user_email(conn=None, user_id=None, new_email=None): 
@@ -1,39 +1,22 @@
-import time
-import sqlite3 
 import functools
 
+from connection_pool import get_pool
+from retry import default_budget, retry_on_failure
+
 # with_db_connection decorator
 def with_db_connection(func):
     @functools.wraps(func)
     def wrapper(*args, **kwargs):
-        conn = sqlite3.connect('users.db')
-        try:
+        with get_pool('users.db').connection() as conn:
             result = func(conn, *args, **kwargs)
             return result
-        finally:
-            conn.close()
     return wrapper
 
-# Retry on failure decorator
-def retry_on_failure(retries=3, delay=2):
-    def decorator(func):
-        @functools.wraps(func)
-        def wrapper(*args, **kwargs):
-            last_exception = None
-            for attempt in range(retries):
-                try:
-                    return func(*args, **kwargs)
-                except Exception as e:
-                    last_exception = e
-                    if attempt < retries - 1:  # Don't sleep on last attempt
-                        time.sleep(delay)
-                    print(f"Attempt {attempt + 1} failed: {e}. Retrying...")
-            raise last_exception  # If all retries fail, raise the last exception
-        return wrapper
-    return decorator
-
+# Retry on failure decorator: exponential backoff with jitter, transient
+# errors only, bounded by the shared retry budget (see retry.py; also for
+# coroutines)
 @with_db_connection
-@retry_on_failure(retries=3, delay=1)
+@retry_on_failure(retries=3, delay=1, budget=default_budget)
 def fetch_users_with_retry(conn):
     cursor = conn.cursor()
     cursor.execute("SELECT * FROM users")
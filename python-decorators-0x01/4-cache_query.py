@@ -1,44 +1,276 @@
+import re
+import sys
 import time
-import sqlite3 
+import sqlite3
 import functools
+import threading
+from collections import OrderedDict
+
+from connection_pool import get_pool
 
 # with_db_connection decorator
 def with_db_connection(func):
+    @functools.wraps(func)
     def wrapper(*args, **kwargs):
-        conn = sqlite3.connect('users.db')
-        try:
+        with get_pool('users.db').connection() as conn:
+            # Writes made through this connection invalidate the cached reads
+            query_cache.track(conn)
             result = func(conn, *args, **kwargs)
             return result
-        finally:
-            conn.close()
     return wrapper
 
-query_cache = {}
+
+# String literals are kept as they are; whitespace elsewhere is collapsed
+_SQL_TOKEN_RE = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\")|\s+")
+_WRITE_RE = re.compile(r'^\s*(INSERT|UPDATE|DELETE|REPLACE|DROP|ALTER)\b', re.IGNORECASE)
+_WRITE_TABLE_RE = re.compile(
+    r'(?:INSERT(?:\s+OR\s+\w+)?\s+INTO|REPLACE\s+INTO|UPDATE(?:\s+OR\s+\w+)?'
+    r'|DELETE\s+FROM|DROP\s+TABLE(?:\s+IF\s+EXISTS)?|ALTER\s+TABLE)'
+    r'\s+(?:\w+\.)?["`\[]?(\w+)',
+    re.IGNORECASE,
+)
+_END_TRANSACTION_RE = re.compile(
+    r'^\s*(COMMIT|END|ROLLBACK)(?:\s+TRANSACTION)?\s*;?\s*$', re.IGNORECASE
+)
+
+
+def normalize_sql(query):
+    """Collapse whitespace outside string literals and drop a trailing ';'."""
+    def replace(match):
+        return match.group(1) or ' '
+    return _SQL_TOKEN_RE.sub(replace, query).strip().rstrip(';').rstrip()
+
+
+def written_tables(statement):
+    """Return the tables an INSERT/UPDATE/DELETE/REPLACE/DROP/ALTER writes to."""
+    if not _WRITE_RE.match(statement):
+        return set()
+    return {name.lower() for name in _WRITE_TABLE_RE.findall(statement)}
+
+
+def _sizeof(result):
+    # Rows are tuples of scalars, so one level down covers nearly everything
+    size = sys.getsizeof(result)
+    if isinstance(result, (list, tuple)):
+        for row in result:
+            size += sys.getsizeof(row)
+            if isinstance(row, (tuple, list)):
+                size += sum(sys.getsizeof(value) for value in row)
+    return size
+
+
+class QueryCache:
+    """Thread-safe LRU cache of query results with per-table invalidation.
+
+    Entries are evicted least recently used first once there are more than
+    `maxsize` of them or together they take more than `max_bytes`; with a
+    `ttl` (seconds) they also expire. Every entry remembers the tables its
+    query read (as reported by SQLite's authorizer, so views and subqueries
+    count), and a write to any of those tables drops it. Writes are seen on
+    connections passed to `track`: when the statement runs and again when
+    its transaction commits, so a read racing the write cannot keep the old
+    rows. Writes made by triggers or foreign key cascades are not seen; call
+    `invalidate` for those.
+    """
+
+    def __init__(self, maxsize=128, max_bytes=8 * 1024 * 1024, ttl=None):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.RLock()
+        # key -> (result, tables, size, expires_at)
+        self._entries = OrderedDict()
+        # table -> keys of the entries that read it
+        self._by_table = {}
+        self._bytes = 0
+        # Bumped by every invalidation; a result is only stored if none of
+        # its tables were invalidated after its query started
+        self._epoch = 0
+        self._table_epochs = {}
+        self._clear_epoch = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def epoch(self):
+        with self._lock:
+            return self._epoch
+
+    def get(self, key):
+        """Return ``(True, result)`` for a live entry, ``(False, None)`` otherwise."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[3] is not None and entry[3] <= time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, entry[0]
+
+    def put(self, key, result, tables, started_epoch):
+        """Store `result`, read from `tables` by a query started at `started_epoch`."""
+        tables = frozenset(t.lower() for t in tables)
+        size = _sizeof(result)
+        if size > self.max_bytes:
+            return False
+        with self._lock:
+            if started_epoch < self._clear_epoch or any(
+                self._table_epochs.get(t, 0) > started_epoch for t in tables
+            ):
+                # A write landed while the query ran; the result may be stale
+                return False
+            if key in self._entries:
+                self._remove(key)
+            expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+            self._entries[key] = (result, tables, size, expires_at)
+            self._bytes += size
+            for table in tables:
+                self._by_table.setdefault(table, set()).add(key)
+            while len(self._entries) > self.maxsize or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+            return True
+
+    def _remove(self, key):
+        result, tables, size, expires_at = self._entries.pop(key)
+        self._bytes -= size
+        for table in tables:
+            keys = self._by_table.get(table)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_table[table]
+
+    def invalidate(self, tables=None):
+        """Drop the entries that read any of `tables`, or every entry."""
+        with self._lock:
+            self._epoch += 1
+            if tables is None:
+                self.invalidations += len(self._entries)
+                self._entries.clear()
+                self._by_table.clear()
+                self._bytes = 0
+                self._clear_epoch = self._epoch
+                return
+            for table in tables:
+                table = table.lower()
+                self._table_epochs[table] = self._epoch
+                for key in list(self._by_table.get(table, ())):
+                    self._remove(key)
+                    self.invalidations += 1
+
+    def clear(self):
+        self.invalidate()
+
+    def track(self, conn):
+        """Invalidate on the writes executed through `conn` (uses its trace callback)."""
+        pending = set()
+
+        def trace(statement):
+            tables = written_tables(statement)
+            if tables:
+                pending.update(tables)
+                self.invalidate(tables)
+            elif pending:
+                match = _END_TRANSACTION_RE.match(statement)
+                if match:
+                    if match.group(1).upper() != 'ROLLBACK':
+                        self.invalidate(pending)
+                    pending.clear()
+
+        conn.set_trace_callback(trace)
+        return conn
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+            }
+
+
+query_cache = QueryCache()
+
+
+def _read_tables(conn, func, *args, **kwargs):
+    """Call `func` and return its result with the tables SQLite read for it."""
+    tables = set()
+
+    def authorize(action, arg1, arg2, db_name, trigger):
+        if action == sqlite3.SQLITE_READ and arg1:
+            tables.add(arg1.lower())
+        return sqlite3.SQLITE_OK
+
+    # Setting an authorizer makes SQLite prepare the statements again
+    conn.set_authorizer(authorize)
+    try:
+        result = func(*args, **kwargs)
+    finally:
+        conn.set_authorizer(None)
+    return result, tables
+
 
 # Cache query decorator
-def cache_query(func):
+def cache_query(func=None, *, cache=None):
+    """Cache the result of `func(conn, query, *params)` in `cache` (`query_cache`).
+
+    The key is the function, the normalized SQL and the remaining
+    arguments, so the same query with other parameters is a separate
+    entry. Writes are executed and invalidate what they touch instead of
+    being cached; so are calls whose arguments cannot be hashed.
+    """
+    if func is None:
+        return functools.partial(cache_query, cache=cache)
+
     @functools.wraps(func)
     def wrapper(conn, query, *args, **kwargs):
-        # Use query as cache key
-        cache_key = query
-        
-        # Check if result is in cache
-        if cache_key in query_cache:
-            print("Using cached result")
-            return query_cache[cache_key]
-        
-        # Execute query and cache result
-        print("Executing query and caching result")
-        result = func(conn, query, *args, **kwargs)
-        query_cache[cache_key] = result
-        return result
+        store = query_cache if cache is None else cache
+        if written_tables(query):
+            try:
+                return func(conn, query, *args, **kwargs)
+            finally:
+                store.invalidate(written_tables(query))
+
+        cache_key = (
+            func.__module__,
+            func.__qualname__,
+            normalize_sql(query),
+            args,
+            tuple(sorted(kwargs.items())),
+        )
+        try:
+            hash(cache_key)
+        except TypeError:
+            return func(conn, query, *args, **kwargs)
+
+        hit, result = store.get(cache_key)
+        if hit:
+            return list(result) if isinstance(result, list) else result
+
+        started_epoch = store.epoch()
+        result, tables = _read_tables(conn, func, conn, query, *args, **kwargs)
+        store.put(cache_key, result, tables, started_epoch)
+        return list(result) if isinstance(result, list) else result
     return wrapper
 
 @with_db_connection
 @cache_query
-def fetch_users_with_cache(conn, query):
+def fetch_users_with_cache(conn, query, params=()):
     cursor = conn.cursor()
-    cursor.execute(query)
+    cursor.execute(query, params)
     return cursor.fetchall()
 
 #### First call will cache the result
@@ -0,0 +1,107 @@
+"""Writes/sec of `update_user_email` with per-call commits against group commit.
+
+Each run updates one row per call on a fresh database (rollback journal,
+``synchronous=FULL``: every COMMIT is fsynced), in two shapes:
+
+* sequential: one thread issues the calls back to back; in group mode it
+  collects the futures and waits for them at the end;
+* concurrent: `--threads` threads each wait for every call to be durable
+  before issuing the next, like request handlers would.
+
+    python benchmark_group_commit.py --calls 2000 --threads 16 --dir .
+"""
+
+import os
+import time
+import sqlite3
+import argparse
+import tempfile
+import threading
+
+from transactions import GroupCommit, transactional
+
+
+def update_user_email(conn, user_id, new_email):
+    conn.execute('UPDATE users SET email = ? WHERE id = ?', (new_email, user_id))
+
+
+def setup_database(path, rows=1000):
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE users (id INTEGER PRIMARY KEY, name TEXT, email TEXT)')
+    conn.executemany(
+        'INSERT INTO users (name, email) VALUES (?, ?)',
+        ((f'user{i}', f'user{i}@example.com') for i in range(rows)),
+    )
+    conn.commit()
+    conn.close()
+
+
+def per_call(path, calls, threads):
+    update = transactional(update_user_email)
+
+    def work(n, count):
+        conn = sqlite3.connect(path, timeout=60)
+        for i in range(count):
+            update(conn, (n * count + i) % 1000 + 1, f'{n}-{i}@example.com')
+        conn.close()
+    return _timed(work, calls, threads)
+
+
+def grouped(path, calls, threads, max_batch, max_delay):
+    with GroupCommit(path, max_batch=max_batch, max_delay=max_delay) as group:
+        update = transactional(update_user_email, group=group)
+
+        def work(n, count):
+            if threads == 1:
+                futures = [
+                    update((n * count + i) % 1000 + 1, f'{n}-{i}@example.com')
+                    for i in range(count)
+                ]
+                for future in futures:
+                    future.result()
+                return
+            for i in range(count):
+                update((n * count + i) % 1000 + 1, f'{n}-{i}@example.com').result()
+        elapsed = _timed(work, calls, threads)
+        commits = group.commits
+    return elapsed, commits
+
+
+def _timed(work, calls, threads):
+    count = calls // threads
+    workers = [threading.Thread(target=work, args=(n, count)) for n in range(threads)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--calls', type=int, default=2000)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--max-batch', type=int, default=100)
+    parser.add_argument('--max-delay', type=float, default=0.001)
+    parser.add_argument('--dir', default=None, help='Directory for the database (fsync matters)')
+    args = parser.parse_args()
+
+    print(f"{'shape':<11} {'mode':<13} {'writes/s':>9} {'commits':>8}")
+    for threads in (1, args.threads):
+        shape = 'sequential' if threads == 1 else f'{threads} threads'
+        calls = args.calls // threads * threads
+        with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+            path = os.path.join(tmp, 'users.db')
+            setup_database(path)
+            elapsed = per_call(path, calls, threads)
+            print(f"{shape:<11} {'per-call':<13} {calls / elapsed:>9.0f} {calls:>8}")
+        with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+            path = os.path.join(tmp, 'users.db')
+            setup_database(path)
+            elapsed, commits = grouped(path, calls, threads, args.max_batch, args.max_delay)
+            print(f"{shape:<11} {'group commit':<13} {calls / elapsed:>9.0f} {commits:>8}")
+
+
+if __name__ == '__main__':
+    main()
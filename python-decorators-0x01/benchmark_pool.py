@@ -0,0 +1,95 @@
+"""Per-call overhead of a connect-per-call helper against the connection pool.
+
+Runs `get_user_by_id`-style lookups against a throwaway database, first
+opening and closing a connection for every call (the old
+``with_db_connection``), then borrowing one from a `ConnectionPool`, with
+one thread and with several.
+
+    python benchmark_pool.py --calls 20000 --threads 8
+"""
+
+import os
+import time
+import sqlite3
+import argparse
+import tempfile
+import threading
+
+from connection_pool import ConnectionPool
+
+
+def setup_database(path, rows=1000):
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE users (id INTEGER PRIMARY KEY, name TEXT, email TEXT)')
+    conn.executemany(
+        'INSERT INTO users (name, email) VALUES (?, ?)',
+        ((f'user{i}', f'user{i}@example.com') for i in range(rows)),
+    )
+    conn.commit()
+    conn.close()
+
+
+def connect_per_call(path):
+    def lookup(user_id):
+        conn = sqlite3.connect(path)
+        try:
+            return conn.execute('SELECT * FROM users WHERE id = ?', (user_id,)).fetchone()
+        finally:
+            conn.close()
+    return lookup
+
+
+def pooled(pool):
+    def lookup(user_id):
+        with pool.connection() as conn:
+            return conn.execute('SELECT * FROM users WHERE id = ?', (user_id,)).fetchone()
+    return lookup
+
+
+def run(lookup, calls, threads):
+    """Return the wall time of `calls` lookups spread over `threads` threads."""
+    per_thread = calls // threads
+
+    def work(offset):
+        for i in range(per_thread):
+            lookup((offset + i) % 1000 + 1)
+
+    workers = [threading.Thread(target=work, args=(t * per_thread,)) for t in range(threads)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return time.perf_counter() - started, per_thread * threads
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--calls', type=int, default=20000)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--max-size', type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'users.db')
+        setup_database(path)
+        pool = ConnectionPool(path, min_size=1, max_size=args.max_size)
+
+        print(f"{'variant':<20} {'threads':>7} {'calls/s':>10} {'us/call':>9}")
+        for threads in sorted({1, args.threads}):
+            for name, lookup in (
+                ('connect per call', connect_per_call(path)),
+                ('pooled', pooled(pool)),
+            ):
+                lookup(1)  # warm up
+                elapsed, calls = run(lookup, args.calls, threads)
+                print(
+                    f'{name:<20} {threads:>7} {calls / elapsed:>10.0f} '
+                    f'{elapsed / calls * 1e6:>9.1f}'
+                )
+        print('pool:', pool.stats())
+        pool.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""Write throughput under lock contention: fixed-delay retries against backoff.
+
+Many threads update a throwaway database at once. Connections use
+``timeout=0``, so a writer that finds the database locked gets
+"database is locked" at once and the retry policy decides what happens:
+
+* fixed: the old ``retry_on_failure``, sleeping `delay` after any error;
+* backoff: `retry.retry_on_failure`, full-jitter exponential backoff
+  from the same `delay` up to `max_delay`;
+* backoff+budget: the same with a `RetryBudget`, which stops retrying
+  once retries outnumber a tenth of the successes.
+
+    python benchmark_retry.py --writers 32 --writes 50
+"""
+
+import os
+import time
+import sqlite3
+import argparse
+import tempfile
+import functools
+import threading
+
+from retry import RetryBudget, retry_on_failure
+
+
+def fixed_retry(retries=3, delay=2):
+    """The previous decorator: any exception, constant delay."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            last_exception = None
+            for attempt in range(retries):
+                try:
+                    return func(*args, **kwargs)
+                except Exception as e:
+                    last_exception = e
+                    if attempt < retries - 1:
+                        time.sleep(delay)
+            raise last_exception
+        return wrapper
+    return decorator
+
+
+def setup_database(path, rows=100):
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('CREATE TABLE users (id INTEGER PRIMARY KEY, name TEXT, email TEXT)')
+    conn.executemany(
+        'INSERT INTO users (name, email) VALUES (?, ?)',
+        ((f'user{i}', f'user{i}@example.com') for i in range(rows)),
+    )
+    conn.commit()
+    conn.close()
+
+
+def run(path, policy, writers, writes, hold):
+    attempts = [0]
+    lock = threading.Lock()
+
+    @policy
+    def update_email(conn, user_id, email):
+        with lock:
+            attempts[0] += 1
+        conn.execute('BEGIN IMMEDIATE')
+        conn.execute('UPDATE users SET email = ? WHERE id = ?', (email, user_id))
+        # Work done while holding the write lock
+        time.sleep(hold)
+        conn.execute('COMMIT')
+
+    committed, failed = [0] * writers, [0] * writers
+    start = threading.Barrier(writers + 1)
+
+    def writer(n):
+        conn = sqlite3.connect(path, timeout=0, isolation_level=None)
+        start.wait()
+        for i in range(writes):
+            try:
+                update_email(conn, (n * writes + i) % 100 + 1, f'w{n}-{i}@example.com')
+                committed[n] += 1
+            except sqlite3.OperationalError:
+                failed[n] += 1
+                if conn.in_transaction:
+                    conn.rollback()
+        conn.close()
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(writers)]
+    for thread in threads:
+        thread.start()
+    start.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    return sum(committed), sum(failed), attempts[0], elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--writers', type=int, default=32)
+    parser.add_argument('--writes', type=int, default=50)
+    parser.add_argument('--retries', type=int, default=20)
+    parser.add_argument('--delay', type=float, default=0.005)
+    parser.add_argument('--max-delay', type=float, default=0.5)
+    parser.add_argument('--hold', type=float, default=0.0005)
+    args = parser.parse_args()
+
+    policies = (
+        ('fixed', fixed_retry(args.retries, args.delay)),
+        ('backoff', retry_on_failure(args.retries, args.delay, args.max_delay)),
+        ('backoff+budget', retry_on_failure(
+            args.retries, args.delay, args.max_delay, budget=RetryBudget()
+        )),
+    )
+    print(f"{'policy':<16} {'writes/s':>9} {'committed':>10} {'failed':>7} {'attempts':>9}")
+    for name, policy in policies:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'users.db')
+            setup_database(path)
+            committed, failed, attempts, elapsed = run(
+                path, policy, args.writers, args.writes, args.hold
+            )
+        print(
+            f'{name:<16} {committed / elapsed:>9.0f} {committed:>10} '
+            f'{failed:>7} {attempts:>9}'
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,241 @@
+"""A thread-safe pool of sqlite3 connections.
+
+Opening a connection (file open, schema read, page cache warm-up) costs
+more than a small query, so the helpers check connections out of a pool
+instead of calling ``sqlite3.connect`` on every call:
+
+    with get_pool('users.db').connection() as conn:
+        conn.execute(...)
+
+A checked out connection belongs to its caller until the ``with`` block
+ends. It is then checked for liveness: an open transaction is rolled back
+(the same outcome as closing it) and a connection that fails a trivial
+query, or was closed by the caller, is thrown away instead of reused.
+"""
+
+import os
+import time
+import atexit
+import sqlite3
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+
+class PoolTimeout(Exception):
+    """No connection became available within the checkout timeout."""
+
+
+class PoolClosed(Exception):
+    """The pool was closed."""
+
+
+class _Waiter:
+    def __init__(self, ident, cond):
+        self.ident = ident
+        self.cond = cond
+        self.conn = None
+
+
+class ConnectionPool:
+    """Keep between `min_size` and `max_size` connections to `database`.
+
+    Checkouts wait up to `timeout` seconds for a connection once
+    `max_size` are in use, then raise `PoolTimeout`; waiting callers are
+    served first come, first served. Idle connections are handed back to
+    the thread that last used them when possible, which keeps its statement
+    cache warm. Connections are opened with
+    ``check_same_thread=False`` since the pool guarantees that only one
+    thread uses them at a time; if the sqlite3 module is built
+    single-threaded (``sqlite3.threadsafety == 0``) a connection never
+    leaves the thread that opened it.
+    """
+
+    def __init__(self, database, min_size=1, max_size=5, timeout=5.0, **connect_kwargs):
+        if not 0 <= min_size <= max_size or max_size < 1:
+            raise ValueError('Need 0 <= min_size <= max_size and max_size >= 1')
+        self.database = database
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.connect_kwargs = dict(connect_kwargs, check_same_thread=False)
+        self.thread_bound = sqlite3.threadsafety == 0
+        self._lock = threading.Lock()
+        self._waiters = deque()
+        # Idle connections as (connection, owner thread id), most recent last
+        self._idle = []
+        self._owners = {}
+        self._size = 0
+        self._closed = False
+        self.metrics = {
+            'created': 0,
+            'closed': 0,
+            'checkouts': 0,
+            'same_thread': 0,
+            'waits': 0,
+            'wait_seconds': 0.0,
+            'timeouts': 0,
+            'discarded': 0,
+            'peak_in_use': 0,
+        }
+        with self._lock:
+            for _ in range(min_size):
+                self._idle.append((self._connect(), threading.get_ident()))
+
+    def _connect(self):
+        # Called with the lock held: the connection counts towards the size
+        conn = sqlite3.connect(self.database, **self.connect_kwargs)
+        self._size += 1
+        self.metrics['created'] += 1
+        return conn
+
+    def _discard(self, conn):
+        self._size -= 1
+        self.metrics['closed'] += 1
+        self._owners.pop(id(conn), None)
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    def _take_idle(self, ident):
+        for i in range(len(self._idle) - 1, -1, -1):
+            if self._idle[i][1] == ident:
+                self.metrics['same_thread'] += 1
+                return self._idle.pop(i)[0]
+        if self._idle and not self.thread_bound:
+            return self._idle.pop()[0]
+        return None
+
+    def acquire(self, timeout=None):
+        """Check out a connection; pair every call with `release`."""
+        timeout = self.timeout if timeout is None else timeout
+        ident = threading.get_ident()
+        with self._lock:
+            if self._closed:
+                raise PoolClosed(self.database)
+            conn = None
+            # Queued callers come first, or a busy thread could starve them
+            if not self._waiters:
+                conn = self._take_idle(ident)
+                if conn is None and self._size >= self.max_size and self._idle:
+                    # Only other threads' connections are idle; replace one
+                    self._discard(self._idle.pop(0)[0])
+                if conn is None and self._size < self.max_size:
+                    conn = self._connect()
+            if conn is None:
+                conn = self._wait(ident, timeout)
+            self.metrics['checkouts'] += 1
+            self._owners[id(conn)] = ident
+            in_use = self._size - len(self._idle)
+            self.metrics['peak_in_use'] = max(self.metrics['peak_in_use'], in_use)
+            return conn
+
+    def _wait(self, ident, timeout):
+        # Called with the lock held; `release` hands the connection over
+        waiter = _Waiter(ident, threading.Condition(self._lock))
+        self._waiters.append(waiter)
+        self.metrics['waits'] += 1
+        started = time.monotonic()
+        deadline = started + timeout
+        try:
+            while waiter.conn is None:
+                if self._closed:
+                    raise PoolClosed(self.database)
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.metrics['timeouts'] += 1
+                    raise PoolTimeout(
+                        f'No connection to {self.database} free after {timeout}s'
+                    )
+                waiter.cond.wait(remaining)
+        finally:
+            if waiter.conn is None:
+                self._waiters.remove(waiter)
+            self.metrics['wait_seconds'] += time.monotonic() - started
+        return waiter.conn
+
+    def _is_reusable(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            # Helpers install per-call hooks; do not let them leak to the next caller
+            conn.set_trace_callback(None)
+            conn.execute('SELECT 1').fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def release(self, conn):
+        """Return a connection checked out with `acquire`."""
+        reusable = self._is_reusable(conn)
+        with self._lock:
+            ident = self._owners.pop(id(conn), threading.get_ident())
+            if not reusable or self._closed:
+                if not reusable:
+                    self.metrics['discarded'] += 1
+                self._discard(conn)
+                conn = None
+            if self._closed:
+                # close() woke the waiters up to fail
+                return
+            if not self._waiters:
+                if conn is not None:
+                    self._idle.append((conn, ident))
+                return
+            waiter = self._waiters.popleft()
+            if conn is not None and self.thread_bound and waiter.ident != ident:
+                self._discard(conn)
+                conn = None
+            if conn is None:
+                conn = self._connect()
+            waiter.conn = conn
+            waiter.cond.notify()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        conn = self.acquire(timeout)
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def stats(self):
+        with self._lock:
+            return dict(
+                self.metrics,
+                size=self._size,
+                idle=len(self._idle),
+                in_use=self._size - len(self._idle),
+            )
+
+    def close(self):
+        """Close the idle connections now and the others when they come back."""
+        with self._lock:
+            self._closed = True
+            while self._idle:
+                self._discard(self._idle.pop()[0])
+            for waiter in self._waiters:
+                waiter.cond.notify()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(database, **kwargs):
+    """Return the process-wide pool for `database`, creating it with `kwargs`."""
+    key = database if database == ':memory:' else os.path.abspath(database)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None or pool._closed:
+            pool = _pools[key] = ConnectionPool(database, **kwargs)
+        return pool
+
+
+@atexit.register
+def close_pools():
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
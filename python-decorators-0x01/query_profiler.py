@@ -0,0 +1,320 @@
+"""Low-overhead SQL query profiling.
+
+Queries are grouped by fingerprint (the SQL with literals replaced by
+``?`` and whitespace collapsed), and each fingerprint keeps a call count,
+a row count and a latency histogram. Queries taking longer than
+``slow_threshold`` seconds are logged to the ``query_profiler`` logger.
+
+There are three ways to feed a profiler:
+
+* ``@profiler.profile`` (or ``log_queries``) times a function, sync or
+  async, that receives the SQL as ``query=...`` or as a positional string.
+* ``with profiler.query(sql) as q: ...; q.rows = n`` times any block.
+* ``sqlite3.connect(path, factory=ProfiledConnection)`` (also accepted by
+  ``aiosqlite.connect``) times every statement run on the connection,
+  from ``execute`` until its rows are fetched.
+
+A disabled profiler costs a method call and an attribute check. With
+``sample_rate`` below 1 only that share of calls is recorded (and
+checked against the slow threshold); the report scales the counts back up.
+"""
+
+import re
+import json
+import time
+import random
+import logging
+import inspect
+import sqlite3
+import bisect
+import functools
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger('query_profiler')
+
+# Upper bounds of the latency buckets: 10us, 20us, 40us ... about 84s
+BUCKETS = tuple(1e-5 * 2 ** i for i in range(24))
+
+_LITERAL_RE = re.compile(
+    r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?(?:[eE][-+]?\d+)?\b|\bx'[0-9a-fA-F]*'",
+)
+_IN_LIST_RE = re.compile(r'\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)', re.IGNORECASE)
+_SPACE_RE = re.compile(r'\s+')
+_SQL_START_RE = re.compile(
+    r'\s*(SELECT|INSERT|UPDATE|DELETE|REPLACE|WITH|CREATE|DROP|ALTER|PRAGMA)\b',
+    re.IGNORECASE,
+)
+
+
+@functools.lru_cache(maxsize=4096)
+def fingerprint(sql):
+    """Return `sql` with literals as ``?``, ``IN (...)`` lists folded and spaces collapsed."""
+    sql = _LITERAL_RE.sub('?', sql)
+    sql = _IN_LIST_RE.sub('IN (...)', sql)
+    return _SPACE_RE.sub(' ', sql).strip().rstrip(';').rstrip()
+
+
+class QueryStats:
+    """Counters and latency histogram of one fingerprint."""
+
+    __slots__ = ('calls', 'rows', 'total', 'max', 'slow', 'histogram')
+
+    def __init__(self):
+        self.calls = 0
+        self.rows = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.slow = 0
+        self.histogram = [0] * (len(BUCKETS) + 1)
+
+    def percentile(self, fraction):
+        """Upper bound of the bucket holding the `fraction` quantile, in seconds."""
+        rank = fraction * self.calls
+        seen = 0
+        for i, count in enumerate(self.histogram):
+            seen += count
+            if count and seen >= rank:
+                return min(BUCKETS[i], self.max) if i < len(BUCKETS) else self.max
+        return 0.0
+
+
+class QueryProfiler:
+    """Collect per-fingerprint statistics; thread safe."""
+
+    def __init__(self, enabled=True, sample_rate=1.0, slow_threshold=0.1):
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def sampled(self):
+        """Whether to record the next query; False whenever disabled."""
+        if not self.enabled:
+            return False
+        return self.sample_rate >= 1.0 or random.random() < self.sample_rate
+
+    def record(self, sql, seconds, rows=0):
+        key = fingerprint(sql)
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = QueryStats()
+            stats.calls += 1
+            stats.rows += rows
+            stats.total += seconds
+            if seconds > stats.max:
+                stats.max = seconds
+            stats.histogram[bisect.bisect_left(BUCKETS, seconds)] += 1
+            slow = seconds >= self.slow_threshold
+            if slow:
+                stats.slow += 1
+        if slow:
+            logger.warning('Slow query (%.1f ms, %d rows): %s', seconds * 1000, rows, sql)
+        elif logger.isEnabledFor(logging.DEBUG):
+            logger.debug('Query (%.3f ms, %d rows): %s', seconds * 1000, rows, sql)
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+    @contextmanager
+    def query(self, sql):
+        """Time the block as one execution of `sql`; set ``.rows`` on the result."""
+        if not self.sampled():
+            yield _NullTiming
+            return
+        timing = _Timing()
+        started = time.perf_counter()
+        try:
+            yield timing
+        finally:
+            self.record(sql, time.perf_counter() - started, timing.rows)
+
+    def profile(self, func):
+        """Decorate a function taking its SQL as ``query=`` or a positional string."""
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if not self.sampled():
+                    return await func(*args, **kwargs)
+                started = time.perf_counter()
+                result = await func(*args, **kwargs)
+                self._record_call(args, kwargs, time.perf_counter() - started, result)
+                return result
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not self.sampled():
+                return func(*args, **kwargs)
+            started = time.perf_counter()
+            result = func(*args, **kwargs)
+            self._record_call(args, kwargs, time.perf_counter() - started, result)
+            return result
+        return wrapper
+
+    def _record_call(self, args, kwargs, seconds, result):
+        sql = kwargs.get('query')
+        if not isinstance(sql, str):
+            sql = next(
+                (a for a in args if isinstance(a, str) and _SQL_START_RE.match(a)), None
+            )
+        if sql is None:
+            return
+        rows = len(result) if isinstance(result, (list, tuple)) else 0
+        self.record(sql, seconds, rows)
+
+    def snapshot(self):
+        """Return the statistics as a list of dicts, most total time first."""
+        scale = 1 / self.sample_rate if 0 < self.sample_rate < 1 else 1
+        result = []
+        with self._lock:
+            for key, stats in sorted(self._stats.items(), key=lambda item: -item[1].total):
+                result.append({
+                    'fingerprint': key,
+                    'calls': stats.calls,
+                    'estimated_calls': round(stats.calls * scale),
+                    'rows': stats.rows,
+                    'slow': stats.slow,
+                    'total_ms': round(stats.total * 1000, 3),
+                    'mean_ms': round(stats.total / stats.calls * 1000, 3),
+                    'p50_ms': round(stats.percentile(0.50) * 1000, 3),
+                    'p95_ms': round(stats.percentile(0.95) * 1000, 3),
+                    'p99_ms': round(stats.percentile(0.99) * 1000, 3),
+                    'max_ms': round(stats.max * 1000, 3),
+                    'histogram': {
+                        (f'{BUCKETS[i] * 1000:g}ms' if i < len(BUCKETS) else 'inf'): count
+                        for i, count in enumerate(stats.histogram) if count
+                    },
+                })
+        return result
+
+    def report(self, format='text', limit=None):
+        """Return the statistics as a text table or a JSON document."""
+        rows = self.snapshot()[:limit]
+        if format == 'json':
+            return json.dumps(
+                {'sample_rate': self.sample_rate, 'queries': rows}, indent=2
+            )
+        lines = [
+            f"{'calls':>8} {'rows':>8} {'total ms':>10} {'mean ms':>9} "
+            f"{'p95 ms':>9} {'max ms':>9} {'slow':>5}  query"
+        ]
+        for r in rows:
+            lines.append(
+                f"{r['estimated_calls']:>8} {r['rows']:>8} {r['total_ms']:>10.2f} "
+                f"{r['mean_ms']:>9.3f} {r['p95_ms']:>9.3f} {r['max_ms']:>9.3f} "
+                f"{r['slow']:>5}  {r['fingerprint'][:80]}"
+            )
+        return '\n'.join(lines)
+
+
+class _Timing:
+    __slots__ = ('rows',)
+
+    def __init__(self):
+        self.rows = 0
+
+
+# Stands in for a `_Timing` when the query is not sampled
+_NullTiming = _Timing()
+
+
+profiler = QueryProfiler()
+
+
+class ProfiledCursor(sqlite3.Cursor):
+    """Cursor recording each statement in its connection's profiler.
+
+    A SELECT is timed from ``execute`` until ``fetchall``, a short
+    ``fetchmany``/``fetchone`` result, the next ``execute`` or ``close``.
+    Rows read by iterating the cursor are not counted.
+    """
+
+    _pending = None
+
+    def execute(self, sql, parameters=()):
+        if self._pending is not None:
+            self._finish()
+        if not self.connection.profiler.sampled():
+            return super().execute(sql, parameters)
+        started = time.perf_counter()
+        # A statement that raises is not recorded
+        super().execute(sql, parameters)
+        self._pending = [sql, time.perf_counter() - started, 0]
+        if self.description is None:
+            self._finish(max(self.rowcount, 0))
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        if self._pending is not None:
+            self._finish()
+        profiler = self.connection.profiler
+        if not profiler.sampled():
+            return super().executemany(sql, seq_of_parameters)
+        started = time.perf_counter()
+        super().executemany(sql, seq_of_parameters)
+        profiler.record(sql, time.perf_counter() - started, max(self.rowcount, 0))
+        return self
+
+    def _fetch(self, fetch, *args):
+        started = time.perf_counter()
+        result = fetch(*args)
+        self._pending[1] += time.perf_counter() - started
+        return result
+
+    def fetchone(self):
+        if self._pending is None:
+            return super().fetchone()
+        row = self._fetch(super().fetchone)
+        if row is None:
+            self._finish()
+        else:
+            self._pending[2] += 1
+        return row
+
+    def fetchmany(self, size=None):
+        if self._pending is None:
+            return super().fetchmany(self.arraysize if size is None else size)
+        size = self.arraysize if size is None else size
+        rows = self._fetch(super().fetchmany, size)
+        self._pending[2] += len(rows)
+        if len(rows) < size:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        if self._pending is None:
+            return super().fetchall()
+        rows = self._fetch(super().fetchall)
+        self._pending[2] += len(rows)
+        self._finish()
+        return rows
+
+    def close(self):
+        if self._pending is not None:
+            self._finish()
+        super().close()
+
+    def _finish(self, extra_rows=0):
+        sql, seconds, rows = self._pending
+        self._pending = None
+        self.connection.profiler.record(sql, seconds, rows + extra_rows)
+
+
+class ProfiledConnection(sqlite3.Connection):
+    """Connection whose cursors are `ProfiledCursor`s feeding `profiler`."""
+
+    profiler = profiler
+
+    def cursor(self, factory=ProfiledCursor):
+        return super().cursor(factory)
+
+    # The built-in shortcuts create plain cursors
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
@@ -0,0 +1,254 @@
+"""Retrying database calls that failed for a transient reason.
+
+`retry_on_failure` retries a call, sync or async, when its exception is
+transient according to `retry_if` (by default `is_transient`: SQLite's
+"database is locked"/busy conditions). Permanent errors, such as a syntax
+error or a constraint violation, are raised at once.
+
+Retries are spaced by exponential backoff with full jitter: attempt ``n``
+sleeps a random time between 0 and ``min(max_delay, delay * 2**n)``, so
+writers that collided do not all come back at the same moment and
+collide again.
+
+Two opt-in guards keep retries from adding to an overload; share one
+instance between decorators to make it process-wide (`default_budget` is
+such an instance):
+
+* `RetryBudget`: every retry spends a token, every success earns back a
+  fraction of one, and retrying stops while fewer than half the tokens
+  are left.
+* `CircuitBreaker`: after `failure_threshold` transient failures
+  in a row, calls fail fast with `CircuitOpen` for `reset_timeout` seconds;
+  then one trial call decides whether to close the circuit again.
+"""
+
+import time
+import random
+import asyncio
+import logging
+import inspect
+import sqlite3
+import functools
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Primary result codes; extended codes keep them in their low byte
+SQLITE_BUSY = 5
+SQLITE_LOCKED = 6
+_TRANSIENT_MESSAGES = ('database is locked', 'database table is locked', 'database is busy')
+
+
+def is_transient(exc):
+    """Whether `exc` is a SQLite lock/busy condition worth retrying."""
+    if not isinstance(exc, sqlite3.OperationalError):
+        return False
+    code = getattr(exc, 'sqlite_errorcode', None)
+    if code is not None:
+        return code & 0xFF in (SQLITE_BUSY, SQLITE_LOCKED)
+    message = str(exc).lower()
+    return any(text in message for text in _TRANSIENT_MESSAGES)
+
+
+class RetryBudget:
+    """Token bucket limiting retries to a share of successful calls.
+
+    Starts with `max_tokens`; a retry costs one token and a success gives
+    back `token_ratio`. Retries are refused while the bucket is at or
+    below half full, which caps sustained retries at about `token_ratio`
+    per success.
+    """
+
+    def __init__(self, max_tokens=100, token_ratio=0.1):
+        self.max_tokens = max_tokens
+        self.token_ratio = token_ratio
+        self._tokens = float(max_tokens)
+        self._lock = threading.Lock()
+        self.refused = 0
+
+    def can_retry(self):
+        with self._lock:
+            if self._tokens <= self.max_tokens / 2:
+                self.refused += 1
+                return False
+            self._tokens -= 1
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._tokens = min(self.max_tokens, self._tokens + self.token_ratio)
+
+    @property
+    def tokens(self):
+        return self._tokens
+
+
+class CircuitOpen(Exception):
+    """The circuit breaker is open; the call was not attempted."""
+
+
+class CircuitBreaker:
+    """Stop calling after repeated failures and probe again after a pause."""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return 'closed'
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                return 'half-open'
+            return 'open'
+
+    def before_call(self):
+        """Raise `CircuitOpen` unless a call may go ahead."""
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if time.monotonic() - self._opened_at < self.reset_timeout or self._probing:
+                raise CircuitOpen(f'Circuit open after {self._failures} failures')
+            # Half open: let this one call through as a probe
+            self._probing = True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._probing = False
+
+
+default_budget = RetryBudget()
+
+
+def backoff_delay(attempt, delay, max_delay):
+    """Full-jitter exponential backoff for retry number `attempt` (from 0)."""
+    return random.uniform(0, min(max_delay, delay * 2 ** attempt))
+
+
+def _rollback_connections(args):
+    # A failed attempt may leave a transaction open on the connection it was
+    # given; the next attempt must start from a clean state
+    for arg in args:
+        if isinstance(arg, sqlite3.Connection) and arg.in_transaction:
+            arg.rollback()
+
+
+async def _arollback_connections(args):
+    # The same for aiosqlite connections, whose rollback is a coroutine
+    for arg in args:
+        rollback = getattr(arg, 'rollback', None)
+        if inspect.iscoroutinefunction(rollback) and arg.in_transaction:
+            await rollback()
+        elif isinstance(arg, sqlite3.Connection) and arg.in_transaction:
+            arg.rollback()
+
+
+class _Retrier:
+    """The retry loop's state, shared by the sync and async wrappers."""
+
+    def __init__(self, func, retries, delay, max_delay, retry_if, budget, breaker):
+        self.name = func.__qualname__
+        self.retries = retries
+        self.delay = delay
+        self.max_delay = max_delay
+        self.retry_if = retry_if
+        self.budget = budget
+        self.breaker = breaker
+
+    def before(self):
+        if self.breaker is not None:
+            self.breaker.before_call()
+
+    def succeeded(self):
+        if self.budget is not None:
+            self.budget.record_success()
+        if self.breaker is not None:
+            self.breaker.record_success()
+
+    def failed(self, exc, attempt, args):
+        """Return the seconds to wait before retrying, or re-raise `exc`."""
+        transient = self.retry_if(exc)
+        if self.breaker is not None:
+            # A permanent error still means the database answered
+            if transient:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+        if (
+            not transient
+            or attempt >= self.retries - 1
+            or (self.budget is not None and not self.budget.can_retry())
+        ):
+            raise exc
+        wait = backoff_delay(attempt, self.delay, self.max_delay)
+        logger.info(
+            'Attempt %d of %s failed: %s. Retrying in %.3fs',
+            attempt + 1, self.name, exc, wait,
+        )
+        return wait
+
+
+# Retry on failure decorator
+def retry_on_failure(retries=3, delay=2, max_delay=1.0, retry_if=is_transient,
+                     budget=None, breaker=None):
+    """Make up to `retries` attempts, backing off from `delay` seconds.
+
+    No wait is longer than `max_delay` seconds: SQLite locks are held for
+    milliseconds, so longer sleeps only cost throughput. Works on functions
+    and coroutine functions (aiosqlite). `budget` is an optional
+    `RetryBudget` (e.g. `default_budget`) and `breaker` an optional
+    `CircuitBreaker`.
+    """
+
+    def decorator(func):
+        retrier = _Retrier(func, retries, delay, max_delay, retry_if, budget, breaker)
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                attempt = 0
+                while True:
+                    retrier.before()
+                    try:
+                        result = await func(*args, **kwargs)
+                    except Exception as e:
+                        wait = retrier.failed(e, attempt, args)
+                        await _arollback_connections(args)
+                        await asyncio.sleep(wait)
+                        attempt += 1
+                        continue
+                    retrier.succeeded()
+                    return result
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            attempt = 0
+            while True:
+                retrier.before()
+                try:
+                    result = func(*args, **kwargs)
+                except Exception as e:
+                    wait = retrier.failed(e, attempt, args)
+                    _rollback_connections(args)
+                    time.sleep(wait)
+                    attempt += 1
+                    continue
+                retrier.succeeded()
+                return result
+        return wrapper
+    return decorator
@@ -0,0 +1,231 @@
+"""The `transactional` decorator, with savepoints and an opt-in group commit.
+
+By default a decorated call commits when it returns and rolls back when it
+raises. A call made while another `transactional` call is already running
+on the same connection (nesting) runs in a SAVEPOINT instead: its failure
+rolls back only its own changes, and only the outermost call commits.
+
+Committing is the expensive part of a small write: every COMMIT waits for
+the journal to reach the disk. With ``@transactional(group=GroupCommit(...))``
+calls share commits instead:
+
+* each call runs in its own SAVEPOINT inside the group's open transaction,
+  so a failing call is rolled back alone and its exception reported at once;
+* a group call made from inside another one runs in a SAVEPOINT of the
+  outer call; its Future is resolved at once and it is durable when the
+  outer call's is;
+* the transaction is committed when `max_batch` calls are pending or
+  `max_delay` seconds after the first of them, whichever comes first;
+* the call returns a `concurrent.futures.Future` that is resolved with its
+  return value only once that COMMIT succeeded, i.e. once the write is
+  durable. If the COMMIT fails, every pending future gets the error.
+"""
+
+import time
+import sqlite3
+import functools
+import threading
+from concurrent.futures import Future
+
+_local = threading.local()
+
+
+def _depths():
+    # Per thread: id(connection) -> number of transactional calls running on it
+    depths = getattr(_local, 'depths', None)
+    if depths is None:
+        depths = _local.depths = {}
+    return depths
+
+
+def _run_in_savepoint(conn, name, func, args, kwargs):
+    """Run `func` in SAVEPOINT `name`, rolled back to it if `func` raises."""
+    conn.execute(f'SAVEPOINT {name}')
+    try:
+        result = func(conn, *args, **kwargs)
+    except BaseException:
+        conn.execute(f'ROLLBACK TO {name}')
+        conn.execute(f'RELEASE {name}')
+        raise
+    conn.execute(f'RELEASE {name}')
+    return result
+
+
+def _run(conn, func, args, kwargs):
+    """Run `func` as a transaction, or as a savepoint when nested."""
+    depths = _depths()
+    key = id(conn)
+    depth = depths.get(key, 0)
+    depths[key] = depth + 1
+    try:
+        if depth:
+            if not conn.in_transaction:
+                # Releasing a savepoint that opened the transaction would
+                # commit it; nest it in a real transaction instead
+                conn.execute('BEGIN')
+            return _run_in_savepoint(conn, f'transactional_{depth}', func, args, kwargs)
+        try:
+            result = func(conn, *args, **kwargs)
+            conn.commit()  # Commit if no exception
+            return result
+        except Exception:
+            conn.rollback()  # Rollback on error
+            raise  # Re-raise the exception
+    finally:
+        if depth:
+            depths[key] = depth
+        else:
+            del depths[key]
+
+
+class GroupCommit:
+    """Share COMMITs between the calls of `transactional(group=...)` functions.
+
+    Owns one connection to `database` (SQLite has a single writer anyway);
+    calls from any thread take turns on it. A group call made from inside
+    another one on the same thread (nesting) runs as a savepoint of the
+    outer call and is committed with it. Call `close` (or use it as a
+    context manager) to commit what is pending and stop the flusher thread.
+    """
+
+    def __init__(self, database, max_batch=100, max_delay=0.001, **connect_kwargs):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.conn = sqlite3.connect(
+            database, isolation_level=None, check_same_thread=False, **connect_kwargs
+        )
+        # Held while the connection is in use: by a call, or by a COMMIT.
+        # Always taken before `_lock`, which only guards the fields below
+        # and is never held while user code runs.
+        self._conn_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._due = threading.Condition(self._lock)
+        # (future, result) of the calls waiting for the next COMMIT
+        self._pending = []
+        self._deadline = None
+        self._closed = False
+        self.commits = 0
+        self.calls = 0
+        self._flusher = threading.Thread(target=self._flush_when_due, daemon=True)
+        self._flusher.start()
+
+    def submit(self, func, *args, **kwargs):
+        """Run ``func(conn, *args, **kwargs)`` now; return a Future resolved on COMMIT."""
+        future = Future()
+        if _depths().get(id(self.conn)):
+            # Nested in a call of this group on this thread, which already
+            # holds the connection: a savepoint of it, durable with it
+            try:
+                future.set_result(_run(self.conn, func, args, kwargs))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+
+        with self._conn_lock:
+            with self._lock:
+                if self._closed:
+                    raise RuntimeError('GroupCommit is closed')
+            if not self.conn.in_transaction:
+                self.conn.execute('BEGIN')
+            depths = _depths()
+            depths[id(self.conn)] = 1
+            try:
+                result = _run_in_savepoint(self.conn, 'group_commit', func, args, kwargs)
+            except Exception as e:
+                # Rolled back to the savepoint; the other calls are unaffected
+                future.set_exception(e)
+                return future
+            finally:
+                del depths[id(self.conn)]
+            with self._lock:
+                self.calls += 1
+                self._pending.append((future, result))
+                full = len(self._pending) >= self.max_batch
+                if not full and self._deadline is None:
+                    self._deadline = time.monotonic() + self.max_delay
+                    self._due.notify()
+            if full:
+                self._commit()
+        return future
+
+    def _commit(self):
+        # Called with the connection lock held
+        with self._lock:
+            pending, self._pending, self._deadline = self._pending, [], None
+        try:
+            if self.conn.in_transaction:
+                self.conn.execute('COMMIT')
+        except Exception as e:
+            if self.conn.in_transaction:
+                self.conn.execute('ROLLBACK')
+            for future, result in pending:
+                future.set_exception(e)
+            return
+        with self._lock:
+            self.commits += 1
+        for future, result in pending:
+            future.set_result(result)
+
+    def _flush_when_due(self):
+        while True:
+            with self._lock:
+                while not self._closed:
+                    if self._deadline is None:
+                        self._due.wait()
+                        continue
+                    remaining = self._deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._due.wait(remaining)
+                if self._closed:
+                    return
+            with self._conn_lock:
+                self._commit()
+
+    def flush(self):
+        """Commit the pending calls now."""
+        with self._conn_lock:
+            self._commit()
+
+    def close(self):
+        with self._conn_lock:
+            with self._lock:
+                if self._closed:
+                    return
+            self._commit()
+            with self._lock:
+                self._closed = True
+                self._due.notify()
+        self._flusher.join()
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+
+# Transactional decorator
+def transactional(func=None, *, group=None):
+    """Commit `func(conn, ...)` when it returns, roll it back when it raises.
+
+    Nested calls on the same connection become savepoints. With a
+    `GroupCommit` as `group`, the function is called without a connection
+    (the group supplies its own) and returns a Future; see the module
+    docstring.
+    """
+    if func is None:
+        return functools.partial(transactional, group=group)
+
+    if group is not None:
+        @functools.wraps(func)
+        def group_wrapper(*args, **kwargs):
+            return group.submit(func, *args, **kwargs)
+        return group_wrapper
+
+    @functools.wraps(func)
+    def wrapper(conn, *args, **kwargs):
+        return _run(conn, func, args, kwargs)
+    return wrapper